@@ -0,0 +1,411 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Export the layers of the Shiny map as simplified TopoJSON, one file per
+zoom level, with the deliveries and the key races already joined:
+
+    shiny/map_z6.topojson   objects `districts` (CD116), `states` and
+                            `deliveries` (one point per delivery site)
+
+Boundaries are simplified without breaking the topology: the rings of a
+layer are cut into arcs where three or more boundaries meet, each arc is
+stored once however many polygons share it, and is simplified once
+(Douglas-Peucker, to one pixel at the zoom level), so neighbouring
+polygons keep a common edge with neither gaps nor overlaps. Coordinates
+are quantized to a quarter of a pixel and delta-encoded.
+
+The key races are read from script/2018-elections-results.R so that the
+flags stay those of the R scripts. In shiny/global.R, the app reads the
+file with sf::st_read(file, layer = "districts").
+
+$ python script/export_map.py -zooms 4 6 8
+"""
+
+import argparse
+import json
+import logging
+import os
+import re
+import sys
+import time
+import numpy as np
+import pandas as pd
+sys.path.append(os.getcwd() + "/script")
+from manifest import Manifest
+sys.path.append(os.getcwd() + "/script/scrape_tweets")
+import districts
+from shapefile import read_shapefile
+
+log = logging.getLogger(__name__)
+
+# layers of the map, within the directory of shp files
+layers = {"districts": districts.cd_shapefile,
+          "states": "cb_2018_us_state_500k/cb_2018_us_state_500k.shp"}
+
+# popup fields of the races, as in shiny/server.R
+race_fields = ("candidate1", "party1", "share1", "candidate2", "party2", "share2")
+
+
+def pixel_degrees(zoom):
+    """
+    Return the width of a pixel in degrees of longitude at a web map `zoom`.
+    """
+    return 360. / (256 * 2 ** zoom)
+
+
+def douglas_peucker(points, tolerance, force = False):
+    """
+    Return the indices of the `points` (an (n, 2) array) kept by the
+    Douglas-Peucker simplification to `tolerance`, always including the
+    first and last. A closed line is first split at its point farthest
+    from the start.
+    ---
+    force (bool, keep the farthest point of each first split even if it
+           is within `tolerance`, so that a ring keeps an area)
+    """
+    n = len(points)
+    keep = np.zeros(n, dtype = bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1, force)]
+    if n > 3 and (points[0] == points[-1]).all():
+        far = int(np.argmax(((points - points[0]) ** 2).sum(axis = 1)))
+        keep[far] = True
+        stack = [(0, far, force), (far, n - 1, force)]
+    while stack:
+        i, j, forced = stack.pop()
+        if j <= i + 1:
+            continue
+        a, b = points[i], points[j]
+        inner = points[i + 1:j]
+        dx, dy = b - a
+        length = np.hypot(dx, dy)
+        if length == 0:
+            distance = np.hypot(*(inner - a).T)
+        else:
+            distance = np.abs(dx * (inner[:, 1] - a[1]) - dy * (inner[:, 0] - a[0])) / length
+        k = int(np.argmax(distance))
+        if forced or distance[k] > tolerance:
+            keep[i + 1 + k] = True
+            stack.append((i, i + 1 + k, False))
+            stack.append((i + 1 + k, j, False))
+    return np.flatnonzero(keep)
+
+
+class Topology(object):
+    """
+    The rings of a shapefile.Geometry as shared arcs: `points` are the
+    distinct vertices, `arcs` arrays of point ids, and ring k the list of
+    arcs `rings[k]`, where ~a stands for arc a reversed. Rings are
+    oriented counterclockwise for outer rings and clockwise for holes,
+    as in GeoJSON.
+    """
+
+    def __init__(self, geometry):
+        coords = np.ascontiguousarray(geometry.coords, dtype = np.float64)
+        keys = coords.view([("x", np.float64), ("y", np.float64)]).ravel()
+        _, first, ids = np.unique(keys, return_index = True, return_inverse = True)
+        self.points = coords[first]
+        self.parts = np.asarray(geometry.parts)
+        starts, stops = np.asarray(geometry.rings[:-1]), np.asarray(geometry.rings[1:])
+
+        # rings as point ids, without the vertex closing them
+        rings = []
+        for start, stop in zip(starts.tolist(), stops.tolist()):
+            ring = ids[start:stop]
+            if len(ring) > 1 and ring[0] == ring[-1]:
+                ring = ring[:-1]
+            # outer rings are clockwise in shapefiles: reverse every ring
+            rings.append(ring[::-1])
+
+        # junctions: points joined to three or more distinct neighbours
+        if rings:
+            a = np.concatenate(rings)
+            b = np.concatenate([np.roll(ring, -1) for ring in rings])
+            pairs = np.unique(np.minimum(a, b) * len(self.points) + np.maximum(a, b))
+            degree = np.bincount(np.concatenate([pairs // len(self.points), pairs % len(self.points)]),
+                                 minlength = len(self.points))
+        else:
+            degree = np.zeros(len(self.points), dtype = np.int64)
+        junction = degree >= 3
+
+        self.arcs = []
+        self.rings = []
+        known = {}
+        for ring in rings:
+            if len(ring) < 3:
+                self.rings.append([])
+                continue
+            cuts = np.flatnonzero(junction[ring])
+            if len(cuts):
+                ring = np.roll(ring, -cuts[0])
+                cuts = np.append(cuts - cuts[0], len(ring))
+                pieces = [ring[i:j + 1] if j < len(ring) else np.append(ring[i:], ring[0])
+                          for i, j in zip(cuts[:-1], cuts[1:])]
+            else:
+                # a ring meeting no other boundary is one closed arc, from its lowest point
+                ring = np.roll(ring, -int(np.argmin(ring)))
+                pieces = [np.append(ring, ring[0])]
+            refs = []
+            for piece in pieces:
+                key = piece.tobytes()
+                if key in known:
+                    refs.append(known[key])
+                    continue
+                reverse = piece[::-1].tobytes()
+                if reverse in known:
+                    refs.append(~known[reverse])
+                    continue
+                known[key] = len(self.arcs)
+                refs.append(len(self.arcs))
+                self.arcs.append(piece)
+            self.rings.append(refs)
+
+    def simplify(self, tolerance):
+        """
+        Return the points of each arc kept at `tolerance` (arrays of
+        indices into the arc). Arcs of rings that would lose their area
+        keep their farthest points.
+        """
+        kept = [douglas_peucker(self.points[arc], tolerance) for arc in self.arcs]
+        for ring in self.rings:
+            if ring and sum(len(kept[a if a >= 0 else ~a]) - 1 for a in ring) < 3:
+                for a in ring:
+                    a = a if a >= 0 else ~a
+                    kept[a] = douglas_peucker(self.points[self.arcs[a]], tolerance, force = True)
+        return kept
+
+    def polygons(self, shape):
+        """
+        Return the rings (lists of arc references) of `shape` grouped into
+        polygons: each outer ring followed by its holes.
+        """
+        polygons = []
+        for k in range(self.parts[shape], self.parts[shape + 1]):
+            if not self.rings[k]:
+                continue
+            if self.area(k) > 0 or not polygons:
+                polygons.append([self.rings[k]])
+            else:
+                polygons[-1].append(self.rings[k])
+        return polygons
+
+    def area(self, k):
+        """
+        Return the signed area of ring k, positive if counterclockwise.
+        """
+        ids = np.concatenate([self.arcs[a][:-1] if a >= 0 else self.arcs[~a][::-1][:-1]
+                              for a in self.rings[k]])
+        x, y = self.points[ids].T
+        return (x * np.roll(y, -1) - np.roll(x, -1) * y).sum() / 2
+
+
+def encode_arcs(topology, kept, scale, translate):
+    """
+    Return the arcs quantized to `scale` from `translate` and delta-encoded,
+    as in TopoJSON.
+    """
+    arcs = []
+    for arc, keep in zip(topology.arcs, kept):
+        q = np.round((topology.points[arc[keep]] - translate) / scale).astype(np.int64)
+        moved = np.append(True, (np.diff(q, axis = 0) != 0).any(axis = 1))
+        moved[-1] = True
+        q = q[moved]
+        arcs.append(np.vstack([q[:1], np.diff(q, axis = 0)]).tolist())
+    return arcs
+
+
+def shape_geometry(topology, shape, offset):
+    """
+    Return the TopoJSON geometry of `shape`, its arc references shifted by
+    `offset` (the arcs of earlier layers).
+    """
+    shift = lambda a: a + offset if a >= 0 else ~(~a + offset)
+    polygons = [[[shift(a) for a in ring] for ring in polygon]
+                for polygon in topology.polygons(shape)]
+    if not polygons:
+        return {"type": None}
+    if len(polygons) == 1:
+        return {"type": "Polygon", "arcs": polygons[0]}
+    return {"type": "MultiPolygon", "arcs": polygons}
+
+
+def read_keys(path):
+    """
+    Return {name: set of races} of the `<name>_key <- c(...)` vectors of
+    the R script at `path`.
+    """
+    with open(path) as f:
+        text = f.read()
+    return {name: set(re.findall(r'"([^"]+)"', values))
+            for name, values in re.findall(r'(\w+_key) <- c\(([^)]*)\)', text)}
+
+
+def records(df):
+    """
+    Return {index: properties} of a DataFrame, with null for missing values.
+    """
+    df = df.astype(object).where(df.notna(), None)
+    return {index: row for index, row in zip(df.index, df.to_dict("records"))}
+
+
+def layer_properties(args, labels, tables, tweets, keys):
+    """
+    Return {layer: list of properties of each shape} for the `labels`
+    (districts) and `tables` (states) read from the shapefiles.
+    """
+    properties = {}
+    if "districts" in labels:
+        house = pd.read_csv(os.path.join(args.csvdir, "house_elections_2018.csv"),
+                            index_col = 0).set_index("district")
+        races = records(house[list(race_fields)])
+        counts = tweets['district'].value_counts() if 'district' in tweets else {}
+        properties["districts"] = [
+            dict({"district": label, "deliveries": int(counts.get(label, 0)),
+                  "key": label in keys.get("house_key", ())},
+                 **races.get(label, dict.fromkeys(race_fields)))
+            for label in labels["districts"]]
+    if "states" in tables:
+        states = {}
+        for name, race, office in (("senate_elections_2018.csv", "senate_key", "sen"),
+                                   ("gubernatorial_elections_2018.csv", "governor_key", "gov")):
+            df = pd.read_csv(os.path.join(args.csvdir, name), index_col = 0)
+            df = df.rename(columns = {"percentage1": "share1", "percentage2": "share2"})
+            states[office] = (records(df[list(race_fields)]), keys.get(race, ()))
+        counts = tweets['state_abbv'].value_counts()
+        properties["states"] = []
+        for abbv, name in zip(tables["states"].column("STUSPS").tolist(),
+                              tables["states"].column("NAME").tolist()):
+            row = {"state": abbv, "name": name, "deliveries": int(counts.get(abbv, 0))}
+            for office, (races, key) in states.items():
+                row["key_" + office] = abbv in key
+                for field, value in races.get(abbv, dict.fromkeys(race_fields)).items():
+                    row["{}_{}".format(field, office)] = value
+            properties["states"].append(row)
+    return properties
+
+
+def export(args, zoom, topologies, properties, locations):
+    """
+    Write the TopoJSON file of `zoom` and return its path.
+    """
+    tolerance = pixel_degrees(zoom)
+    scale = tolerance / 4
+    points = [t.points for t in topologies.values()] + [locations[["lng", "lat"]].to_numpy()]
+    translate = np.concatenate(points).min(axis = 0)
+    objects, arcs = {}, []
+    for layer, topology in topologies.items():
+        offset = len(arcs)
+        arcs += encode_arcs(topology, topology.simplify(tolerance), scale, translate)
+        geometries = []
+        for shape, props in enumerate(properties[layer]):
+            geometry = shape_geometry(topology, shape, offset)
+            geometry["properties"] = props
+            geometries.append(geometry)
+        objects[layer] = {"type": "GeometryCollection", "geometries": geometries}
+    q = np.round((locations[["lng", "lat"]].to_numpy() - translate) / scale).astype(np.int64)
+    sites = locations.drop(columns = ["lat", "lng"]).to_dict("records")
+    objects["deliveries"] = {"type": "GeometryCollection", "geometries": [
+        {"type": "Point", "coordinates": xy, "properties": dict(props, deliveries = int(props['deliveries']))}
+        for xy, props in zip(q.tolist(), sites)]}
+    topology = {"type": "Topology",
+                "transform": {"scale": [scale, scale], "translate": translate.tolist()},
+                "objects": objects,
+                "arcs": arcs}
+    path = os.path.join(args.outdir, "map_z{}.topojson".format(zoom))
+    tmp = path + ".part"
+    with open(tmp, "w") as f:
+        json.dump(topology, f, separators = (",", ":"))
+    os.replace(tmp, path)
+    return path
+
+
+
+if __name__ == "__main__":
+
+    logger = logging.getLogger()
+    logger.setLevel(logging.INFO)
+    handler = logging.StreamHandler()
+    handler.setLevel(logging.INFO)
+    logger.addHandler(handler)
+
+    parser = argparse.ArgumentParser(description = 'Export the layers of the Shiny map as TopoJSON')
+    parser.add_argument('-shpdir', type = str,
+                        help = "Directory storing shp files",
+                        default = "data/shp")
+    parser.add_argument('-csvdir', type = str,
+                        help = "Directory storing csv files",
+                        default = "data/csv")
+    parser.add_argument('-races', type = str,
+                        help = "R script defining the key races",
+                        default = "script/2018-elections-results.R")
+    parser.add_argument('-outdir', type = str,
+                        help = "Directory of the Shiny app",
+                        default = "shiny")
+    parser.add_argument('-zooms', type = int, nargs = "+",
+                        help = "Zoom levels to export",
+                        default = [4, 6, 8])
+    parser.add_argument('-manifest', type = str,
+                        help = 'Manifest of built files; nothing is rebuilt if no input or code changed',
+                        default = 'data/manifest.json')
+    parser.add_argument('-force',
+                        help = 'Rebuild even if up to date',
+                        action = "store_true")
+    args = parser.parse_args()
+
+    """ STEP 1: inputs and outputs """
+    shps = {layer: os.path.join(args.shpdir, path) for layer, path in layers.items()}
+    for layer, path in list(shps.items()):
+        if not os.path.exists(path):
+            log.warning("{} does not exist; no {} layer".format(path, layer))
+            del shps[layer]
+    csv_path = os.path.join(args.csvdir, "PizzaToThePolls.csv")
+    sites_path = os.path.join(args.csvdir, "PizzaToThePolls_sites.csv")
+    inputs = ([csv_path, args.races] +
+              ([sites_path] if os.path.exists(sites_path) else []) +
+              [os.path.join(args.csvdir, name) for name in
+               ("house_elections_2018.csv", "senate_elections_2018.csv",
+                "gubernatorial_elections_2018.csv")] +
+              [path for shp in shps.values()
+               for path in (shp, os.path.splitext(shp)[0] + ".dbf")])
+    outputs = [os.path.join(args.outdir, "map_z{}.topojson".format(zoom)) for zoom in args.zooms]
+    manifest = Manifest(args.manifest, "export_map", sources = [__file__, read_shapefile, districts],
+                        force = args.force)
+    if all(manifest.fresh(path, inputs) for path in outputs):
+        print("{} are up to date".format(", ".join(outputs)))
+        sys.exit()
+
+    """ STEP 2: deliveries by district, state and location """
+    tweets = pd.read_csv(csv_path)
+    if 'district' not in tweets:
+        tweets = districts.add_districts(tweets, args.shpdir)
+    # one point per delivery site of sites.py, else per distinct coordinates
+    if os.path.exists(sites_path):
+        locations = (pd.read_csv(sites_path, usecols = ["site_id", "count", "lat", "lng"])
+                     .rename(columns = {"count": "deliveries"}))
+    else:
+        locations = (tweets.dropna(subset = ["lat", "lng"])
+                     .groupby(["lat", "lng"]).size().rename("deliveries").reset_index())
+
+    """ STEP 3: topology of each layer """
+    topologies, labels, tables = {}, {}, {}
+    for layer, shp in shps.items():
+        start = time.perf_counter()
+        table, geometry = read_shapefile(shp)
+        topologies[layer] = Topology(geometry)
+        tables[layer] = table
+        if layer == "districts":
+            labels[layer] = districts.district_labels(table)
+        log.info("{}: {} shapes, {} vertices, {} arcs ({:.2f} s)".format(
+            layer, len(geometry), len(geometry.coords), len(topologies[layer].arcs),
+            time.perf_counter() - start))
+    properties = layer_properties(args, labels, tables, tweets, read_keys(args.races))
+
+    """ STEP 4: one file per zoom level """
+    for zoom in args.zooms:
+        start = time.perf_counter()
+        path = export(args, zoom, topologies, properties, locations)
+        manifest.record(path, inputs)
+        print("{}: {:,} bytes ({:.2f} s)".format(path, os.path.getsize(path),
+                                                 time.perf_counter() - start))
+    manifest.save()
+    sys.exit()
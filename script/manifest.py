@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Manifest of the outputs built by the scripts in scrape_tweets/,
+scrape_wiki/ and women/, so that a rerun only rebuilds what changed.
+
+For every output, the manifest keeps the size, mtime and content hash of
+each input it was built from, and the code version of the stage (a hash of
+the stage's source files and of the options that change its output).
+An output is up to date while it exists and neither its inputs nor the
+code have changed. Inputs whose mtime moved but whose content is the same
+(e.g. a page downloaded again) still count as unchanged, so outputs
+downstream of them are not rebuilt either.
+
+$ python script/manifest.py                  # list stages and outputs
+$ python script/manifest.py -stage 04_convert_to_csv -forget
+"""
+
+import argparse
+import hashlib
+import inspect
+import json
+import os
+import sys
+import threading
+
+default_path = "data/manifest.json"
+
+
+def file_hash(path, block = 1 << 20):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(block), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def code_version(sources, params = None):
+    """
+    Hash of the source files and options of a stage. `sources` are paths,
+    or modules, classes and functions standing for the file defining them.
+    """
+    h = hashlib.sha1()
+    for source in sources:
+        path = source if isinstance(source, str) else inspect.getsourcefile(source)
+        with open(path, "rb") as f:
+            h.update(f.read())
+    h.update(json.dumps(params, sort_keys = True, default = str).encode("utf-8"))
+    return h.hexdigest()
+
+
+class Manifest(object):
+    """
+    The entries of one stage in the manifest file at `path`.
+    ---
+    stage (str, name of the stage, e.g. '02_clean_and_find_address')
+    sources (list of paths, modules, classes or functions whose code the
+             outputs depend on)
+    params (dict of options that change the outputs)
+    force (bool, treat every output as out of date)
+    """
+
+    def __init__(self, path, stage, sources = (), params = None, force = False):
+        self.path = path
+        self.stage = stage
+        self.code = code_version(sources, params)
+        self.force = force
+        self.entries = load(path).get(stage, {})
+        self.fresh_count = self.built_count = 0
+        self.lock = threading.Lock()
+
+    def stat(self, path, known = None):
+        """
+        Return {'size', 'mtime', 'sha1'} of the file at `path`, reusing the
+        hash of the `known` record when size and mtime are the same.
+        """
+        st = os.stat(path)
+        record = {"size": st.st_size, "mtime": st.st_mtime_ns}
+        if (known is not None and known.get("size") == record["size"] and
+                known.get("mtime") == record["mtime"]):
+            record["sha1"] = known["sha1"]
+        else:
+            record["sha1"] = file_hash(path)
+        return record
+
+    def fresh(self, output, inputs):
+        """
+        Return True if `output` was built from the current content of the
+        `inputs` (list of paths) by the current code.
+        """
+        entry = self.entries.get(output)
+        up_to_date = (not self.force and entry is not None and
+                      entry["code"] == self.code and
+                      os.path.exists(output) and
+                      sorted(entry["inputs"]) == sorted(inputs))
+        if up_to_date:
+            stats = {}
+            for path in inputs:
+                known = entry["inputs"][path]
+                if not os.path.exists(path):
+                    return False
+                stats[path] = self.stat(path, known)
+                if stats[path]["sha1"] != known["sha1"]:
+                    return False
+            with self.lock:
+                # remember new mtimes of unchanged content to skip hashing next time
+                entry["inputs"].update(stats)
+                self.fresh_count += 1
+        return up_to_date
+
+    def record(self, output, inputs):
+        """
+        Record that `output` was just built from `inputs`.
+        """
+        old = self.entries.get(output, {}).get("inputs", {})
+        entry = {"code": self.code,
+                 "inputs": {path: self.stat(path, old.get(path)) for path in inputs}}
+        with self.lock:
+            self.entries[output] = entry
+            self.built_count += 1
+
+    def forget(self):
+        """
+        Drop every entry of the stage, so that all outputs are rebuilt.
+        """
+        with self.lock:
+            self.entries = {}
+
+    def save(self):
+        """
+        Write the entries of the stage, keeping those of other stages.
+        """
+        with self.lock:
+            data = load(self.path)
+            data[self.stage] = self.entries
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok = True)
+            tmp = self.path + ".part"
+            with open(tmp, "w") as j:
+                json.dump(data, j, indent = 1, sort_keys = True)
+            os.replace(tmp, self.path)
+
+    def summary(self):
+        return "{}: {} outputs up to date, {} rebuilt".format(
+            self.stage, self.fresh_count, self.built_count)
+
+
+def load(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as j:
+        return json.load(j)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description = 'Inspect the rebuild manifest')
+    parser.add_argument('-manifest', type = str,
+                        help = 'Manifest file',
+                        default = default_path)
+    parser.add_argument('-stage', type = str,
+                        help = 'Only show this stage',
+                        default = None)
+    parser.add_argument('-forget',
+                        help = 'Drop the entries of -stage so that it is rebuilt',
+                        action = "store_true")
+    args = parser.parse_args()
+
+    data = load(args.manifest)
+    if args.forget:
+        if args.stage is None:
+            sys.exit("-forget needs -stage")
+        manifest = Manifest(args.manifest, args.stage)
+        manifest.forget()
+        manifest.save()
+        print("Forgot {} outputs of {}".format(len(data.get(args.stage, {})), args.stage))
+        sys.exit()
+    for stage in sorted(data):
+        if args.stage is not None and stage != args.stage:
+            continue
+        entries = data[stage]
+        inputs = sum(len(e["inputs"]) for e in entries.values())
+        print("{}: {} outputs from {} inputs".format(stage, len(entries), inputs))
+    sys.exit()
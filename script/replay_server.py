@@ -0,0 +1,490 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Local stand-in for the services the scrapers call, replaying the
+responses recorded by earlier runs, so that the scrapers can be run,
+load-tested and profiled offline.
+
+    Twitter search    /oauth2/token, /1.1/tweets/search/fullarchive/<env>.json
+                      and <env>/counts.json, from the raw pages in -rawdir
+    Google Geocoding  /maps/api/geocode/{xml,json}, from the geocode cache
+                      and the geocoded tweets of -script03dir
+    Wikipedia         /wiki/<title> and /w/index.php?title=<title>, from the
+                      pages saved in -wikidir/*/<state>-wikipage.html
+
+Latency, errors and rate limits are configurable per run. Requests over a
+service's limit are answered as the service does: HTTP 429 with an
+'x-rate-limit-reset' header from Twitter and Wikipedia, and
+OVER_QUERY_LIMIT from the Geocoding API.
+
+$ python script/replay_server.py -port 8080 -latency 0.2 -errorrate 0.01
+$ python script/scrape_tweets/01_scrape_twitter.py -twitterurl http://127.0.0.1:8080
+$ python script/scrape_tweets/03_parse_address.py -geocodeurl http://127.0.0.1:8080
+$ python script/scrape_wiki/01_scrape_gov_senate_pages.py -wikiurl http://127.0.0.1:8080
+"""
+
+import argparse
+import datetime
+import glob
+import json
+import logging
+import os
+import random
+import re
+import signal
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+sys.path.append(os.getcwd() + "/script/scrape_tweets")
+import raw_archive
+from address_parser import build_response, parse_response, status_response
+from address_query import address_query
+from geocode_cache import GeocodeCache, normalize_query
+from tweet_reader import iter_tweets
+
+log = logging.getLogger(__name__)
+
+# format of Twitter's `created_at`
+created_at_format = "%a %b %d %H:%M:%S %z %Y"
+page_pattern = re.compile(r"^search_resp(\d{12})-(\d{12})-(\d+)\.json(?:\.gz)?$")
+next_pattern = re.compile(rb'"next"\s*:\s*"([^"]+)"')
+
+
+class Behavior(object):
+    """
+    Latency, errors and rate limits of the replayed services.
+    ---
+    latency (float, seconds added to every response)
+    jitter (float, up to this many more seconds, uniformly drawn)
+    errorrate (float, share of requests answered with HTTP 503)
+    limits ({service: requests allowed per `window`, 0 for no limit})
+    window (float, seconds of a rate limit window)
+    """
+
+    def __init__(self, latency = 0., jitter = 0., errorrate = 0., limits = None,
+                 window = 60., seed = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.errorrate = errorrate
+        self.limits = limits or {}
+        self.window = window
+        self.rng = random.Random(seed)
+        self.windows = {} # service -> [start of window, requests in window]
+        self.lock = threading.Lock()
+
+    def delay(self):
+        with self.lock:
+            extra = self.rng.uniform(0, self.jitter) if self.jitter else 0.
+        if self.latency + extra > 0:
+            time.sleep(self.latency + extra)
+
+    def error(self):
+        with self.lock:
+            return self.errorrate > 0 and self.rng.random() < self.errorrate
+
+    def limited(self, service):
+        """
+        Count a request to `service`. Returns the time (epoch seconds) the
+        window resets if the request is over the limit, else None.
+        """
+        limit = self.limits.get(service, 0)
+        if not limit:
+            return None
+        now = time.time()
+        with self.lock:
+            window = self.windows.setdefault(service, [now, 0])
+            if now - window[0] >= self.window:
+                window[:] = [now, 0]
+            window[1] += 1
+            if window[1] > limit:
+                return window[0] + self.window
+        return None
+
+
+class TwitterReplay(object):
+    """
+    Search pages and counts replayed from the raw pages saved in `rawdir`.
+    Pages of a recorded time slice are replayed as they were sent, the
+    'next' token of each page leading to the following page. Other slices
+    (e.g. the minutes of a busy hour split by bucket_planner.py, or a slice
+    with pages missing from `rawdir`) are answered with the recorded tweets
+    posted in the slice, newest first, `maxResults` at a time.
+    """
+
+    def __init__(self, rawdir):
+        self.rawdir = rawdir
+        self.pages = {} # (fromDate, toDate) -> {page: path}
+        self.tokens = {} # 'next' token -> page it leads to
+        self.created = None # sorted 'YYYYMMDDHHMM' of every tweet, read on first use
+        self.tweets = None # ('YYYYMMDDHHMM', tweet) newest first, read on first use
+        self.lock = threading.Lock()
+        for file in sorted(os.listdir(rawdir)):
+            m = page_pattern.match(file)
+            if m is None:
+                continue
+            path = os.path.join(rawdir, file)
+            self.pages.setdefault((m.group(1), m.group(2)), {})[int(m.group(3))] = path
+            found = next_pattern.findall(raw_archive.read_page(path)[-4096:])
+            if found:
+                self.tokens[found[-1].decode("utf-8")] = int(m.group(3)) + 1
+        # slices replayed as recorded, from the first page on
+        self.complete = set(key for key, pages in self.pages.items()
+                            if sorted(pages) == list(range(len(pages))))
+
+    def __len__(self):
+        return sum(len(pages) for pages in self.pages.values())
+
+    def search(self, params):
+        """
+        Return (HTTP status, body) of the search page asked by `params`.
+        """
+        key = (params.get('fromDate'), params.get('toDate'))
+        if key not in self.complete or params.get('next', '').startswith("replay-"):
+            return self.select(params)
+        page = 0
+        if params.get('next'):
+            if params['next'] not in self.tokens:
+                return 400, json.dumps({"error": {"message": "Invalid 'next' token"}}).encode()
+            page = self.tokens[params['next']]
+        if page not in self.pages[key]:
+            return 404, json.dumps({"error": {"message": "Page not recorded"}}).encode()
+        return 200, raw_archive.read_page(self.pages[key][page])
+
+    def select(self, params):
+        """
+        Return (HTTP status, body) of a page of the recorded tweets posted
+        between 'fromDate' and 'toDate', for slices that were not recorded.
+        """
+        with self.lock:
+            if self.tweets is None:
+                self.tweets = sorted(
+                    ((datetime.datetime.strptime(tweet['created_at'], created_at_format)
+                      .strftime("%Y%m%d%H%M"), tweet)
+                     for pages in self.pages.values() for path in pages.values()
+                     for tweet in iter_tweets(path)),
+                    key = lambda x: (x[0], x[1]['id']), reverse = True)
+        fromDate, toDate = params.get('fromDate', ''), params.get('toDate', '9' * 12)
+        size = int(params.get('maxResults') or 500)
+        offset = int(params['next'].rsplit("-", 1)[1]) if params.get('next') else 0
+        selected = [tweet for minute, tweet in self.tweets if fromDate <= minute < toDate]
+        body = {"results": selected[offset:offset + size],
+                "requestParameters": {k: v for k, v in params.items() if k != 'next'}}
+        if offset + size < len(selected):
+            body["next"] = "replay-{}-{}-{}".format(fromDate, toDate, offset + size)
+        return 200, json.dumps(body).encode("utf-8")
+
+    def counts(self, params):
+        """
+        Return (HTTP status, body) of the counts asked by `params`, counted
+        over every recorded tweet.
+        """
+        with self.lock:
+            if self.created is None:
+                self.created = sorted(
+                    datetime.datetime.strptime(tweet['created_at'], created_at_format)
+                    .strftime("%Y%m%d%H%M")
+                    for pages in self.pages.values() for path in pages.values()
+                    for tweet in iter_tweets(path))
+        width = {"minute": 12, "hour": 10, "day": 8}.get(params.get('bucket', 'day'), 8)
+        fromDate, toDate = params.get('fromDate', ''), params.get('toDate', '9' * 12)
+        counts = {}
+        for minute in self.created:
+            if fromDate <= minute < toDate:
+                bucket = minute[:width].ljust(12, "0")
+                counts[bucket] = counts.get(bucket, 0) + 1
+        results = [{"timePeriod": bucket, "count": n} for bucket, n in sorted(counts.items())]
+        return 200, json.dumps({"results": results,
+                                "totalCount": sum(counts.values()),
+                                "requestParameters": params}).encode("utf-8")
+
+
+class GeocodeReplay(object):
+    """
+    Geocoding responses replayed from the responses recorded in the geocode
+    cache at `cache` and from the geocoded tweets of `script03dir`, keyed by
+    normalized query. Queries never geocoded are answered ZERO_RESULTS.
+    """
+
+    def __init__(self, cache = None, script03dir = None):
+        self.responses = {} # normalized query -> recorded response
+        self.addresses = {} # normalized query -> address parsed from a tweet
+        if cache is not None and os.path.exists(cache):
+            db = GeocodeCache(cache)
+            self.responses = {query: response for query, response in db.responses()
+                              if response is not None}
+            db.close()
+        if script03dir is not None and os.path.isdir(script03dir):
+            for file in sorted(os.listdir(script03dir)):
+                for tweet in iter_tweets(os.path.join(script03dir, file)):
+                    query = address_query(tweet.get('clean_text') or "")
+                    if query is not None and tweet.get('full') is not None:
+                        self.addresses.setdefault(normalize_query(query), tweet)
+
+    def __len__(self):
+        return len(set(self.responses) | set(self.addresses))
+
+    def geocode(self, query, fmt = "xml"):
+        """
+        Return the body of the `fmt` endpoint's response to `query`.
+        """
+        key = normalize_query(query or "")
+        response = self.responses.get(key)
+        if response is not None:
+            recorded = "xml" if response.lstrip().startswith(b"<") else "json"
+            if recorded == fmt:
+                return response
+            return build_response(parse_response(response, recorded), fmt)
+        return build_response(self.addresses.get(key), fmt)
+
+
+class WikiReplay(object):
+    """
+    Wikipedia pages replayed from the html saved in `wikidir`/<office>/,
+    keyed by the page title recorded in "<state>-wikilink.json". The
+    election pages listing the states are rebuilt as lists of links to the
+    saved pages.
+    """
+
+    # title of the page listing the races of each office
+    lists = {"governor": "2018_United_States_gubernatorial_elections",
+             "senate": "2018_United_States_Senate_elections",
+             "house": "2018_United_States_House_of_Representatives_elections"}
+
+    def __init__(self, wikidir):
+        self.pages = {} # title -> path of the saved html
+        self.links = {} # title of a list page -> [(href, title)]
+        for office, list_title in self.lists.items():
+            for link in sorted(glob.glob(os.path.join(wikidir, office, "*-wikilink.json"))):
+                html = link.replace("-wikilink.json", "-wikipage.html")
+                with open(link) as h:
+                    url = h.read().strip()
+                title = self.title(url)
+                if title is None or not os.path.exists(html):
+                    continue
+                self.pages[title] = html
+                href = url[url.index("/w"):] if "/w" in url else url
+                self.links.setdefault(list_title, []).append((href, title.replace("_", " ")))
+
+    def __len__(self):
+        return len(self.pages)
+
+    @staticmethod
+    def title(url):
+        """
+        Return the page title of a "/wiki/<title>" or
+        "/w/index.php?title=<title>" url, with underscores for spaces.
+        """
+        parts = urlsplit(url)
+        path = re.sub("/+", "/", parts.path)
+        if path.startswith("/wiki/"):
+            title = unquote(path[len("/wiki/"):])
+        elif path == "/w/index.php":
+            title = parse_qs(parts.query).get('title', [None])[0]
+        else:
+            return None
+        return title.replace(" ", "_") if title else None
+
+    def page(self, url):
+        """
+        Return (HTTP status, html) of the page at `url`.
+        """
+        title = self.title(url)
+        if title in self.pages:
+            with open(self.pages[title], "rb") as h:
+                return 200, h.read()
+        if title in self.links:
+            items = "".join('<li><a href="{}" title="{}">{}</a></li>'.format(href, t, t)
+                            for href, t in self.links[title])
+            return 200, "<html><body><ul>{}</ul></body></html>".format(items).encode("utf-8")
+        return 404, b"<html><body>Page not recorded</body></html>"
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    """
+    Route requests to the replays of the server. Runs one thread per request.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        log.debug(format % args)
+
+    def send(self, status, body, content_type = "application/json", headers = None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.count(self.service, status)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            self.rfile.read(length)
+        self.do_GET()
+
+    def do_GET(self):
+        replay = self.server
+        parts = urlsplit(self.path)
+        params = {k: v[-1] for k, v in parse_qs(parts.query).items()}
+        path = re.sub("/+", "/", parts.path)
+        if path.startswith("/oauth2/") or path.startswith("/1.1/"):
+            self.service = "twitter"
+        elif path.startswith("/maps/api/geocode/"):
+            self.service = "geocode"
+        elif path.startswith("/wiki/") or path.startswith("/w/"):
+            self.service = "wiki"
+        else:
+            self.service = None
+            return self.send(404, b'{"error": "unknown endpoint"}')
+
+        replay.behavior.delay()
+        if replay.behavior.error():
+            return self.send(503, b'{"error": "service unavailable"}')
+        reset = replay.behavior.limited(self.service)
+
+        if self.service == "geocode":
+            fmt = "json" if path.endswith("/json") else "xml"
+            content_type = "application/json" if fmt == "json" else "application/xml"
+            if reset is not None:
+                return self.send(200, status_response("OVER_QUERY_LIMIT", fmt), content_type)
+            return self.send(200, replay.geocode.geocode(params.get('address'), fmt), content_type)
+
+        if reset is not None:
+            return self.send(429, b'{"errors": [{"message": "Rate limit exceeded"}]}',
+                             headers = {"x-rate-limit-reset": str(int(reset) + 1)})
+        if self.service == "twitter":
+            if path == "/oauth2/token":
+                return self.send(200, b'{"token_type": "bearer", "access_token": "replay"}')
+            if path.endswith("/counts.json"):
+                return self.send(*replay.twitter.counts(params))
+            return self.send(*replay.twitter.search(params))
+        status, html = replay.wiki.page(self.path)
+        return self.send(status, html, "text/html; charset=utf-8")
+
+
+class ReplayServer(ThreadingHTTPServer):
+    """
+    HTTP server of the replays, counting the responses sent by service
+    and status.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, twitter, geocode, wiki, behavior):
+        super().__init__(address, ReplayHandler)
+        self.twitter = twitter
+        self.geocode = geocode
+        self.wiki = wiki
+        self.behavior = behavior
+        self.counts = {} # (service, status) -> responses
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return "http://{}:{}".format(host, port)
+
+    def count(self, service, status):
+        with self.lock:
+            self.counts[(service, status)] = self.counts.get((service, status), 0) + 1
+
+    def summary(self):
+        with self.lock:
+            items = sorted(self.counts.items(), key = lambda x: (str(x[0][0]), x[0][1]))
+        if not items:
+            return "no requests"
+        return ", ".join("{} {}: {}".format(service, status, n)
+                         for (service, status), n in items)
+
+
+def start_server(server):
+    """
+    Serve `server` from a daemon thread, e.g. in a benchmark. Returns the thread.
+    """
+    thread = threading.Thread(target = server.serve_forever, daemon = True)
+    thread.start()
+    return thread
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description = 'Replay recorded Twitter, Geocoding and Wikipedia responses')
+    parser.add_argument('-host', type = str,
+                        help = 'Address to listen on',
+                        default = '127.0.0.1')
+    parser.add_argument('-port', type = int,
+                        help = 'Port to listen on',
+                        default = 8080)
+    parser.add_argument('-rawdir', type = str,
+                        help = 'Directory storing raw search pages (plain or gzip compressed)',
+                        default = 'data/tweets/raw')
+    parser.add_argument('-cache', type = str,
+                        help = 'SQLite file of the geocode cache with recorded responses',
+                        default = 'data/tweets/geocode_cache.sqlite')
+    parser.add_argument('-script03dir', type = str,
+                        help = 'Directory storing outputs from 03_parse_address.py, replayed for queries not in -cache',
+                        default = 'data/tweets/03_parsed')
+    parser.add_argument('-wikidir', type = str,
+                        help = 'Directory storing the Wikipedia pages saved by scrape_wiki/',
+                        default = 'data/raw_wiki')
+    parser.add_argument('-latency', type = float,
+                        help = 'Seconds added to every response',
+                        default = 0.)
+    parser.add_argument('-jitter', type = float,
+                        help = 'Up to this many more seconds added to every response',
+                        default = 0.)
+    parser.add_argument('-errorrate', type = float,
+                        help = 'Share of requests answered with HTTP 503',
+                        default = 0.)
+    parser.add_argument('-twitterlimit', type = int,
+                        help = 'Twitter requests allowed per -window (full-archive limit is 60 a minute; 0 for no limit)',
+                        default = 60)
+    parser.add_argument('-geocodelimit', type = int,
+                        help = 'Geocoding requests allowed per -window (0 for no limit)',
+                        default = 3000)
+    parser.add_argument('-wikilimit', type = int,
+                        help = 'Wikipedia requests allowed per -window (0 for no limit)',
+                        default = 0)
+    parser.add_argument('-window', type = float,
+                        help = 'Seconds of a rate limit window',
+                        default = 60.)
+    parser.add_argument('-seed', type = int,
+                        help = 'Seed of the latency and error draws',
+                        default = None)
+    parser.add_argument('-v','--verbose',
+                        help = "Set log level to debug", action = "store_true")
+    args = parser.parse_args()
+
+    log.setLevel(logging.INFO)
+    if args.verbose:
+        log.setLevel(logging.DEBUG)
+    loghandler = logging.StreamHandler(sys.stderr)
+    loghandler.setFormatter(logging.Formatter("[%(asctime)s] %(message)s"))
+    log.addHandler(loghandler)
+
+    behavior = Behavior(latency = args.latency, jitter = args.jitter,
+                        errorrate = args.errorrate,
+                        limits = {"twitter": args.twitterlimit,
+                                  "geocode": args.geocodelimit,
+                                  "wiki": args.wikilimit},
+                        window = args.window, seed = args.seed)
+    twitter = TwitterReplay(args.rawdir)
+    geocode = GeocodeReplay(args.cache, args.script03dir)
+    wiki = WikiReplay(args.wikidir)
+    server = ReplayServer((args.host, args.port), twitter, geocode, wiki, behavior)
+    log.info("Replaying {} search pages, {} geocodes and {} Wikipedia pages at {}".format(
+        len(twitter), len(geocode), len(wiki), server.url))
+    # stop on SIGTERM as on Ctrl-C, printing the summary
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+    log.info(server.summary())
+    sys.exit()
@@ -6,11 +6,17 @@ import argparse
 import json
 import os
 import sys
-import base64
-import requests
 import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
 load_dotenv()
+sys.path.append(os.getcwd() + "/script/scrape_tweets")
+from throttle import TokenBucket
+from checkpoint import Journal
+from bucket_planner import plan_slices
+import raw_archive
+from tweet_index import TweetIndex
+from twitter_search import SearchClient, api_url
 
 # set up parser 
 parser = argparse.ArgumentParser(description='Scrape twitter')
@@ -18,11 +24,29 @@ parser.add_argument('-credentials', type = str,
                     help = "Directory storing credential json files.",
                     default = "script/credentials")
 parser.add_argument('-rawdir', type = str,
-                    help = 'Directory to store raw JSON responses',
+                    help = 'Directory to store raw JSON responses (gzip compressed)',
                     default = 'data/raw')                    
 parser.add_argument('-script01dir', type = str,
                     help = 'Direcotry to store 01_scrape_twitter.py output files', 
                     default = 'data/script01')
+parser.add_argument('-workers', type = int,
+                    help = 'Number of time slices to scrape concurrently',
+                    default = 4)
+parser.add_argument('-ratelimit', type = int,
+                    help = 'Search requests allowed per minute (full-archive limit is 60)',
+                    default = 60)
+parser.add_argument('-pagesize', type = int,
+                    help = 'Results per search page; busier hours are split into slices of about one page',
+                    default = 500)
+parser.add_argument('-index', type = str,
+                    help = 'SQLite index from tweet id to raw file, updated as pages are saved',
+                    default = 'data/tweets/tweet_index.sqlite')
+parser.add_argument('-journal', type = str,
+                    help = 'Checkpoint journal of saved pages, used to resume an interrupted scrape',
+                    default = 'data/scrape_journal.jsonl')
+parser.add_argument('-twitterurl', type = str,
+                    help = 'Root of the search API, e.g. a local replay_server.py',
+                    default = api_url)
 
 parser.add_argument('-v','--verbose', 
                     help = "Set log level to debug", action="store_true")
@@ -39,50 +63,23 @@ log.addHandler(loghandler)
 
 """ STEP 0: OAuth2 Authorization """
 
-# Load my credentials .env file
-client_key = os.getenv('twitter_api_key')
-client_secret = os.getenv('twitter_api_secret')
-
-# Encode my keys in base64 per instructed on 
-# https://developer.twitter.com/en/docs/basics/authentication/overview/application-only
-key_secret = '{}:{}'.format(client_key, client_secret).encode('ascii')
-b64_encoded_key = base64.b64encode(key_secret)
-b64_encoded_key = b64_encoded_key.decode('ascii')
-
-# Build authorization request 
-auth_url = 'https://api.twitter.com/oauth2/token'
-auth_headers = {
-    'Authorization': 'Basic {}'.format(b64_encoded_key),
-    'Content-Type': 'application/x-www-form-urlencoded;charset=UTF-8'}
-auth_data = {'grant_type': 'client_credentials'}
-auth_resp = requests.post(auth_url, headers=auth_headers, data=auth_data)
-
-# Check status code is 200, meaning "okay"
-if auth_resp.status_code != 200:
-    log.error("Authorization status code: {}".format(auth_resp.status_code))
-else:
-    log.info("Authorization request successful")
+# Every worker thread draws from the same bucket so that the requests of
+# all concurrent buckets together stay under the per-minute quota.
+limiter = TokenBucket(rate = args.ratelimit / 60.)
+client = SearchClient(limiter, base_url = args.twitterurl, page_size = args.pagesize)
 
-# Store access token
-access_token = auth_resp.json()['access_token']
+# Load my credentials .env file
+client.authorize(os.getenv('twitter_api_key'), os.getenv('twitter_api_secret'))
 
 
 """ STEP 1: Get counts """
-base_url = 'https://api.twitter.com/1.1/tweets/search/'
-search_headers = {'Authorization': 'Bearer {}'.format(access_token)}
 count_params = {'query': '@PizzaToThePolls',
                 'fromDate': '201811061100',
                 'toDate': '201811062359',
                 'bucket': 'hour'}
-count_url = '{}fullarchive/research/counts.json'.format(base_url)
-count_resp = requests.get(count_url, headers = search_headers, 
-                          params = count_params)
-
-# Check status code is 200
-if count_resp.status_code != 200:
-    log.error("Count request status code: {}".format(count_resp.status_code))
-else:
-    log.info("Count data request successful")
+# raises unless the status code is 200, so no error body is saved
+count_resp = client.get_ok(client.count_url, count_params)
+log.info("Count data request successful")
 
 # Save to file
 count_data = count_resp.json()
@@ -93,69 +90,114 @@ with open(os.path.join("data", "counts.json"), "w") as j:
 
 """ STEP 2: Scrape tweets per hour """ 
 
+journal = Journal(args.journal)
+index = TweetIndex(args.index)
+
+
+def page_files(fromHour, toHour, pgcount):
+    """
+    Return the paths of the raw response and the scraped output
+    for page `pgcount` of the bucket 'fromHour' to 'toHour'.
+    """
+    filename = fromHour + "-" + toHour + "-" + str(pgcount) 
+    return (os.path.join(args.rawdir, "search_resp" + filename + ".json.gz"),
+            os.path.join(args.script01dir, "scraped" + filename + ".json"))
+
+
 def request_search(fromHour, toHour, next_, pgcount):
     """
     This function collects tweets posted by @PizzaToThePolls on
-    2018 Election Day during the hour 'fromDate' to 'toDate'.
+    2018 Election Day during the hour 'fromHour' to 'toHour'.
     Some hours are busier than others and will require multiple responses to 
     cover all the data pages.
     ======================
-    fromDate = 'YYYYMMDDHHMM'
-    toDate = 'YYYYMMDDHHMM'
+    fromHour = 'YYYYMMDDHHMM'
+    toHour = 'YYYYMMDDHHMM'
     pgcount = (int, page counter)
     next_ = (str token for the next page of search result)
     """
 
-    
-    # set the search parameters
-    search_params = {'query': '@PizzaToThePolls',
-                     'fromDate': fromDate, 'toDate': toDate,
-                     'maxResults': 500, 
-                     'next': next_}
-    if next_ == 0:
-        del search_params['next']
-        
-        
-    # make search request
-    search_url = '{}fullarchive/research.json'.format(base_url)
-    search_resp = requests.get(search_url, headers = search_headers, 
-                               params = search_params)
-    
-    
-    # Check status code is 200
-    if search_resp.status_code != 200:
-        log.error("Request status code: {}".format(search_resp.status_code))
-    else:
-        log.info("Request successful")
-        
-    search_data = search_resp.json()
-	
-	# Save to file
-    filename = fromDate + "-" + toDate + "-" + str(pgcount) 
-    with open(os.path.join(args.rawdir, "search_resp" + filename + ".json"), "w") as j:
-        json.dump(search_data, j)
+    # make search request, waiting out the rate limit window on HTTP 429;
+    # raises on any other error
+    content = client.search(fromHour, toHour, next_)
     
     # Scrape the date created, text, and id of each tweet 
-    # in the search response. Add the dictionary to output list.
-    request_out = []
-    for res in search_data['results']:
-        t = {'created_at': res['created_at'], 
-             'text': res['text'], 
-             'id': res['id']}
-        request_out.append(t)
+    # in the search response, which raises if it is not a page of results
+    request_out, next_ = raw_archive.project_page(content)
+    
+	# Save the response body to file as it is, without decoding it
+    raw_file, scraped_file = page_files(fromHour, toHour, pgcount)
+    raw_archive.write_page(raw_file, content)
+    index.add_page(raw_file, content)
     
     # Save to file
-    with open(os.path.join(args.script01dir, "scraped" + filename +".json"), "w") as j:
+    with open(scraped_file, "w") as j:
         json.dump(request_out, j)
     
     # Get 'next' token for the next page if exists, else stop.
-    if 'next' not in search_data:
+    if next_ == 0:
         log.info("We've reached the last page")
-        return(0)
-    else:
-        return(search_data['next'])
+    return(next_)
     
 
+def recover_bucket(fromHour, toHour):
+    """
+    Rebuild the journal entries of a bucket from pages already saved by a
+    run that kept no journal. Stops at the first missing or truncated page.
+    Returns (page, next_) of the last good page, or None.
+    """
+    bucket = fromHour + "-" + toHour
+    last = None
+    c = 0
+    while all(os.path.exists(f) for f in page_files(fromHour, toHour, c)):
+        raw_file = page_files(fromHour, toHour, c)[0]
+        try:
+            to_next = json.loads(raw_archive.read_page(raw_file)).get('next', 0)
+        except (ValueError, EOFError, OSError):
+            break
+        journal.record(bucket, c, to_next)
+        last = (c, to_next)
+        if to_next == 0:
+            break
+        c += 1
+    return last
+
+
+def scrape_bucket(fromHour, toHour):
+    """
+    Follow the chain of 'next' tokens for one time slice (bucket).
+    Pages of a bucket are requested in order; only different buckets 
+    run concurrently. A bucket that was interrupted resumes after its last 
+    journaled page, and a complete bucket is skipped.
+    Returns the number of pages of the bucket.
+    """
+    bucket = fromHour + "-" + toHour
+    last = journal.last_page(bucket)
+    if last is None:
+        last = recover_bucket(fromHour, toHour)
+    if last is not None:
+        saved = [f for c in range(last[0] + 1) 
+                 for f in page_files(fromHour, toHour, c)]
+        if not all(os.path.exists(f) for f in saved):
+            log.info("Files missing for bucket {}, starting over".format(bucket))
+            last = None
+    
+    c = 0
+    to_next = 0
+    if last is not None:
+        c, to_next = last
+        if to_next == 0:
+            log.info("Bucket {} is complete, skipping".format(bucket))
+            return c + 1
+        log.info("Resuming bucket {} at page {}".format(bucket, c + 1))
+        c += 1
+    to_next = request_search(fromHour, toHour, pgcount = c, next_ = to_next)
+    journal.record(bucket, c, to_next)
+    while(to_next != 0):
+        c += 1
+        to_next = request_search(fromHour, toHour, pgcount = c, next_ = to_next)
+        journal.record(bucket, c, to_next)
+    return c + 1
 
 
 
@@ -165,14 +207,21 @@ if __name__ == "__main__":
     
     with open(os.path.join("data", "counts.json"), "r") as j:
        counts = json.load(j)['results']
-    for count in counts:
-       fromHour = count['timePeriod']
-       toHour = str(int(fromHour) + 100)
-       c = 0
-       to_next = request_search(fromHour, toHour, pgcount = c, next_ = 0)
-       while(to_next != 0):
-           c += 1
-           to_next = request_search(fromHour, toHour, pgcount = c, next_ = to_next)
+    
+    # index pages saved by earlier runs before adding new ones
+    index.add_dir(args.rawdir)
+    
+    # split hours holding more than one page into slices of about one page
+    slices = plan_slices(counts, page_size = args.pagesize, 
+                         refine = client.counts)
+    log.info("{} hours planned as {} slices".format(len(counts), len(slices)))
+    
+    with ThreadPoolExecutor(max_workers = args.workers) as pool:
+        jobs = {}
+        for fromHour, toHour, expected in slices:
+            jobs[pool.submit(scrape_bucket, fromHour, toHour)] = fromHour
+        for job in as_completed(jobs):
+            log.info("{} pages saved for bucket {}".format(job.result(), jobs[job]))
     sys.exit()
            
            
@@ -12,6 +12,15 @@ import re
 import argparse
 import xml.etree.ElementTree as ET
 import time
+sys.path.append(os.getcwd() + "/script/scrape_tweets")
+sys.path.append(os.getcwd() + "/script")
+from manifest import Manifest
+from tweet_reader import iter_tweets, iter_chunks
+from tweet_text import clean_tweets
+from address_filter import contain_address
+from address_query import address_query
+from dedup import Deduplicator
+from parallel import map_files, timing_summary
 
 # set up parser
 parser = argparse.ArgumentParser(description='Clean and process tweets')
@@ -21,6 +30,18 @@ parser.add_argument('-script01dir', type = str,
 parser.add_argument('-script02dir', type = str,
                     help = 'Directory storing outputs from 02_clean_and_find_address.py',
                     default = "data/tweets/02_cleaned")
+parser.add_argument('-chunksize', type = int,
+                    help = 'Number of tweets cleaned together in one batch',
+                    default = 2000)
+parser.add_argument('-workers', type = int,
+                    help = 'Number of processes working on files in parallel',
+                    default = 1)
+parser.add_argument('-manifest', type = str,
+                    help = 'Manifest of built files; files whose input and code are unchanged are skipped',
+                    default = 'data/manifest.json')
+parser.add_argument('-force',
+                    help = 'Rebuild every file, even if up to date',
+                    action = "store_true")
 parser.add_argument('-v','--verbose', 
                     help = "Set log level to debug", 
                     action="store_true")
@@ -40,47 +61,50 @@ log.addHandler(loghandler)
 
 
 """ STEP 1: clean and record whether tweet text contains street address"""
-regex_parser = CommonRegex()
 
-
-def clean_tweet(tweet):
-    '''
-    Utility function to clean the text in a tweet by removing 
-    links and special characters using regex.
-    '''
-    return ' '.join(re.sub("(@[\S]+)|([^0-9A-Za-z \t])|(\w+:\/\/\S+)", " ", tweet).split())
+# retweets and copies of a text are checked for an address only once
+dedup = Deduplicator(threshold = None)
+found = {} # representative key -> whether the text contains an address
+address_queries = {} # representative key -> canonical geocode query of the address
 
 
 def find_address(jsonfile):
     """
     Cleans tweet text.
     Adds entry {'contain_address': (logical)} to tweet dictionary where 
-    (logical) indicates whether the cleaned tweet contains street addresses.
+    (logical) indicates whether the cleaned tweet contains street addresses,
+    and for tweets with an address {'address_query': (str)}, the canonical 
+    query of the address for 03_parse_address.py (None if the pre-parser 
+    finds no plausible address).
     ===================
     jsonfile = (str of .json file name containing the tweets)
+    Returns (number of tweets, number of tweets containing address).
     """
-    # Load the JSON file 
-    with open(os.path.join(args.script01dir, jsonfile), "r", errors = "ignore") as j:
-        tweets = json.load(j)
-        
-    
+    # Read the JSON file one tweet at a time
+    tweets = iter_tweets(os.path.join(args.script01dir, jsonfile))
     
     out_list = []
+    n = 0 # counter for number of tweets
     c = 0 # counter for number of tweets containing address
-    for tweet in tweets:
-        query = clean_tweet(tweet['text'])
-        tweet.update({'clean_text': query}) # add clean text to `tweet`
-        # Check whether the cleaned text contains street address
-        if regex_parser.street_addresses(query) == []:
-            tweet.update({'contain_address': False})
-        else:
-            if re.search('pizza', query) != None or re.search('1 8{1-3}[0-9]{1-2}', query) != None:
-                tweet.update({'contain_address': False})
-                
-            else:
-                tweet.update({'contain_address': True})
+    for chunk in iter_chunks(tweets, args.chunksize):
+        n += len(chunk)
+        # clean the texts of the whole chunk at once
+        queries = clean_tweets([tweet['text'] for tweet in chunk])
+        for tweet, query in zip(chunk, queries):
+            tweet.update({'clean_text': query}) # add clean text to `tweet`
+            # Check whether the cleaned text contains street address
+            key = dedup.add(query)
+            if key not in found:
+                found[key] = contain_address(query)
+                if found[key]:
+                    address_queries[key] = address_query(query)
+            if found[key]:
+                tweet.update({'contain_address': True,
+                              'address_query': address_queries[key]})
                 c += 1
                 out_list.append(tweet)
+            else:
+                tweet.update({'contain_address': False})
     
     # Save to "cleaned*.json" file
     cleanfile = jsonfile.replace("scraped", "cleaned")
@@ -90,19 +114,46 @@ def find_address(jsonfile):
     # Log how many tweets were found containing address
     message = "{} tweets containing address"
     log.info(message.format(c))
+    return n, c
 
         
 
                
 if __name__ == "__main__":
     
-    os.chdir(os.path.abspath("/Users/asako/Google Drive/pizza_to_the_polls"))
-    
     path = os.path.join(os.getcwd(), args.script01dir)  
-    for file in sorted(os.listdir(path)):
-        find_address(file)
     
+    # skip files already cleaned from the same input by the same code
+    manifest = Manifest(args.manifest, "02_clean_and_find_address",
+                        sources = [__file__, iter_tweets, clean_tweets, contain_address, 
+                                   address_query, Deduplicator],
+                        force = args.force)
+    def files(file):
+        return (os.path.join(args.script01dir, file),
+                os.path.join(args.script02dir, file.replace("scraped", "cleaned")))
+    todo = [file for file in sorted(os.listdir(path)) 
+            if not manifest.fresh(files(file)[1], [files(file)[0]])]
+    
+    start = time.perf_counter()
+    timings = []
+    total = address = 0
+    for file, (n, c), seconds in map_files(find_address, todo, workers = args.workers):
+        print("{}: {} tweets, {} containing address, {:.3f} s".format(file, n, c, seconds))
+        manifest.record(files(file)[1], [files(file)[0]])
+        timings.append((file, seconds))
+        total += n
+        address += c
+    manifest.save()
     
+    print("{} tweets, {} containing address".format(total, address))
+    print(timing_summary(timings, time.perf_counter() - start))
+    print(manifest.summary())
+    if args.workers <= 1:
+        # the worker processes keep their own counts
+        print(dedup.summary())
+        print("{} distinct addresses, {} canonical queries, {} without a plausible address".format(
+            len(address_queries), len(set(address_queries.values()) - {None}), 
+            sum(1 for q in address_queries.values() if q is None)))
     print("Reached last file")
     sys.exit()
         
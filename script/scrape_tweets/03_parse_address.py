@@ -2,18 +2,26 @@
 # -*- coding: utf-8 -*-
 
 import os
-import requests
-from requests.exceptions import HTTPError
-import json
 import sys
 from commonregex import CommonRegex
 import logging
-import re
 import argparse
-import xml.etree.ElementTree as ET
+import functools
 import time
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 load_dotenv()
+sys.path.append(os.getcwd() + "/script/scrape_tweets")
+sys.path.append(os.getcwd() + "/script")
+from manifest import Manifest
+from tweet_reader import iter_tweets, write_tweets
+from dedup import Deduplicator
+from geocode_cache import GeocodeCache, normalize_query
+from throttle import TokenBucket
+from geocoder import Geocoder, api_url
+from address_parser import parse_response
+from address_query import address_query
+from parallel import map_files, timing_summary
 google_api_key = os.getenv('google_api_key')
 
 # set up parser
@@ -21,9 +29,50 @@ parser = argparse.ArgumentParser(description='Clean and process tweets')
 parser.add_argument('-script02dir', type = str,
                     help = 'Directory storing outputs from 02_clean_and_find_address.py',
                     default = "data/tweets/02_cleaned")
-parser.add_argument('-script02dir', type = str,
-                    help = 'Directory storing outputs from 02_clean_and_find_address.py',
+parser.add_argument('-script03dir', type = str,
+                    help = 'Directory storing outputs from 03_parse_address.py',
                     default = "data/tweets/03_parsed")
+parser.add_argument('-query', type = str,
+                    help = 'Geocode the canonical address found by the pre-parser, or the whole cleaned text',
+                    choices = ["address", "text"],
+                    default = "address")
+parser.add_argument('-similarity', type = float,
+                    help = 'Word-shingle similarity above which tweets with the same street address share one geocode',
+                    default = 0.8)
+parser.add_argument('-cache', type = str,
+                    help = 'SQLite file caching geocode responses across runs',
+                    default = "data/tweets/geocode_cache.sqlite")
+parser.add_argument('-cachettl', type = float,
+                    help = 'Days a cached geocode stays valid (0 for no expiry)',
+                    default = 0)
+parser.add_argument('-cachesize', type = int,
+                    help = 'Geocodes kept in the cache, least recently used evicted first (0 for no limit)',
+                    default = 0)
+parser.add_argument('-threads', type = int,
+                    help = 'Number of concurrent Geocoding requests per process',
+                    default = 8)
+parser.add_argument('-workers', type = int,
+                    help = 'Number of processes working on files in parallel',
+                    default = 1)
+parser.add_argument('-qps', type = float,
+                    help = 'Geocoding requests allowed per second, shared by all processes',
+                    default = 10)
+parser.add_argument('-retries', type = int,
+                    help = 'Retries of a request answered with OVER_QUERY_LIMIT',
+                    default = 5)
+parser.add_argument('-format', type = str,
+                    help = 'Output format of the Geocoding API',
+                    choices = ["xml", "json"],
+                    default = "xml")
+parser.add_argument('-geocodeurl', type = str,
+                    help = 'Root of the Geocoding API, e.g. a local replay_server.py',
+                    default = api_url)
+parser.add_argument('-manifest', type = str,
+                    help = 'Manifest of built files; files whose input and code are unchanged are skipped',
+                    default = 'data/manifest.json')
+parser.add_argument('-force',
+                    help = 'Rebuild every file, even if up to date',
+                    action = "store_true")
 parser.add_argument('-v','--verbose', 
                     help = "Set log level to debug", 
                     action="store_true")
@@ -43,134 +92,175 @@ log.addHandler(loghandler)
 
 
 
-""" STEP 1: Pass tweet text to API """
+""" STEP 1: Choose the query of each tweet """
 
-def get_address(tweet):
+def geocode_query(tweet):
     """
-    Pass the tweet text to Google's Geocode API to get structured 
-    address data in xml format. 
+    Return the query to geocode for the tweet: the canonical address found 
+    by the pre-parser of 02_clean_and_find_address.py, or the whole cleaned 
+    text with `-query text`. Returns None if the tweet is not geocoded.
     """
-    
-    base_url = "https://maps.googleapis.com/maps/api/geocode/xml?address"
-    if tweet['contain_address'] == True:
-       query = tweet['clean_text']
-       req_url = base_url + "=" + query + '&lang=en&key=' + google_api_key
-       try:
-           resp = requests.get(req_url)
-           # If the response was successful, no Exception will be raised
-           resp.raise_for_status()
-       except HTTPError as http_err:
-           log.info(f'HTTP error occurred: {http_err}')  
-       except Exception as err:
-           log.info(f'Other error occurred: {err}')  
-       else:
-           log.info('Success!')
-    else:
-       resp = None
-       
-    
-    return resp
+    if tweet['contain_address'] != True:
+        return None
+    if args.query == "text":
+        return tweet['clean_text']
+    if 'address_query' not in tweet:
+        # output of 02_clean_and_find_address.py before the pre-parser
+        return address_query(tweet['clean_text'])
+    return tweet['address_query']
 
-""" STEP 2: Parse API response """
 
-def parse_address(resp):
+""" STEP 2: Pass the query to the API and parse the response """
+
+cache = geocoder = None
+
+
+def open_geocoder(share = 1):
     """
-    Parses the `get_address` response output and constructs
-    dictionary output to be returned.
-    =====================
-    resp (the response xml output of `get_address`)
+    Open the cache and the geocoder of this process. All threads of the 
+    process share one connection pool, the cache and a rate limit of 
+    1 / `share` of `args.qps`, `share` being the number of processes.
     """
-    # set up tree
-    root = ET.fromstring(resp.content)
-    
-    # only parse if google API response is 'ok' and 
-    # address type is in the `type_list`
-    type_list = ['street_address',
-                 'church',
-                 'locality',
-                 'clothing_store',
-                 'subpremise',
-                 'colloquial_area',
-                 'premise',
-                 'establishment',
-                 'bar']
-    
-    if (root.find('status').text.lower() == "ok" and 
-        root.find('./result/type').text in type_list):
-        add_type = root.find('./result/type').text
-        path = "./result/[type='{}']/".format(add_type)
-        try:
-            full = root.find(path + "formatted_address").text
-        except UnboundLocalError:
-            full = None
-        try:
-            st_num = root.find(path + "address_component/[type='street_number']/long_name").text
-        except:
-            st_num = None
-        try:
-            route = root.find(path + "address_component/[type='route']/long_name").text
-        except:
-            route = None
-        try:
-            city = root.find(path + "address_component/[type='locality']/long_name").text
-        except:
-            try:
-                city = root.find(path + "address_component/[type='sublocality']/long_name").text
-            except:
-                city = None
-        try:
-            county = root.find(path + "address_component/[type='administrative_area_level_2']/long_name").text
-        except:
-            county = None
-        try:
-            state = root.find(path + "address_component/[type='administrative_area_level_1']/long_name").text
-            state_abbv = root.find(path + "address_component/[type='administrative_area_level_1']/short_name").text
-        except:
-            state = state_abbv = None
-        try:
-            zipcode = root.find(path + "address_component/[type='postal_code']/short_name").text
-        except:
-            zipcode = None
-        try:
-            lat = root.find(path + "geometry/location/lat").text
-            lng = root.find(path + "geometry/location/lng").text
-        except:
-            lat = lng = None
-    else:
-        full = st_num = route = city = county = state = state_abbv = zipcode = lat = lng = None
-    # construct dictionary 
-    address = {"full": full,
-                "st_num": st_num, 
-               "route": route,
-                "city": city,
-                "county": county,
-                "state": state,
-                "state_abbv": state_abbv,
-                "zipcode": zipcode,
-                "lat": lat,
-                "lng": lng}
-    return address
+    global cache, geocoder
+    qps = args.qps / share
+    cache = GeocodeCache(args.cache, ttl = args.cachettl, max_entries = args.cachesize)
+    geocoder = Geocoder(google_api_key, 
+                        limiter = TokenBucket(rate = qps, capacity = max(1, int(qps))),
+                        cache = cache, 
+                        fmt = args.format, 
+                        retries = args.retries, 
+                        pool_size = args.threads,
+                        base_url = args.geocodeurl)
+
+
+""" STEP 3: Geocode each distinct query once """
+
+regex_parser = CommonRegex()
+
+
+def same_address(key, other):
+    """
+    Near duplicate texts share a geocode only if they name the same 
+    street addresses.
+    """
+    return regex_parser.street_addresses(key) == regex_parser.street_addresses(other)
+
+
+dedup = Deduplicator(threshold = args.similarity, verify = same_address)
+geocoded = {} # representative key -> parsed address (None if not geocoded)
+skipped = 0 # tweets with an address the pre-parser found implausible
+
+
+def geocode_tweets(tweets, pool):
+    """
+    Geocode the distinct address queries of `tweets` and return the key 
+    of each tweet's query (None for tweets without an address); the 
+    parsed address of a key is in `geocoded`. Queries are geocoded 
+    concurrently on the thread `pool`; tweets whose query was already 
+    geocoded (with `-query text`, retweets and near duplicates of a text) 
+    reuse its address. Only the keys are kept, not the tweets.
+    """
+    global skipped
+    keys = []
+    todo = {}
+    for tweet in tweets:
+        key = None
+        query = geocode_query(tweet)
+        if query is not None:
+            if args.query == "text":
+                key = dedup.add(query)
+            else:
+                key = normalize_query(query)
+            if key not in geocoded and key not in todo:
+                todo[key] = pool.submit(geocoder.geocode, query)
+        elif tweet['contain_address'] == True:
+            skipped += 1
+        keys.append(key)
+    for key, job in todo.items():
+        geocoded[key] = job.result()
+    return keys
+
+
+def parse_file(file):
+    """
+    Geocode the tweets of one "cleaned*.json" file of `args.script02dir` 
+    and save them to the matching "parsed*.json" file. The file is read 
+    twice, once for the queries and once to stream the parsed tweets out, 
+    so it is never held in memory as a whole.
+    Returns (number of tweets, number of tweets geocoded, number of 
+    tweets whose geocode failed).
+    """
+    path = os.path.join(args.script02dir, file)
+    with ThreadPoolExecutor(max_workers = args.threads) as pool:
+        keys = geocode_tweets(iter_tweets(path), pool)
+    counts = {"geocoded": 0, "failed": 0}
+
+    def parsed_tweets():
+        for tweet, key in zip(iter_tweets(path), keys):
+            if key is not None:
+                if geocoded[key] is None:
+                    counts["failed"] += 1
+                else:
+                    tweet.update(geocoded[key])
+            if tweet.get('lat') is not None:
+                counts["geocoded"] += 1
+            yield tweet
+
+    parsed = file.replace("cleaned", "parsed")
+    n = write_tweets(os.path.join(args.script03dir, parsed), parsed_tweets())
+    return n, counts["geocoded"], counts["failed"]
 
 
 if __name__ == "__main__":
 
-    os.chdir(os.path.abspath("/Users/asako/Google Drive/pizza_to_the_polls"))
     path = os.path.join(os.getcwd(), args.script02dir)
 
-    # iterate over files in 'data/02_cleaned'
-    for file in sorted(os.listdir(path)):
-        with open(os.path.join(path, file), "r") as j:
-            tweets = json.load(j)
-        for tweet in tweets:
-            xml_resp = get_address(tweet) 
-            if xml_resp is not None:
-                address_dict = parse_address(xml_resp)
-                tweet.update(address_dict)
-            else:
-                pass
-        time.sleep(2.5)
-        parsed = file.replace("cleaned", "parsed")
-        with open(os.path.join(args.script03dir, parsed), "w") as j:
-            json.dump(tweets, j)
-    log.message('Reached last file')
+    # iterate over files in 'data/02_cleaned'; worker processes open their 
+    # own cache connection and share the rate limit
+    initializer = None
+    if args.workers <= 1:
+        open_geocoder()
+    else:
+        initializer = functools.partial(open_geocoder, args.workers)
+    
+    # skip files already geocoded from the same input by the same code
+    manifest = Manifest(args.manifest, "03_parse_address",
+                        sources = [__file__, iter_tweets, Geocoder, parse_response, normalize_query,
+                                   address_query, Deduplicator],
+                        params = {"query": args.query, "format": args.format, 
+                                  "similarity": args.similarity},
+                        force = args.force)
+    def files(file):
+        return (os.path.join(args.script02dir, file),
+                os.path.join(args.script03dir, file.replace("cleaned", "parsed")))
+    todo = [file for file in sorted(os.listdir(path)) 
+            if not manifest.fresh(files(file)[1], [files(file)[0]])]
+    
+    start = time.perf_counter()
+    timings = []
+    for file, (n, c, failed), seconds in map_files(parse_file, todo, 
+                                                   workers = args.workers,
+                                                   initializer = initializer):
+        print("{}: {} tweets, {} geocoded, {} failed, {:.3f} s".format(file, n, c, failed, seconds))
+        # a file with failed geocodes is written but parsed again next run
+        if not failed:
+            manifest.record(files(file)[1], [files(file)[0]])
+        timings.append((file, seconds))
+    manifest.save()
+    print(timing_summary(timings, time.perf_counter() - start))
+    print(manifest.summary())
+    if args.workers > 1:
+        # the worker processes keep their own counts
+        log.info('Reached last file')
+        sys.exit()
+    if args.query == "text":
+        stats = dedup.stats()
+        print(dedup.summary())
+        print("{} geocoding calls saved".format(stats['tweets'] - stats['representatives']))
+    else:
+        print("{} distinct address queries, {} tweets skipped without a plausible address".format(
+            len(geocoded), skipped))
+    print(cache.summary())
+    print(geocoder.latency_summary())
+    log.info('Reached last file')
     sys.exit()
\ No newline at end of file
@@ -6,7 +6,20 @@ import logging
 import os
 import json
 import sys
-import pandas as pd
+import time
+sys.path.append(os.getcwd() + "/script/scrape_tweets")
+sys.path.append(os.getcwd() + "/script")
+from manifest import Manifest
+from tweet_reader import iter_tweets
+from tweet_frame import collect_columns, merge_columns, to_frame
+from parallel import map_files, timing_summary
+import districts
+import sites
+try:
+    from tweet_store import write_store
+except ImportError:
+    # the typed dataset is optional; the CSV is written without pyarrow
+    write_store = None
 
 
 # set up arg parser 
@@ -20,6 +33,25 @@ parser.add_argument('-shpdir', type = str,
 parser.add_argument('-csvdir', type = str,
                     help = "Directory storing csv files",
                     default = "data/csv")
+parser.add_argument('-radius', type = float,
+                    help = "Distance in metres under which two tweets are at the same delivery site",
+                    default = sites.default_radius)
+parser.add_argument('-storedir', type = str,
+                    help = "Directory of the Parquet/Arrow dataset partitioned by state and hour ('' to skip)",
+                    default = "data/parquet/PizzaToThePolls")
+parser.add_argument('-storeformat', type = str,
+                    help = "File format of the dataset",
+                    choices = ["parquet", "arrow"],
+                    default = "parquet")
+parser.add_argument('-workers', type = int,
+                    help = "Number of processes reading files in parallel",
+                    default = 1)
+parser.add_argument('-manifest', type = str,
+                    help = 'Manifest of built files; nothing is rebuilt if no input or code changed',
+                    default = 'data/manifest.json')
+parser.add_argument('-force',
+                    help = 'Rebuild even if up to date',
+                    action = "store_true")
 parser.add_argument('-v','--verbose',
                     help = "Set log level to debug", action="store_true")
 args = parser.parse_args()
@@ -35,42 +67,75 @@ log.addHandler(f_handler)
 
 
 
+def read_file(file):
+    """
+    Return the column buffers of the tweets of one "parsed*.json" file.
+    """
+    return collect_columns(iter_tweets(os.path.join(args.script02dir, file)))
+
+
+
 if __name__ == "__main__":
     
-    colnames = ("st_num", "route", "city", "state_abbv",
-                "zipcode", "county", "lng", "lat", 
-                "created_at", "id", "clean_text")
-    df = pd.DataFrame(columns = colnames)
-    
     # create a list of files in "data/tweets/script02"
     parsed_list = []
     for file in sorted(os.listdir(args.script02dir)):
         if (file.startswith("parsed") and file.endswith(".json")):
             parsed_list.append(file)
     
-    # iterate over `parsed_list`
-    for file in parsed_list:
-        with open(os.path.join(args.script02dir, file), "r") as p:
-            tweets = json.load(p)
-        for tweet in tweets:
-            if tweet.get('contain_address') == True:
-                print(tweets.index(tweet))
-                subset_tweet = {k:v for k, v in tweet.items() if k in colnames}
-                df = df.append(pd.DataFrame.from_records(subset_tweet, index = [0]), 
-                               sort = True)
-            else:
-                pass
-                
+    # the table depends on every file; rebuild it only if one of them changed
     csv_path = os.path.join(args.csvdir, "PizzaToThePolls.csv")
+    sites_path = os.path.join(args.csvdir, os.path.basename(sites.default_path))
+    inputs = [os.path.join(args.script02dir, file) for file in parsed_list]
+    shp_path = os.path.join(args.shpdir, districts.cd_shapefile)
+    if os.path.exists(shp_path):
+        inputs += [shp_path, os.path.splitext(shp_path)[0] + ".dbf"]
+    crosswalk = districts.county_crosswalk
+    inputs += [path for path in (crosswalk.default_path,
+                                 os.path.join(args.shpdir, crosswalk.within_dbf),
+                                 os.path.join(args.shpdir, crosswalk.county_dbf))
+               if os.path.exists(path)]
+    sources = [__file__, iter_tweets, collect_columns, districts, districts.read_shapefile,
+               crosswalk, sites]
+    if write_store is not None:
+        sources.append(write_store)
+    manifest = Manifest(args.manifest, "04_convert_to_csv", sources = sources,
+                        params = {"storedir": args.storedir, "storeformat": args.storeformat,
+                                  "radius": args.radius},
+                        force = args.force)
+    if (manifest.fresh(csv_path, inputs) and manifest.fresh(sites_path, inputs) and
+            (not args.storedir or os.path.exists(args.storedir))):
+        print("{} is up to date".format(csv_path))
+        sys.exit()
+    
+    # read every file once into column buffers, then build one DataFrame
+    # from the buffers in file order
+    start = time.perf_counter()
+    parts = []
+    timings = []
+    for file, columns, seconds in map_files(read_file, parsed_list, workers = args.workers):
+        print("{}: {} tweets, {:.3f} s".format(file, len(columns['id']), seconds))
+        parts.append(columns)
+        timings.append((file, seconds))
+    print(timing_summary(timings, time.perf_counter() - start))
+    df = to_frame(merge_columns(parts))
+    
+    # congressional district of each tweet, if the shapefile is there
+    df = districts.add_districts(df, args.shpdir)
+    
+    # delivery site of each tweet, and the deliveries per site
+    df = sites.add_sites(df, args.radius)
+    
     df.to_csv(csv_path)
+    sites.write_sites(df, sites_path)
+    
+    # typed copy for readers that only need some columns or partitions
+    if args.storedir:
+        if write_store is None:
+            print("pyarrow is not installed; skipping {}".format(args.storedir))
+        else:
+            write_store(df, args.storedir, fmt = args.storeformat)
+    manifest.record(csv_path, inputs)
+    manifest.record(sites_path, inputs)
+    manifest.save()
     sys.exit()
-
-
-
-
-
-
-
-
-
-
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Decide whether a cleaned tweet contains a street address, as
+02_clean_and_find_address.py does with CommonRegex.street_addresses.
+A cheap pre-filter rejects most tweets before the full pattern runs.
+"""
+
+import re
+from commonregex import CommonRegex, street_address
+
+regex_parser = CommonRegex()
+
+
+def street_suffixes(pattern = street_address.pattern):
+    """
+    Return the street types of the alternation at the end of CommonRegex's
+    street address `pattern`, e.g. ('street', 'st', ...). Raises
+    ValueError if the pattern no longer ends in one such group, since the
+    pre-filter would then reject addresses the pattern matches.
+    """
+    m = re.search(r"\(\?:(\w+(?:\|\w+)*)\)[^()]*\(\?=[^()]*\)$", pattern)
+    if m is None:
+        raise ValueError("Unexpected street address pattern: {}".format(pattern))
+    return tuple(m.group(1).split("|"))
+
+
+# street types at the end of CommonRegex's street address pattern
+suffixes = street_suffixes()
+
+digit_space = re.compile(r"\d ")
+
+
+def may_contain_address(query):
+    """
+    Pre-filter for `street_addresses` on cleaned text (ASCII letters and
+    digits separated by single spaces). Returns False only for text the
+    full pattern cannot match: the pattern needs a number followed by a
+    space and, after it, a word ending in one of the `suffixes`.
+    """
+    m = digit_space.search(query)
+    if m is None:
+        return False
+    return any(word.endswith(suffixes) for word in query[m.end():].lower().split())
+
+
+def contain_address(query):
+    """
+    Return True if the cleaned tweet `query` contains a street address and
+    is not one of the tweets that only mention pizza.
+    """
+    if not may_contain_address(query):
+        return False
+    if regex_parser.street_addresses(query) == []:
+        return False
+    if re.search('pizza', query) != None or re.search('1 8{1-3}[0-9]{1-2}', query) != None:
+        return False
+    return True
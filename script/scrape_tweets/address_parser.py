@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Parse Geocoding API responses into the address dictionary of
+03_parse_address.py. Each response is walked once: the address components
+of the first result are collected into a map from component type to name,
+instead of searching the tree again for every field.
+Responses of both the XML and the JSON endpoint are supported.
+"""
+
+import json
+import xml.etree.ElementTree as ET
+from xml.sax.saxutils import escape
+
+# only parse results whose first type is in `type_list`
+type_list = ['street_address',
+             'church',
+             'locality',
+             'clothing_store',
+             'subpremise',
+             'colloquial_area',
+             'premise',
+             'establishment',
+             'bar']
+
+fields = ("full", "st_num", "route", "city", "county", "state",
+          "state_abbv", "zipcode", "lat", "lng")
+
+
+def empty_address():
+    return dict.fromkeys(fields)
+
+
+def build_address(full, long_names, short_names, lat, lng):
+    """
+    Assemble the address dictionary from the formatted address, the
+    maps from component type to long and short name, and the location.
+    """
+    city = long_names.get('locality', long_names.get('sublocality'))
+    if ('administrative_area_level_1' in long_names and
+            'administrative_area_level_1' in short_names):
+        state = long_names['administrative_area_level_1']
+        state_abbv = short_names['administrative_area_level_1']
+    else:
+        state = state_abbv = None
+    if lat is None or lng is None:
+        lat = lng = None
+    return {"full": full,
+            "st_num": long_names.get('street_number'),
+            "route": long_names.get('route'),
+            "city": city,
+            "county": long_names.get('administrative_area_level_2'),
+            "state": state,
+            "state_abbv": state_abbv,
+            "zipcode": short_names.get('postal_code'),
+            "lat": lat,
+            "lng": lng}
+
+
+def parse_xml(content):
+    """
+    Parse the body of an XML endpoint response (bytes or str).
+    """
+    root = ET.fromstring(content)
+    result = root.find('result')
+    if (root.findtext('status', '').lower() != "ok" or result is None or
+            result.findtext('type') not in type_list):
+        return empty_address()
+
+    # the first component of each type that has the name wins
+    long_names = {}
+    short_names = {}
+    for component in result.iter('address_component'):
+        long_name = component.find('long_name')
+        short_name = component.find('short_name')
+        for t in component.iter('type'):
+            if long_name is not None and t.text not in long_names:
+                long_names[t.text] = long_name.text
+            if short_name is not None and t.text not in short_names:
+                short_names[t.text] = short_name.text
+
+    location = result.find('geometry/location')
+    lat = location.find('lat') if location is not None else None
+    lng = location.find('lng') if location is not None else None
+    return build_address(result.findtext('formatted_address'), long_names, short_names,
+                         lat.text if lat is not None else None,
+                         lng.text if lng is not None else None)
+
+
+def parse_json(content):
+    """
+    Parse the body of a JSON endpoint response (bytes or str).
+    Coordinates are returned as strings, as in XML responses.
+    """
+    data = json.loads(content)
+    results = data.get('results') or []
+    if (data.get('status', '').lower() != "ok" or not results or
+            (results[0].get('types') or [None])[0] not in type_list):
+        return empty_address()
+    result = results[0]
+
+    long_names = {}
+    short_names = {}
+    for component in result.get('address_components', []):
+        for t in component.get('types', []):
+            if 'long_name' in component and t not in long_names:
+                long_names[t] = component['long_name']
+            if 'short_name' in component and t not in short_names:
+                short_names[t] = component['short_name']
+
+    location = result.get('geometry', {}).get('location', {})
+    lat, lng = location.get('lat'), location.get('lng')
+    return build_address(result.get('formatted_address'), long_names, short_names,
+                         repr(lat) if lat is not None else None,
+                         repr(lng) if lng is not None else None)
+
+
+parsers = {"xml": parse_xml, "json": parse_json}
+
+
+def parse_response(content, fmt = "xml"):
+    """
+    Parse the body of a response of the `fmt` ('xml' or 'json') endpoint.
+    """
+    return parsers[fmt](content)
+
+
+def parse_many(contents, fmt = "xml"):
+    """
+    Parse a list of response bodies. Returns the list of address dictionaries.
+    """
+    parse = parsers[fmt]
+    return [parse(content) for content in contents]
+
+
+def response_status(content, fmt = "xml"):
+    """
+    Return the status of a response, e.g. 'OK' or 'OVER_QUERY_LIMIT'.
+    """
+    if fmt == "json":
+        return json.loads(content).get('status')
+    return ET.fromstring(content).findtext('status')
+
+
+def components(address):
+    """
+    Return the (type, long name, short name) address components of `address`.
+    """
+    return [("street_number", address.get('st_num'), address.get('st_num')),
+            ("route", address.get('route'), address.get('route')),
+            ("locality", address.get('city'), address.get('city')),
+            ("administrative_area_level_2", address.get('county'), address.get('county')),
+            ("administrative_area_level_1", address.get('state'), address.get('state_abbv')),
+            ("postal_code", address.get('zipcode'), address.get('zipcode'))]
+
+
+def status_response(status, fmt = "xml"):
+    """
+    Body of a response with `status` and no results, e.g. 'ZERO_RESULTS'.
+    """
+    if fmt == "json":
+        return json.dumps({"results": [], "status": status}).encode("utf-8")
+    return "<GeocodeResponse><status>{}</status></GeocodeResponse>".format(status).encode("utf-8")
+
+
+def build_xml(address, result_type = "street_address"):
+    """
+    Build an XML endpoint response that parses back to `address`, for
+    replaying parsed geocodes where the raw response was not kept.
+    """
+    if address is None or address.get('full') is None:
+        return status_response("ZERO_RESULTS", "xml")
+    parts = ["<GeocodeResponse><status>OK</status><result>",
+             "<type>{}</type>".format(result_type),
+             "<formatted_address>{}</formatted_address>".format(escape(address['full']))]
+    for t, long_name, short_name in components(address):
+        if long_name is None:
+            continue
+        parts.append("<address_component><long_name>{}</long_name>"
+                     "<short_name>{}</short_name><type>{}</type></address_component>".format(
+                         escape(long_name), escape(short_name or long_name), t))
+    if address.get('lat') is not None and address.get('lng') is not None:
+        parts.append("<geometry><location><lat>{}</lat><lng>{}</lng></location></geometry>".format(
+            address['lat'], address['lng']))
+    parts.append("</result></GeocodeResponse>")
+    return "".join(parts).encode("utf-8")
+
+
+def build_json(address, result_type = "street_address"):
+    """
+    Build a JSON endpoint response that parses back to `address`.
+    """
+    if address is None or address.get('full') is None:
+        return status_response("ZERO_RESULTS", "json")
+    result = {"types": [result_type],
+              "formatted_address": address['full'],
+              "address_components": [{"long_name": long_name,
+                                      "short_name": short_name or long_name,
+                                      "types": [t]}
+                                     for t, long_name, short_name in components(address)
+                                     if long_name is not None]}
+    if address.get('lat') is not None and address.get('lng') is not None:
+        result["geometry"] = {"location": {"lat": float(address['lat']),
+                                           "lng": float(address['lng'])}}
+    return json.dumps({"results": [result], "status": "OK"}).encode("utf-8")
+
+
+builders = {"xml": build_xml, "json": build_json}
+
+
+def build_response(address, fmt = "xml"):
+    """
+    Build a response of the `fmt` ('xml' or 'json') endpoint for `address`.
+    """
+    return builders[fmt](address)
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Offline pre-parser of the street addresses found by
+02_clean_and_find_address.py. It extracts the (number, street, city, state,
+zipcode) of the first plausible address in a cleaned tweet and renders it
+as a canonical query, e.g.
+
+    "Hey they re definitely going to need you today 111 Bright Street in JC"
+    -> "111 Bright St, JC"
+
+03_parse_address.py sends the canonical query to the Geocoding API instead
+of the whole tweet and uses it as the cache key, so tweets naming the same
+address in different words share one call. Tweets without a plausible
+address are not geocoded at all.
+"""
+
+import os
+import re
+import sys
+sys.path.append(os.getcwd() + "/script/scrape_wiki")
+import us_states_list as us
+
+# street types and their USPS abbreviations
+street_types = {"street": "St", "st": "St",
+                "avenue": "Ave", "ave": "Ave",
+                "road": "Rd", "rd": "Rd",
+                "highway": "Hwy", "hwy": "Hwy",
+                "square": "Sq", "sq": "Sq",
+                "trail": "Trl", "trl": "Trl",
+                "drive": "Dr", "dr": "Dr",
+                "court": "Ct", "ct": "Ct",
+                "parkway": "Pkwy", "pkwy": "Pkwy",
+                "circle": "Cir", "cir": "Cir",
+                "boulevard": "Blvd", "blvd": "Blvd",
+                "lane": "Ln", "ln": "Ln",
+                "place": "Pl", "pl": "Pl",
+                "way": "Way"}
+
+directions = {"n": "N", "s": "S", "e": "E", "w": "W",
+              "ne": "NE", "nw": "NW", "se": "SE", "sw": "SW",
+              "north": "N", "south": "S", "east": "E", "west": "W"}
+
+# a house number, up to four street name words, a street type and an
+# optional direction, all as whole words
+street_pattern = re.compile(
+    r"\b(\d{1,5}) ((?:[A-Za-z0-9]+ ){1,4}?)(" + "|".join(street_types) +
+    r")\b(?: ([NS][EW]?|[EW])\b)?", re.IGNORECASE)
+
+ordinal = re.compile(r"^\d+(?:st|nd|rd|th)$", re.IGNORECASE)
+zipcode_pattern = re.compile(r"^\d{5}$")
+
+state_abbvs = set(us.states_abbv)
+state_names = {name.lower(): abbv for name, abbv in us.states_dict.items()}
+prepositions = ("in", "at", "on", "of")
+country = ("USA", "US")
+
+
+def plausible_street(words):
+    """
+    A street name has at least one word with a letter, and no bare
+    numbers other than ordinals (which would be phone numbers, times, ...).
+    """
+    if not any(re.search("[A-Za-z]", w) for w in words):
+        return False
+    return all(not w.isdigit() for w in words if not ordinal.match(w))
+
+
+def split_state(words):
+    """
+    Split the capitalized words following a street into (city words, state
+    abbreviation). The state is the last word if it is an abbreviation, or
+    the longest full state name ending the words.
+    """
+    if words and (words[-1].upper() in state_abbvs and
+                  (words[-1].isupper() or words[-1].istitle())):
+        return words[:-1], words[-1].upper()
+    for n in (3, 2, 1):
+        if len(words) >= n and " ".join(words[-n:]).lower() in state_names:
+            return words[:-n], state_names[" ".join(words[-n:]).lower()]
+    return words, None
+
+
+def locality(rest):
+    """
+    Parse the city, state and zipcode following a street, e.g.
+    "Chicago IL 60625 USA via" or "in JC". Returns (city, state, zipcode).
+    """
+    tokens = rest.split()
+    if tokens[:1] and tokens[0].lower() in prepositions:
+        tokens = tokens[1:]
+    words = []
+    for token in tokens:
+        if len(words) == 4 or not token[:1].isupper() or token in country:
+            break
+        words.append(token)
+    city_words, state = split_state(words)
+    after = tokens[len(words):]
+    while after[:1] and after[0] in country:
+        after = after[1:]
+    zipcode = after[0] if after[:1] and zipcode_pattern.match(after[0]) else None
+    return " ".join(city_words) or None, state, zipcode
+
+
+def parse_components(text):
+    """
+    Return the dictionary of the first plausible address in the cleaned
+    tweet `text` with keys number, street, city, state, zipcode (None for
+    parts not found), or None if the tweet has no plausible address.
+    """
+    pos = 0
+    while True:
+        m = street_pattern.search(text, pos)
+        if m is None:
+            return None
+        words = m.group(2).split()
+        if not plausible_street(words):
+            # the address may start at a later number, e.g. "PS 130 is at 70 ..."
+            pos = m.end(1)
+            continue
+        street = " ".join(directions.get(w.lower(), w) if i == 0 else w
+                          for i, w in enumerate(words))
+        street += " " + street_types[m.group(3).lower()]
+        if m.group(4):
+            street += " " + directions[m.group(4).lower()]
+        city, state, zipcode = locality(text[m.end():])
+        return {"number": m.group(1),
+                "street": street,
+                "city": city,
+                "state": state,
+                "zipcode": zipcode}
+
+
+def address_query(text):
+    """
+    Return the canonical geocode query of the cleaned tweet `text`,
+    "number street, city, state zipcode", or None if the tweet has no
+    plausible address.
+    """
+    parts = parse_components(text)
+    if parts is None:
+        return None
+    region = " ".join(p for p in (parts['state'], parts['zipcode']) if p)
+    return ", ".join(p for p in ("{} {}".format(parts['number'], parts['street']),
+                                 parts['city'], region) if p)
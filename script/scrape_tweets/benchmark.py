@@ -0,0 +1,549 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Throughput benchmarks for the stages of the scrape_tweets pipeline,
+run on the tweets already scraped to `-script01dir` and parsed to
+`-script03dir`, and (`stages`) on a synthetic corpus `-scale` times the
+size of Election Day made by synthetic.py.
+
+$ python script/scrape_tweets/benchmark.py            # every benchmark
+$ python script/scrape_tweets/benchmark.py clean      # only `clean`
+$ python script/scrape_tweets/benchmark.py stages -scale 100
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+sys.path.append(os.getcwd() + "/script/scrape_tweets")
+from tweet_reader import iter_tweets
+
+# benchmark name -> function taking the parsed arguments
+benchmarks = {}
+
+
+def benchmark(name):
+    """
+    Register the decorated function as benchmark `name`.
+    """
+    def register(fn):
+        benchmarks[name] = fn
+        return fn
+    return register
+
+
+def best_time(fn, repeat):
+    """
+    Return (best wall-clock seconds over `repeat` calls of fn(), result).
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+
+def report(label, n, seconds, unit = "tweets"):
+    print("{:<32} {:>8} {} {:>9.3f} s {:>12,.0f} {}/s".format(
+        label, n, unit, seconds, n / seconds, unit))
+
+
+def reset_peak_rss():
+    """
+    Reset the peak resident set size of this process to the current one.
+    Returns False where this is not supported (only Linux does).
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss():
+    """
+    Return the peak resident set size of this process in bytes, since the
+    last `reset_peak_rss`.
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    import resource
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def load_texts(script01dir):
+    """
+    Return the text of every tweet in the "scraped*.json" files of `script01dir`.
+    """
+    return [tweet['text'] for file in sorted(os.listdir(script01dir))
+            for tweet in iter_tweets(os.path.join(script01dir, file))]
+
+
+@benchmark("clean")
+def bench_clean(args):
+    """
+    Per-tweet `clean_tweet` against the batch `clean_tweets`.
+    """
+    from tweet_text import clean_tweet, clean_tweets
+    texts = load_texts(args.script01dir)
+    
+    seconds, single = best_time(lambda: [clean_tweet(t) for t in texts], args.repeat)
+    report("clean_tweet (per tweet)", len(texts), seconds)
+    seconds, batch = best_time(lambda: clean_tweets(texts), args.repeat)
+    report("clean_tweets (batch)", len(texts), seconds)
+    if single != batch:
+        print("WARNING: batch output differs from clean_tweet")
+
+
+@benchmark("address")
+def bench_address(args):
+    """
+    Street address detection with and without the pre-filter, and the
+    recall of the pre-filter against the full CommonRegex pattern.
+    """
+    from tweet_text import clean_tweets
+    from address_filter import regex_parser, may_contain_address
+    queries = clean_tweets(load_texts(args.script01dir))
+    
+    seconds, full = best_time(
+        lambda: [regex_parser.street_addresses(q) != [] for q in queries], args.repeat)
+    report("street_addresses", len(queries), seconds)
+    seconds, passed = best_time(
+        lambda: [may_contain_address(q) for q in queries], args.repeat)
+    report("may_contain_address", len(queries), seconds)
+    seconds, filtered = best_time(
+        lambda: [may_contain_address(q) and regex_parser.street_addresses(q) != []
+                 for q in queries], args.repeat)
+    report("pre-filter + street_addresses", len(queries), seconds)
+    
+    found = sum(full)
+    kept = sum(1 for f, p in zip(full, passed) if f and p)
+    print("pre-filter passes {} of {} tweets; recall {}/{} = {:.4f}".format(
+        sum(passed), len(queries), kept, found, kept / found if found else 1.))
+    if filtered != full:
+        print("WARNING: pre-filter changes the detected addresses")
+
+
+def xpath_parse_address(content):
+    """
+    The original parser of 03_parse_address.py, one XPath search per field.
+    """
+    import xml.etree.ElementTree as ET
+    from address_parser import type_list, empty_address
+    root = ET.fromstring(content)
+    if not (root.find('status').text.lower() == "ok" and 
+            root.find('./result/type').text in type_list):
+        return empty_address()
+    path = "./result/[type='{}']/".format(root.find('./result/type').text)
+    
+    def text(p):
+        try:
+            return root.find(path + p).text
+        except AttributeError:
+            return None
+    address = {"full": text("formatted_address"),
+               "st_num": text("address_component/[type='street_number']/long_name"),
+               "route": text("address_component/[type='route']/long_name"),
+               "city": (text("address_component/[type='locality']/long_name") or
+                        text("address_component/[type='sublocality']/long_name")),
+               "county": text("address_component/[type='administrative_area_level_2']/long_name"),
+               "state": text("address_component/[type='administrative_area_level_1']/long_name"),
+               "state_abbv": text("address_component/[type='administrative_area_level_1']/short_name"),
+               "zipcode": text("address_component/[type='postal_code']/short_name"),
+               "lat": text("geometry/location/lat"),
+               "lng": text("geometry/location/lng")}
+    return address
+
+
+def load_responses(cache_path, script03dir):
+    """
+    Return the XML responses recorded in the geocode cache at `cache_path`,
+    or, if there are none, responses rebuilt from the parsed tweets of 
+    `script03dir`.
+    """
+    from address_parser import build_xml
+    responses = []
+    if os.path.exists(cache_path):
+        from geocode_cache import GeocodeCache
+        cache = GeocodeCache(cache_path)
+        responses = [r for _, r in cache.responses() 
+                     if r is not None and r.lstrip().startswith(b"<")]
+        cache.close()
+    if responses:
+        return responses
+    return [build_xml(tweet) for file in sorted(os.listdir(script03dir))
+            for tweet in iter_tweets(os.path.join(script03dir, file))
+            if tweet.get('full') is not None]
+
+
+@benchmark("parse")
+def bench_parse(args):
+    """
+    XPath search per field against the single pass of `parse_many`, on 
+    recorded Geocoding responses.
+    """
+    from address_parser import parse_many
+    responses = load_responses(args.cache, args.script03dir)
+    
+    seconds, xpath = best_time(
+        lambda: [xpath_parse_address(r) for r in responses], args.repeat)
+    report("XPath per field", len(responses), seconds, unit = "responses")
+    seconds, single = best_time(lambda: parse_many(responses), args.repeat)
+    report("parse_many (single pass)", len(responses), seconds, unit = "responses")
+    if single != xpath:
+        print("WARNING: single pass output differs from the XPath parser")
+
+
+def synthetic_parsed(script03dir, n):
+    """
+    Return `n` geocoded tweets made by cycling the tweets parsed to
+    `script03dir`, each with a new id.
+    """
+    import itertools
+    parsed = [tweet for file in sorted(os.listdir(script03dir))
+              for tweet in iter_tweets(os.path.join(script03dir, file))]
+    tweets = []
+    for i, tweet in enumerate(itertools.islice(itertools.cycle(parsed), n)):
+        tweet = dict(tweet)
+        tweet['id'] = tweet['id'] + i
+        tweets.append(tweet)
+    return tweets
+
+
+@benchmark("frame")
+def bench_frame(args):
+    """
+    One DataFrame concatenation per tweet, as 04_convert_to_csv.py used to
+    do, against the column buffers of `build_frame`. The per-tweet version
+    is quadratic and only runs on the first `-n` / 50 tweets.
+    """
+    import pandas as pd
+    from tweet_frame import build_frame, colnames
+    tweets = synthetic_parsed(args.script03dir, args.n)
+    few = tweets[:max(1, args.n // 50)]
+    
+    def per_tweet():
+        df = pd.DataFrame(columns = colnames)
+        for tweet in few:
+            if tweet.get('contain_address') == True:
+                subset_tweet = {k:v for k, v in tweet.items() if k in colnames}
+                df = pd.concat([df, pd.DataFrame.from_records(subset_tweet, index = [0])], 
+                               sort = True)
+        return df
+    seconds, _ = best_time(per_tweet, 1)
+    report("concat per tweet", len(few), seconds)
+    seconds, df = best_time(lambda: build_frame(tweets), args.repeat)
+    report("build_frame (columns)", len(tweets), seconds)
+    print("{} rows, dtypes: {}".format(len(df), ", ".join(
+        "{}={}".format(c, df[c].dtype) for c in ("id", "lat", "lng", "created_at"))))
+
+
+class StageTimer(object):
+    """
+    Accumulate the time, items processed and peak RSS of each stage of the
+    `stages` benchmark over repeated calls.
+    """
+
+    def __init__(self):
+        self.stats = {} # stage -> [items, seconds, peak RSS]
+        self.order = []
+
+    def run(self, name, fn, items, *args, count = len):
+        """
+        Return fn(items, *args), counting count(items) items for stage `name`.
+        """
+        if name not in self.stats:
+            self.stats[name] = [0, 0., 0]
+            self.order.append(name)
+        reset_peak_rss()
+        start = time.perf_counter()
+        result = fn(items, *args)
+        seconds = time.perf_counter() - start
+        stat = self.stats[name]
+        stat[0] += count(items)
+        stat[1] += seconds
+        stat[2] = max(stat[2], peak_rss())
+        return result
+
+    def report(self, units):
+        print("{:<16} {:>10} {:>10} {:>14} {:>12}".format(
+            "stage", "items", "seconds", "items/s", "peak RSS"))
+        for name in self.order:
+            n, seconds, rss = self.stats[name]
+            print("{:<16} {:>10,} {:>10.3f} {:>14,.0f} {:>9.0f} MB  ({})".format(
+                name, n, seconds, n / seconds if seconds else 0., rss / 1e6, units.get(name, "")))
+
+
+def write_table(columns, outdir):
+    """
+    The writer of 04_convert_to_csv.py: the typed table of the column
+    buffers, saved as CSV and, if pyarrow is installed, as a Parquet dataset.
+    """
+    from tweet_frame import merge_columns, to_frame
+    df = to_frame(merge_columns(columns))
+    df.to_csv(os.path.join(outdir, "PizzaToThePolls.csv"))
+    try:
+        from tweet_store import write_store
+    except ImportError:
+        return df
+    write_store(df, os.path.join(outdir, "store"))
+    return df
+
+
+def assign_districts(columns, outdir):
+    """
+    The district column of 04_convert_to_csv.py, for every geocoded row:
+    looked up by county, else tested against the CD polygons.
+    """
+    import pandas as pd
+    from districts import add_districts
+    df = pd.DataFrame({name: [x for part in columns for x in part[name]]
+                       for name in ("lat", "lng", "county", "state_abbv")})
+    df[["lat", "lng"]] = df[["lat", "lng"]].astype(float)
+    return add_districts(df, shpdir)
+
+
+def assign_sites(columns, outdir):
+    """
+    The site_id column of 04_convert_to_csv.py and the table of deliveries
+    per site.
+    """
+    import pandas as pd
+    from sites import add_sites, write_sites
+    df = pd.DataFrame({name: [x for part in columns for x in part[name]]
+                       for name in ("lat", "lng", "st_num", "route", "city", "county",
+                                    "zipcode", "state_abbv")})
+    df[["lat", "lng"]] = df[["lat", "lng"]].astype(float)
+    df = add_sites(df)
+    write_sites(df, os.path.join(outdir, "PizzaToThePolls_sites.csv"))
+    return df
+
+
+# shapefiles of the district stage, set from -shpdir
+shpdir = "data/shp"
+
+# stages run once on the table of all geocoded tweets: name -> fn(columns, outdir);
+# the district stage is added if -shpdir holds its inputs
+table_stages = [("writer", write_table), ("sites", assign_sites)]
+
+
+def synthetic_corpus(args):
+    """
+    Return the sorted paths of the raw pages of the synthetic corpus in
+    `args.corpus`, generating a corpus of `args.scale` first if there is none.
+    """
+    import synthetic
+    if not os.path.isdir(args.corpus) or not os.listdir(args.corpus):
+        profile = synthetic.profile_corpus(args.rawdir)
+        print("Profile: {}".format(synthetic.profile_summary(profile)))
+        start = time.perf_counter()
+        n, size = synthetic.write_corpus(args.corpus, synthetic.generate_pages(
+            profile, scale = args.scale, seed = args.seed))
+        print("Generated {} pages, {:.1f} MB in {:.1f} s".format(
+            n, size / 1e6, time.perf_counter() - start))
+    return sorted(os.path.join(args.corpus, f) for f in os.listdir(args.corpus)
+                  if f.startswith("search_resp"))
+
+
+@benchmark("stages")
+def bench_stages(args):
+    """
+    Every stage of the pipeline on the synthetic corpus, page by page:
+    reading the raw pages, `clean_tweet`, `find_address`, `parse_address`
+    on offline responses for each distinct query, then the `table_stages`
+    (the CSV and columnar writer) on all geocoded tweets. Reports the
+    throughput and peak RSS of each stage.
+    """
+    import raw_archive
+    import synthetic
+    from address_filter import contain_address
+    from address_parser import build_xml, parse_many
+    from address_query import address_query
+    from tweet_frame import collect_columns
+    from tweet_text import clean_tweets
+    
+    pages = synthetic_corpus(args)
+    places = synthetic.profile_corpus(args.rawdir, args.script03dir)['places']
+    timer = StageTimer()
+    geocoded = {} # query -> parsed address
+    columns = []
+    
+    def read_page(path):
+        return raw_archive.project_page(raw_archive.read_page(path))
+    
+    def find(queries):
+        return [contain_address(q) and address_query(q) for q in queries]
+    
+    start = time.perf_counter()
+    for path in pages:
+        tweets, _ = timer.run("read", read_page, path, count = lambda path: 0)
+        timer.stats["read"][0] += len(tweets)
+        texts = [tweet['text'] for tweet in tweets]
+        queries = timer.run("clean_tweet", clean_tweets, texts)
+        found = timer.run("find_address", find, queries)
+        
+        # the Geocoding API is replaced by offline responses, not timed
+        new = sorted(set(q for q in found if q and q not in geocoded))
+        responses = [build_xml(synthetic.fake_geocode(q, places)) for q in new]
+        parsed = timer.run("parse_address", parse_many, responses)
+        geocoded.update(zip(new, parsed))
+        
+        for tweet, query, address in zip(tweets, queries, found):
+            tweet['clean_text'] = query
+            if address:
+                tweet['contain_address'] = True
+                tweet.update(geocoded[address])
+        columns.append(timer.run("collect", collect_columns, tweets))
+    
+    rows = sum(len(part['id']) for part in columns)
+    with tempfile.TemporaryDirectory() as outdir:
+        for name, fn in table_stages:
+            timer.run(name, fn, columns, outdir, count = lambda columns: rows)
+    elapsed = time.perf_counter() - start
+    
+    timer.report({"read": "tweets", "clean_tweet": "tweets", "find_address": "tweets",
+                  "parse_address": "distinct queries", "collect": "tweets",
+                  **{name: "rows" for name, _ in table_stages}})
+    print("{} pages, {} tweets, {} geocoded rows in {:.1f} s".format(
+        len(pages), timer.stats["clean_tweet"][0], rows, elapsed))
+
+
+@benchmark("shapefiles")
+def bench_shapefiles(args):
+    """
+    Loading the layers in -shpdir: the attribute table with every column
+    decoded, and the geometry parsed from the .shp file (cold), then from
+    the cache of parsed geometries (warm).
+    """
+    import glob
+    from shapefile import Table, read_geometry
+    with tempfile.TemporaryDirectory() as cachedir:
+        for path in sorted(glob.glob(os.path.join(args.shpdir, "*", "*.dbf"))):
+            name = os.path.basename(os.path.dirname(path))
+            start = time.perf_counter()
+            table = Table(path)
+            for field in table.names:
+                table.column(field)
+            report("{} dbf".format(name)[:32], len(table), time.perf_counter() - start, unit = "records")
+            shp = os.path.splitext(path)[0] + ".shp"
+            if not os.path.exists(shp):
+                continue
+            for label in ("cold", "warm"):
+                start = time.perf_counter()
+                geometry = read_geometry(shp, cachedir)
+                report("{} shp ({})".format(name, label)[:32], len(geometry.coords),
+                       time.perf_counter() - start, unit = "vertices")
+
+
+@benchmark("districts")
+def bench_districts(args):
+    """
+    District assignment of `-n` points spread uniformly over the contiguous
+    states, once on a fresh index (every grid cell is prepared) and once more
+    on the same points (every cell is ready).
+    """
+    import numpy as np
+    from districts import DistrictIndex, cd_shapefile
+    path = os.path.join(args.shpdir, cd_shapefile)
+    if not os.path.exists(path):
+        print("{} does not exist; skipped".format(path))
+        return
+    start = time.perf_counter()
+    index = DistrictIndex.from_shapefile(path)
+    print("{}: read in {:.2f} s".format(path, time.perf_counter() - start))
+    rng = np.random.default_rng(args.seed)
+    lat = rng.uniform(24.5, 49.5, args.n)
+    lng = rng.uniform(-125., -66.9, args.n)
+    for label in ("cold", "warm"):
+        start = time.perf_counter()
+        found = index.assign(lat, lng)
+        report("districts ({})".format(label), args.n, time.perf_counter() - start, unit = "points")
+    print("{:.1%} of the points in a district; {}".format((found >= 0).mean(), index.summary()))
+
+
+
+@benchmark("sites")
+def bench_sites(args):
+    """
+    Delivery sites of `-n` tweets at n / 10 polling places spread over the
+    contiguous states, each tweet a few metres off its place and spelling
+    the route one of two ways.
+    """
+    import numpy as np
+    import pandas as pd
+    from sites import site_ids, site_table
+    rng = np.random.default_rng(args.seed)
+    n_places = max(args.n // 10, 1)
+    place = rng.integers(0, n_places, args.n)
+    lat = rng.uniform(24.5, 49.5, n_places)[place] + rng.normal(0, 1e-4, args.n)
+    lng = rng.uniform(-125., -66.9, n_places)[place] + rng.normal(0, 1e-4, args.n)
+    df = pd.DataFrame({"lat": lat, "lng": lng, "st_num": (place % 9973 + 1).astype(str),
+                       "route": np.where(rng.random(args.n) < 0.5, "Main Street", "Main St."),
+                       "city": (place // 9973).astype(str), "state_abbv": "NY"})
+    start = time.perf_counter()
+    df['site_id'] = site_ids(df)
+    report("site_id", args.n, time.perf_counter() - start)
+    start = time.perf_counter()
+    sites = site_table(df)
+    report("site table", args.n, time.perf_counter() - start)
+    print("{} sites for {} polling places".format(len(sites), n_places))
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description = 'Benchmark pipeline stages')
+    parser.add_argument('names', nargs = "*",
+                        help = 'Benchmarks to run: {}'.format(", ".join(sorted(benchmarks))),
+                        default = sorted(benchmarks))
+    parser.add_argument('-script01dir', type = str,
+                        help = 'Directory storing outputs from 01_scrape_twitter.py',
+                        default = 'data/tweets/01_scraped')
+    parser.add_argument('-script03dir', type = str,
+                        help = 'Directory storing outputs from 03_parse_address.py',
+                        default = 'data/tweets/03_parsed')
+    parser.add_argument('-cache', type = str,
+                        help = 'SQLite file of the geocode cache with recorded responses',
+                        default = 'data/tweets/geocode_cache.sqlite')
+    parser.add_argument('-n', type = int,
+                        help = 'Tweets in the synthetic corpus',
+                        default = 100000)
+    parser.add_argument('-rawdir', type = str,
+                        help = 'Raw search pages the synthetic corpus is modeled on',
+                        default = 'data/tweets/raw')
+    parser.add_argument('-corpus', type = str,
+                        help = 'Directory of the synthetic corpus; generated at -scale if empty',
+                        default = 'data/synthetic/raw')
+    parser.add_argument('-scale', type = float,
+                        help = 'Size of a generated corpus relative to Election Day',
+                        default = 10)
+    parser.add_argument('-seed', type = int,
+                        help = 'Seed of the synthetic corpus',
+                        default = 0)
+    parser.add_argument('-repeat', type = int,
+                        help = 'Runs of each benchmark; the best time is reported',
+                        default = 3)
+    parser.add_argument('-shpdir', type = str,
+                        help = 'Directory storing shp files, for `shapefiles`, `districts` and `stages`',
+                        default = shpdir)
+    args = parser.parse_args()
+    
+    shpdir = args.shpdir
+    if (os.path.exists(os.path.join(shpdir, "cb_2018_us_cd116_500k/cb_2018_us_cd116_500k.shp")) or
+            os.path.exists(os.path.join(shpdir, "cb_2018_us_county_within_cd116_500k"))):
+        table_stages.append(("district", assign_districts))
+
+    for name in args.names:
+        print("== {}".format(name))
+        benchmarks[name](args)
+    sys.exit()
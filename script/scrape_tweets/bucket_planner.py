@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Plan the time slices requested by 01_scrape_twitter.py from the
+responses of the counts endpoint.
+Quiet hours are requested as a whole, while busy hours are split into
+slices that each hold about one page of results, so that the slices can be
+requested in parallel instead of as one long chain of 'next' tokens.
+"""
+
+from datetime import datetime, timedelta
+
+date_format = "%Y%m%d%H%M"
+
+
+def to_date(timePeriod):
+    return datetime.strptime(timePeriod, date_format)
+
+
+def to_period(date):
+    return datetime.strftime(date, date_format)
+
+
+def pack_minutes(minute_counts, start, end, page_size):
+    """
+    Split the period `start` to `end` into consecutive slices holding
+    at most `page_size` tweets each according to `minute_counts`.
+    A single minute holding more than `page_size` tweets becomes a slice
+    of its own and is paginated as usual.
+    ---
+    minute_counts (list of {'timePeriod': 'YYYYMMDDHHMM', 'count': (int)})
+    start, end (datetime)
+    page_size (int, 'maxResults' of a search request)
+    """
+    slices = []
+    slice_start = start
+    total = 0
+    for minute in sorted(minute_counts, key = lambda x: x['timePeriod']):
+        when = to_date(minute['timePeriod'])
+        if when < start or when >= end:
+            continue
+        if total > 0 and total + minute['count'] > page_size:
+            slices.append((to_period(slice_start), to_period(when), total))
+            slice_start = when
+            total = 0
+        total += minute['count']
+    slices.append((to_period(slice_start), to_period(end), total))
+    return slices
+
+
+def plan_slices(counts, page_size = 500, refine = None, width = 60):
+    """
+    Turn the `counts` response of the counts endpoint into a list of
+    (fromDate, toDate, expected count) slices covering every period with
+    tweets in it.
+    ======================
+    counts (list of {'timePeriod': 'YYYYMMDDHHMM', 'count': (int)})
+    page_size (int, 'maxResults' of a search request)
+    refine (function taking fromDate and toDate and returning minute counts;
+            busy periods are left whole if None)
+    width (int, minutes covered by one entry of `counts`)
+    """
+    slices = []
+    for count in sorted(counts, key = lambda x: x['timePeriod']):
+        if count['count'] == 0:
+            continue
+        start = to_date(count['timePeriod'])
+        end = start + timedelta(minutes = width)
+        if count['count'] <= page_size or refine is None:
+            slices.append((to_period(start), to_period(end), count['count']))
+        else:
+            minute_counts = refine(to_period(start), to_period(end))
+            slices.extend(pack_minutes(minute_counts, start, end, page_size))
+    return slices
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Append-only journal of the search pages saved by 01_scrape_twitter.py.
+Each line records one page of one bucket together with the 'next' token
+returned with it, so an interrupted scrape can pick up where it stopped.
+"""
+
+import json
+import os
+import threading
+
+
+class Journal(object):
+    """
+    Journal of completed pages, stored as one JSON object per line:
+        {"bucket": "<fromDate>-<toDate>", "page": (int), "next": (str or 0)}
+    A bucket is complete once the recorded 'next' of its last page is 0.
+    ---
+    path (str, path to the journal file)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.pages = {}
+        self.lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, "r") as j:
+                for line in j:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # a half-written last line from a crash
+                        continue
+                    # pages of a bucket are recorded in order, so the
+                    # last line for a bucket is its latest page
+                    self.pages[entry['bucket']] = (entry['page'], entry['next'])
+
+    def record(self, bucket, page, next_):
+        """
+        Record that `page` of `bucket` is saved to disk.
+        Only call this after both output files are written.
+        """
+        line = json.dumps({'bucket': bucket, 'page': page, 'next': next_})
+        with self.lock:
+            with open(self.path, "a") as j:
+                j.write(line + "\n")
+                j.flush()
+                os.fsync(j.fileno())
+            self.pages[bucket] = (page, next_)
+
+    def last_page(self, bucket):
+        """
+        Return (page, next_) for the last saved page of `bucket`,
+        or None if no page of the bucket was saved.
+        """
+        with self.lock:
+            return self.pages.get(bucket)
+
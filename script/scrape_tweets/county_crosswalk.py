@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+County to congressional district crosswalk, from the attribute tables of
+data/shp/cb_2018_us_county_within_cd116_500k (one record per part of a
+county in a district, PARTFLG 'Y' if the county is split) and
+data/shp/cb_2017_us_county_500k (county names).
+
+A tweet whose geocoded `county` lies entirely inside one district gets
+that district from the table; only tweets in split counties need the
+polygons of districts.py. The table is written to
+data/csv/county_district_crosswalk.csv with one row per county:
+`district` is empty for split counties, `districts` lists every district
+the county is part of.
+
+$ python script/scrape_tweets/county_crosswalk.py
+"""
+
+import argparse
+import csv
+import os
+import sys
+sys.path.append(os.getcwd() + "/script")
+from manifest import Manifest
+sys.path.append(os.getcwd() + "/script/scrape_wiki")
+from us_states_list import fips_dict
+sys.path.append(os.getcwd() + "/script/scrape_tweets")
+from shapefile import read_dbf
+
+# attribute tables within the directory of shp files
+within_dbf = "cb_2018_us_county_within_cd116_500k/cb_2018_us_county_within_cd116_500k.dbf"
+county_dbf = "cb_2017_us_county_500k/cb_2017_us_county_500k.dbf"
+
+default_path = "data/csv/county_district_crosswalk.csv"
+
+# legal/statistical area of the counties (LSAD) -> suffix of their full name,
+# as in the `county` returned by the Geocoding API, e.g. "Hudson County"
+lsad_suffix = {"03": "City and Borough", "04": "Borough", "05": "Census Area",
+               "06": "County", "12": "Municipality", "13": "Municipio",
+               "15": "Parish", "25": "city"}
+
+columns = ("state_abbv", "county", "geoid", "district", "districts")
+
+
+def county_key(state_abbv, county):
+    """
+    Return the key of a county in the crosswalk, e.g. ('MO', 'st louis city').
+    """
+    return (state_abbv, " ".join(county.replace(".", "").lower().split()))
+
+
+def build_table(shpdir):
+    """
+    Return the rows of the crosswalk (dictionaries with `columns`), from
+    the attribute tables in `shpdir`.
+    """
+    _, counties = read_dbf(os.path.join(shpdir, county_dbf))
+    _, parts = read_dbf(os.path.join(shpdir, within_dbf))
+
+    districts = {} # county GEOID -> districts it is part of
+    split = set()
+    for part in parts:
+        geoid = part['STATEFP'] + part['COUNTYFP']
+        number = next(value for name, value in part.items()
+                      if name.startswith("CD") and name.endswith("FP"))
+        districts.setdefault(geoid, []).append(
+            "{}-{}".format(fips_dict.get(part['STATEFP'], part['STATEFP']), number))
+        if part['PARTFLG'] == "Y":
+            split.add(geoid)
+
+    rows = []
+    for county in counties:
+        suffix = lsad_suffix.get(county['LSAD'])
+        within = sorted(set(districts.get(county['GEOID'], [])))
+        whole = len(within) == 1 and county['GEOID'] not in split
+        rows.append({"state_abbv": fips_dict.get(county['STATEFP'], county['STATEFP']),
+                     "county": county['NAME'] + " " + suffix if suffix else county['NAME'],
+                     "geoid": county['GEOID'],
+                     "district": within[0] if whole else "",
+                     "districts": ";".join(within)})
+    return sorted(rows, key = lambda row: row['geoid'])
+
+
+def write_table(rows, path = default_path):
+    with open(path, "w", newline = "") as f:
+        writer = csv.DictWriter(f, fieldnames = columns)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def load_crosswalk(path = default_path, shpdir = "data/shp"):
+    """
+    Return {county_key: district} for the counties inside a single district
+    and None for split counties, from the table at `path`, or built from
+    `shpdir` if there is no table. Counties are also keyed by their name
+    without suffix (e.g. 'hudson') where that name is unique in the state.
+    """
+    if os.path.exists(path):
+        with open(path, newline = "") as f:
+            rows = list(csv.DictReader(f))
+    else:
+        rows = build_table(shpdir)
+    crosswalk = {}
+    short = {}
+    for row in rows:
+        district = row['district'] or None
+        crosswalk[county_key(row['state_abbv'], row['county'])] = district
+        name = county_key(row['state_abbv'], row['county'].rsplit(" ", 1)[0])
+        short[name] = None if name in short else district
+    for key, district in short.items():
+        crosswalk.setdefault(key, district)
+    return crosswalk
+
+
+def lookup(crosswalk, state_abbv, county):
+    """
+    Return the district of the `county` of `state_abbv` (sequences of
+    strings, None where missing), None where the county is split or unknown.
+    """
+    get = crosswalk.get
+    return [get(county_key(state, name)) if isinstance(state, str) and isinstance(name, str) else None
+            for state, name in zip(state_abbv, county)]
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description = 'Build the county to congressional district crosswalk')
+    parser.add_argument('-shpdir', type = str,
+                        help = "Directory storing shp files",
+                        default = "data/shp")
+    parser.add_argument('-out', type = str,
+                        help = "Crosswalk table",
+                        default = default_path)
+    parser.add_argument('-manifest', type = str,
+                        help = 'Manifest of built files; nothing is rebuilt if no input or code changed',
+                        default = 'data/manifest.json')
+    parser.add_argument('-force',
+                        help = 'Rebuild even if up to date',
+                        action = "store_true")
+    args = parser.parse_args()
+
+    inputs = [os.path.join(args.shpdir, within_dbf), os.path.join(args.shpdir, county_dbf)]
+    manifest = Manifest(args.manifest, "county_crosswalk", sources = [__file__, read_dbf],
+                        force = args.force)
+    if manifest.fresh(args.out, inputs):
+        print("{} is up to date".format(args.out))
+        sys.exit()
+    rows = build_table(args.shpdir)
+    write_table(rows, args.out)
+    manifest.record(args.out, inputs)
+    manifest.save()
+    whole = sum(1 for row in rows if row['district'])
+    print("{} counties, {} inside a single district, {} split".format(
+        len(rows), whole, len(rows) - whole))
+    sys.exit()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Collapse retweets and near-duplicate tweets so that stages 02 and 03 only
+process each distinct text once and fan the result out to every tweet.
+Exact duplicates share the cleaned text without the retweet marker;
+near duplicates (e.g. retweets truncated at 140 characters) are found with
+MinHash signatures and locality sensitive hashing over word shingles.
+"""
+
+import random
+import re
+import zlib
+
+rt_prefix = re.compile(r"^RT ")
+
+# modulus of the MinHash permutations (a Mersenne prime above 2**32)
+prime = (1 << 61) - 1
+
+
+def text_key(clean_text):
+    """
+    Key of exact duplicates: the cleaned text without the retweet marker.
+    """
+    return rt_prefix.sub("", clean_text)
+
+
+def shingles(key, size = 3):
+    """
+    Return the set of `size`-word shingles of `key` (the words themselves
+    if `key` has fewer words).
+    """
+    words = key.lower().split()
+    if len(words) < size:
+        return set(words)
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def jaccard(a, b):
+    if not a and not b:
+        return 1.
+    return len(a & b) / len(a | b)
+
+
+class Deduplicator(object):
+    """
+    Assigns every text the key of its representative, the first text seen
+    among its duplicates.
+    ---
+    threshold (float, Jaccard similarity of shingles above which two texts
+               are near duplicates; None to collapse exact duplicates only)
+    verify (function taking two keys, returning False if the texts must be
+            kept apart even when similar, e.g. when their addresses differ)
+    num_perm (int, length of the MinHash signature)
+    bands (int, LSH bands; must divide num_perm)
+    """
+
+    def __init__(self, threshold = 0.8, verify = None, num_perm = 64, bands = 16,
+                 seed = 1):
+        self.threshold = threshold
+        self.verify = verify
+        self.bands = bands
+        self.rows = num_perm // bands
+        rng = random.Random(seed)
+        self.perms = [(rng.randrange(1, prime), rng.randrange(0, prime))
+                      for _ in range(num_perm)]
+        self.exact = {}      # key -> representative key
+        self.buckets = {}    # (band, band signature) -> representative keys
+        self.shingles = {}   # representative key -> shingles
+        self.seen = 0
+        self.near = 0
+
+    def signature(self, grams):
+        hashes = [zlib.crc32(g.encode("utf-8")) for g in grams] or [0]
+        return [min((a * h + b) % prime for h in hashes) for a, b in self.perms]
+
+    def add(self, clean_text):
+        """
+        Record one tweet and return the key of its representative.
+        """
+        self.seen += 1
+        key = text_key(clean_text)
+        if key in self.exact:
+            return self.exact[key]
+        if self.threshold is None:
+            self.exact[key] = key
+            return key
+
+        grams = shingles(key)
+        sig = self.signature(grams)
+        bands = [(b, tuple(sig[b * self.rows:(b + 1) * self.rows]))
+                 for b in range(self.bands)]
+        candidates = []
+        for band in bands:
+            for rep in self.buckets.get(band, ()):
+                if rep not in candidates:
+                    candidates.append(rep)
+        for rep in candidates:
+            if (jaccard(grams, self.shingles[rep]) >= self.threshold and
+                    (self.verify is None or self.verify(key, rep))):
+                self.exact[key] = rep
+                self.near += 1
+                return rep
+
+        self.exact[key] = key
+        self.shingles[key] = grams
+        for band in bands:
+            self.buckets.setdefault(band, []).append(key)
+        return key
+
+    def stats(self):
+        """
+        Return a dictionary of tweets seen, distinct texts, and
+        representatives (texts left after collapsing near duplicates).
+        """
+        reps = len(set(self.exact.values()))
+        return {"tweets": self.seen,
+                "distinct": len(self.exact),
+                "representatives": reps,
+                "near": self.near,
+                "ratio": self.seen / reps if reps else 0.}
+
+    def summary(self):
+        s = self.stats()
+        return ("{tweets} tweets, {distinct} distinct texts, {representatives} after "
+                "collapsing near duplicates; duplicate-to-unique ratio {ratio:.2f}").format(**s)
@@ -0,0 +1,411 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Assign geocoded tweets to the congressional district they fall in, e.g.
+`NJ-08` as in data/csv/house_elections_2018.csv: the districts of the
+116th Congress, as elected in 2018 (at-large districts are `-00`, the
+non-voting delegates of DC and the territories `-98`). Tweets whose
+county lies inside a single district are looked up in the crosswalk of
+county_crosswalk.py and only the others are tested against the polygons
+of data/shp/cb_2018_us_cd116_500k, so both give the same districts
+(Pennsylvania's were redrawn after the 115th).
+
+The polygons are read once and their edges bucketed into a uniform grid
+of `cell` degrees. A cell is prepared the first time a point falls in it:
+the edges that cross the cell, and whether the centre of the cell is
+inside each district, from where the edges cross the centre line of its
+row (sorted once per row). A cell crossed by no edge lies in a single
+district and its points are labelled by a lookup; in the others, a point
+is inside a district if the centre is and the path from the point to the
+centre crosses the district's edges an even number of times, which is
+tested at once for a whole batch of points against the edges of their
+cells.
+
+$ python script/scrape_tweets/districts.py -csv data/csv/PizzaToThePolls.csv
+"""
+
+import argparse
+import functools
+import logging
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+sys.path.append(os.getcwd() + "/script/scrape_wiki")
+from us_states_list import fips_dict
+sys.path.append(os.getcwd() + "/script/scrape_tweets")
+from shapefile import read_shapefile
+import county_crosswalk
+
+log = logging.getLogger(__name__)
+
+# districts of the 116th Congress, elected in 2018, within the directory of shp
+# files; the same districts as the county crosswalk
+cd_shapefile = "cb_2018_us_cd116_500k/cb_2018_us_cd116_500k.shp"
+
+
+# district of the cells crossed by edges, whose points are tested one by one
+MIXED = -2
+
+
+def district_labels(table):
+    """
+    Return the districts of the records of a CD shapefile's Table, e.g. 'NJ-08'.
+    """
+    number = next(name for name in table.names if name.startswith("CD") and name.endswith("FP"))
+    return ["{}-{}".format(fips_dict.get(state, state), n)
+            for state, n in zip(table.column('STATEFP').tolist(), table.column(number).tolist())]
+
+
+def group(keys, ids):
+    """
+    Return (sorted distinct keys, offsets, ids ordered by key): the ids of
+    key k are ids[offsets[n]:offsets[n + 1]] where keys[n] == k.
+    """
+    order = np.argsort(keys, kind = "stable")
+    unique, first = np.unique(keys[order], return_index = True)
+    return unique, np.append(first, len(keys)), ids[order]
+
+
+def lookup(grouped, key):
+    """
+    Return the ids of `key` in the result of `group`.
+    """
+    unique, offsets, ids = grouped
+    n = np.searchsorted(unique, key)
+    if n == len(unique) or unique[n] != key:
+        return ids[:0]
+    return ids[offsets[n]:offsets[n + 1]]
+
+
+def spread(lo, hi):
+    """
+    Return (index of the range, value) over the integer ranges [lo, hi].
+    """
+    lengths = hi - lo + 1
+    which = np.repeat(np.arange(len(lo)), lengths)
+    starts = np.repeat(lengths.cumsum() - lengths, lengths)
+    return which, lo[which] + np.arange(lengths.sum()) - starts
+
+
+class DistrictIndex(object):
+    """
+    Grid index over the polygons of a shapefile.Geometry, named by `labels`.
+    ---
+    cell (float, side of the grid cells in degrees)
+    chunk (int, point-edge pairs tested at once)
+    """
+
+    def __init__(self, labels, geometry, cell = 0.1, chunk = 1 << 21):
+        self.labels = np.array(labels, dtype = object)
+        self.cell = cell
+        self.chunk = chunk
+        self.rows = int(np.ceil(180. / cell)) + 1
+        # sorted keys of the prepared cells and their slot in the arrays
+        # below, which grow as cells are prepared: the district of the cell
+        # (-1 outside every district, MIXED if edges cross it), its edges
+        # and its candidate districts with whether the centre is inside
+        self.keys = np.zeros(0, dtype = np.int64)
+        self.slots = np.zeros(0, dtype = np.int64)
+        self.label = np.zeros(0, dtype = np.int64)
+        self.edge_start = self.edge_stop = np.zeros(0, dtype = np.int64)
+        self.candidate_start = self.candidate_stop = np.zeros(0, dtype = np.int64)
+        self.cell_edge = np.zeros(0, dtype = np.int64)
+        # latitude where each edge of a cell crosses the vertical line
+        # through the centre (NaN if it does not)
+        self.cell_yint = np.zeros(0)
+        self.candidate = np.zeros(0, dtype = np.int64)
+        self.centre_inside = np.zeros(0, dtype = bool)
+        # row -> (sorted longitudes where the edges cross the row's centre line, districts)
+        self.row_crossings = {}
+        # points labelled by the lookup of their cell alone
+        self.hits = 0
+
+        # every edge of every ring, with the district it belongs to; rings
+        # that do not repeat their first vertex are closed
+        coords = np.asarray(geometry.coords)
+        starts, stops = geometry.rings[:-1], geometry.rings[1:]
+        ring = np.repeat(np.arange(len(starts)), stops - starts)
+        last = stops[stops > starts] - 1
+        follows = np.ones(len(coords), dtype = bool)
+        follows[last] = False
+        a = np.flatnonzero(follows)
+        b = a + 1
+        full = stops > starts
+        unclosed = full & (coords[np.minimum(starts, len(coords) - 1)] !=
+                           coords[np.maximum(stops - 1, 0)]).any(axis = 1)
+        a = np.concatenate([a, stops[unclosed] - 1])
+        b = np.concatenate([b, starts[unclosed]])
+        self.x1, self.y1 = coords[a, 0], coords[a, 1]
+        self.x2, self.y2 = coords[b, 0], coords[b, 1]
+        self.edge_poly = geometry.ring_shape()[ring[a]]
+        self.edge_count = len(self.x1)
+
+        # every edge in the cells and rows its bounding box spans
+        i0 = self.column(np.minimum(self.x1, self.x2))
+        i1 = self.column(np.maximum(self.x1, self.x2))
+        j0 = self.row(np.minimum(self.y1, self.y2))
+        j1 = self.row(np.maximum(self.y1, self.y2))
+        edges, j = spread(j0, j1)
+        self.row_edges = group(j, edges)
+        which, i = spread(i0[edges], i1[edges])
+        self.cell_edges = group(i * self.rows + j[which], edges[which])
+
+    @classmethod
+    def from_shapefile(cls, path, **kwargs):
+        """
+        Read the CD shapefile at `path` into an index.
+        """
+        table, geometry = read_shapefile(path)
+        return cls(district_labels(table), geometry, **kwargs)
+
+    def column(self, lng):
+        return np.floor((lng + 180.) / self.cell).astype(np.int64)
+
+    def row(self, lat):
+        return np.floor((lat + 90.) / self.cell).astype(np.int64)
+
+    def cell_key(self, lat, lng):
+        """
+        Return the grid keys of the points, -1 for missing coordinates.
+        """
+        keys = np.floor((lng + 180.) / self.cell) * self.rows + np.floor((lat + 90.) / self.cell)
+        keys[~np.isfinite(keys)] = -1
+        return keys.astype(np.int64)
+
+    def crossings(self, j):
+        """
+        Return (sorted longitudes, districts) of the edges crossing the
+        centre line of row `j`, computed once per row.
+        """
+        found = self.row_crossings.get(j)
+        if found is None:
+            cy = (j + .5) * self.cell - 90.
+            edges = lookup(self.row_edges, j)
+            x1, y1, x2, y2 = self.x1[edges], self.y1[edges], self.x2[edges], self.y2[edges]
+            crossed = (y1 > cy) != (y2 > cy)
+            x1, y1, x2, y2 = x1[crossed], y1[crossed], x2[crossed], y2[crossed]
+            xint = x1 + (cy - y1) * (x2 - x1) / (y2 - y1)
+            order = np.argsort(xint)
+            found = self.row_crossings[j] = (xint[order], self.edge_poly[edges[crossed]][order])
+        return found
+
+    def prepare(self, key):
+        """
+        Return (district, edges, candidate districts, whether the centre is
+        inside each candidate) of the cell of grid key `key`; the district
+        is MIXED if edges cross the cell.
+        """
+        i, j = divmod(key, self.rows)
+        cx = (i + .5) * self.cell - 180.
+
+        # the centre is inside the districts whose edges a ray from it
+        # towards +x crosses an odd number of times
+        xint, poly = self.crossings(j)
+        parity = np.bincount(poly[np.searchsorted(xint, cx, side = "right"):],
+                             minlength = len(self.labels)) % 2
+        edges = lookup(self.cell_edges, key)
+        if not len(edges):
+            inside = np.flatnonzero(parity)
+            return (inside[0] if len(inside) else -1), edges, inside[:0], np.zeros(0, dtype = bool)
+        polys = np.union1d(np.flatnonzero(parity), self.edge_poly[edges])
+        return MIXED, edges, polys, parity[polys].astype(bool)
+
+    def vertical_crossings(self, keys, edges):
+        """
+        Return the latitudes where the `edges` cross the vertical line
+        through the centre of the cells of grid `keys`, NaN if they do not.
+        """
+        cx = (keys // self.rows + .5) * self.cell - 180.
+        x1, y1, x2, y2 = self.x1[edges], self.y1[edges], self.x2[edges], self.y2[edges]
+        with np.errstate(divide = "ignore", invalid = "ignore"):
+            yint = y1 + (cx - x1) * (y2 - y1) / (x2 - x1)
+        yint[(x1 > cx) == (x2 > cx)] = np.nan
+        return yint
+
+    def prepare_all(self, keys):
+        """
+        Prepare the cells of the grid `keys` that are not prepared yet.
+        """
+        keys = np.setdiff1d(keys, self.keys)
+        if not len(keys):
+            return
+        labels, edges, candidates, inside = zip(*[self.prepare(key) for key in keys])
+        first = len(self.label)
+        self.label = np.append(self.label, labels)
+        lengths = np.array([len(e) for e in edges], dtype = np.int64)
+        stops = len(self.cell_edge) + lengths.cumsum()
+        self.edge_start = np.append(self.edge_start, stops - lengths)
+        self.edge_stop = np.append(self.edge_stop, stops)
+        self.cell_edge = np.concatenate([self.cell_edge] + list(edges))
+        self.cell_yint = np.concatenate([self.cell_yint, self.vertical_crossings(
+            np.repeat(keys, lengths), self.cell_edge[len(self.cell_yint):])])
+        lengths = np.array([len(c) for c in candidates], dtype = np.int64)
+        stops = len(self.candidate) + lengths.cumsum()
+        self.candidate_start = np.append(self.candidate_start, stops - lengths)
+        self.candidate_stop = np.append(self.candidate_stop, stops)
+        self.candidate = np.concatenate([self.candidate] + list(candidates))
+        self.centre_inside = np.concatenate([self.centre_inside] + list(inside))
+        keys = np.concatenate([self.keys, keys])
+        slots = np.concatenate([self.slots, np.arange(first, len(self.label))])
+        order = np.argsort(keys)
+        self.keys, self.slots = keys[order], slots[order]
+
+    def assign_mixed(self, lat, lng, keys, slots):
+        """
+        Return the district indices of points in cells crossed by edges.
+        A point is in a district if the centre of its cell is and the path
+        from the point horizontally to x = cx, then vertically to the
+        centre, crosses the district's edges an even number of times.
+        """
+        n = len(lat)
+        cx = (keys // self.rows + .5) * self.cell - 180.
+        cy = (keys % self.rows + .5) * self.cell - 90.
+
+        # every (point, edge of its cell) pair; the horizontal part of the
+        # path can only cross the edges that span the point's latitude
+        point, at = spread(self.edge_start[slots], self.edge_stop[slots] - 1)
+        edge = self.cell_edge[at]
+        py = lat[point]
+        spans = np.flatnonzero((self.y1[edge] > py) != (self.y2[edge] > py))
+        e, p = edge[spans], point[spans]
+        xint = self.x1[e] + (lat[p] - self.y1[e]) * (self.x2[e] - self.x1[e]) / (self.y2[e] - self.y1[e])
+        horizontal = spans[(xint >= np.minimum(lng[p], cx[p])) & (xint < np.maximum(lng[p], cx[p]))]
+        yint = self.cell_yint[at]
+        with np.errstate(invalid = "ignore"):
+            vertical = np.flatnonzero((yint >= np.minimum(py, cy[point])) &
+                                      (yint < np.maximum(py, cy[point])))
+        crossed = np.concatenate([horizontal, vertical])
+
+        # (point, district) pairs crossed an odd number of times
+        crossed_keys, counts = np.unique(point[crossed] * len(self.labels) +
+                                         self.edge_poly[edge[crossed]], return_counts = True)
+        odd = crossed_keys[counts % 2 == 1]
+
+        # the first candidate of each point that contains it
+        point, at = spread(self.candidate_start[slots], self.candidate_stop[slots] - 1)
+        flipped = np.isin(point * len(self.labels) + self.candidate[at], odd)
+        inside = self.centre_inside[at] ^ flipped
+        out = np.full(n, -1, dtype = np.int64)
+        found, first = np.unique(point[inside], return_index = True)
+        out[found] = self.candidate[at[inside][first]]
+        return out
+
+    def assign(self, lat, lng):
+        """
+        Return the indices into `labels` of the districts of the points
+        (arrays of latitudes and longitudes), -1 outside every district.
+        """
+        lat = np.asarray(lat, dtype = np.float64)
+        lng = np.asarray(lng, dtype = np.float64)
+        out = np.full(len(lat), -1, dtype = np.int64)
+        keys = self.cell_key(lat, lng)
+        valid = np.flatnonzero(keys >= 0)
+        self.prepare_all(np.unique(keys[valid]))
+        slots = self.slots[np.searchsorted(self.keys, keys[valid])]
+        label = self.label[slots]
+        out[valid] = label
+        self.hits += (label != MIXED).sum()
+
+        # the points in cells crossed by edges, in batches of about `chunk` pairs
+        mixed = np.flatnonzero(label == MIXED)
+        pairs = (self.edge_stop - self.edge_start)[slots[mixed]].cumsum()
+        bounds = np.searchsorted(pairs, np.arange(self.chunk, pairs[-1] if len(pairs) else 0,
+                                                  self.chunk))
+        for batch in np.split(mixed, bounds):
+            if len(batch):
+                points = valid[batch]
+                out[points] = self.assign_mixed(lat[points], lng[points],
+                                                keys[points], slots[batch])
+        return out
+
+    def districts(self, lat, lng):
+        """
+        Return the district labels of the points, None outside every district.
+        """
+        found = self.assign(lat, lng)
+        labels = np.append(self.labels, None)
+        return labels[found]
+
+    def summary(self):
+        return ("{} districts, {} edges; {} cells prepared ({} crossed by edges), "
+                "{} points labelled by lookup").format(
+                    len(self.labels), self.edge_count, len(self.keys),
+                    (self.label == MIXED).sum(), self.hits)
+
+
+@functools.lru_cache(maxsize = None)
+def load_index(path, cell = 0.1):
+    """
+    Return the DistrictIndex of the shapefile at `path`, read once per process.
+    """
+    start = time.perf_counter()
+    index = DistrictIndex.from_shapefile(path, cell = cell)
+    log.info("{} read in {:.2f} s".format(path, time.perf_counter() - start))
+    return index
+
+
+@functools.lru_cache(maxsize = None)
+def load_counties(shpdir):
+    """
+    Return the county crosswalk of county_crosswalk.py, empty if neither
+    its table nor the attribute tables in `shpdir` exist.
+    """
+    if not (os.path.exists(county_crosswalk.default_path) or
+            os.path.exists(os.path.join(shpdir, county_crosswalk.within_dbf))):
+        return {}
+    return county_crosswalk.load_crosswalk(shpdir = shpdir)
+
+
+def add_districts(df, shpdir = "data/shp"):
+    """
+    Return the DataFrame of tweet_frame.build_frame with a `district`
+    column: looked up from the geocoded county where it lies inside a
+    single district, else from the CD polygons if the shapefile is in
+    `shpdir` (None if it is not). Unchanged if neither is available.
+    """
+    path = os.path.join(shpdir, cd_shapefile)
+    counties = load_counties(shpdir)
+    if not counties and not os.path.exists(path):
+        log.warning("{} does not exist; no district column".format(path))
+        return df
+    district = np.array(county_crosswalk.lookup(counties, df['state_abbv'], df['county']),
+                        dtype = object)
+    rest = np.flatnonzero(pd.isna(district))
+    from_counties = len(district) - len(rest)
+    if len(rest) and os.path.exists(path):
+        index = load_index(path)
+        district[rest] = index.districts(df['lat'].to_numpy()[rest], df['lng'].to_numpy()[rest])
+    elif len(rest):
+        log.warning("{} does not exist; no district for tweets in split counties".format(path))
+    log.info("{} districts from the county crosswalk, {} from the polygons".format(
+        from_counties, len(rest) if os.path.exists(path) else 0))
+    return df.assign(district = district)
+
+
+if __name__ == "__main__":
+
+    logger = logging.getLogger()
+    logger.setLevel(logging.INFO)
+    handler = logging.StreamHandler()
+    handler.setLevel(logging.INFO)
+    logger.addHandler(handler)
+
+    parser = argparse.ArgumentParser(description = 'Count geocoded tweets by congressional district')
+    parser.add_argument('-csv', type = str,
+                        help = 'CSV file with lat, lng, county and state_abbv columns',
+                        default = "data/csv/PizzaToThePolls.csv")
+    parser.add_argument('-shpdir', type = str,
+                        help = 'Directory storing shp files',
+                        default = "data/shp")
+    args = parser.parse_args()
+
+    df = pd.read_csv(args.csv, usecols = ["lat", "lng", "county", "state_abbv"])
+    start = time.perf_counter()
+    df = add_districts(df, args.shpdir)
+    elapsed = time.perf_counter() - start
+    if 'district' in df:
+        print(df['district'].value_counts(dropna = False).to_string())
+    print("{} tweets in {:.3f} s".format(len(df), elapsed))
+    sys.exit()
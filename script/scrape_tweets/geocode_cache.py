@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Persistent SQLite cache of Geocoding API responses for 03_parse_address.py.
+Each entry keeps the raw response, its format ('xml' or 'json') and the
+parsed address dictionary, keyed by the normalized query, so reruns and
+re-parses cost no API calls. Readers parse the raw response again rather
+than trusting the stored address, so a change of the parser applies to
+cached geocodes too.
+
+$ python script/scrape_tweets/geocode_cache.py          # print cache size
+$ python script/scrape_tweets/geocode_cache.py -purge   # drop expired entries
+"""
+
+import argparse
+import json
+import sqlite3
+import sys
+import threading
+import time
+
+day = 24 * 60 * 60
+
+
+def response_format(response):
+    """
+    Return the format of a raw response, 'json' or 'xml', from its body;
+    for entries cached before the format was recorded.
+    """
+    return "json" if response is not None and response.lstrip().startswith(b"{") else "xml"
+
+
+def normalize_query(query):
+    """
+    Cache key of a geocode query: lower case, single spaces,
+    without the retweet marker.
+    """
+    words = query.lower().split()
+    if words[:1] == ["rt"]:
+        words = words[1:]
+    return " ".join(words)
+
+
+class GeocodeCache(object):
+    """
+    Cache stored in the SQLite database at `path`. Safe to share between
+    threads.
+    ---
+    ttl (float, days an entry stays valid; 0 for no expiry)
+    max_entries (int, entries kept; the least recently used are evicted;
+                 0 for no limit)
+    """
+
+    def __init__(self, path, ttl = 0, max_entries = 0):
+        self.path = path
+        self.ttl = ttl * day
+        self.max_entries = max_entries
+        self.hits = self.misses = self.expired = self.evicted = 0
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread = False)
+        self.db.execute("""CREATE TABLE IF NOT EXISTS geocodes (
+                            query TEXT PRIMARY KEY,
+                            response BLOB,
+                            address TEXT,
+                            created REAL NOT NULL,
+                            used REAL NOT NULL,
+                            fmt TEXT)""")
+        columns = [row[1] for row in self.db.execute("PRAGMA table_info(geocodes)")]
+        if "fmt" not in columns:
+            # caches written before the format was recorded
+            self.db.execute("ALTER TABLE geocodes ADD COLUMN fmt TEXT")
+        self.db.execute("CREATE INDEX IF NOT EXISTS geocodes_used ON geocodes (used)")
+        self.db.commit()
+
+    def get(self, query):
+        """
+        Return {'response': (bytes), 'fmt': (str), 'address': (dict)}
+        cached for `query`, or None on a miss.
+        """
+        key = normalize_query(query)
+        now = time.time()
+        with self.lock:
+            row = self.db.execute("SELECT response, address, created, fmt FROM geocodes "
+                                  "WHERE query = ?", (key,)).fetchone()
+            if row is not None and self.ttl and now - row[2] > self.ttl:
+                with self.db:
+                    self.db.execute("DELETE FROM geocodes WHERE query = ?", (key,))
+                self.expired += 1
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            with self.db:
+                self.db.execute("UPDATE geocodes SET used = ? WHERE query = ?", (now, key))
+            self.hits += 1
+        return {'response': row[0],
+                'fmt': row[3] or response_format(row[0]),
+                'address': json.loads(row[1]) if row[1] is not None else None}
+
+    def put(self, query, response, address, fmt = "xml"):
+        """
+        Cache the raw `response` (bytes) of the `fmt` endpoint and the
+        parsed `address` (dict) of `query`.
+        """
+        key = normalize_query(query)
+        now = time.time()
+        with self.lock:
+            with self.db:
+                self.db.execute("INSERT OR REPLACE INTO geocodes "
+                                "(query, response, address, created, used, fmt) "
+                                "VALUES (?, ?, ?, ?, ?, ?)",
+                                (key, response, json.dumps(address), now, now, fmt))
+                if self.max_entries:
+                    n = self.db.execute("SELECT COUNT(*) FROM geocodes").fetchone()[0]
+                    if n > self.max_entries:
+                        self.db.execute("DELETE FROM geocodes WHERE query IN "
+                                        "(SELECT query FROM geocodes ORDER BY used LIMIT ?)",
+                                        (n - self.max_entries,))
+                        self.evicted += n - self.max_entries
+
+    def purge(self):
+        """
+        Delete expired entries. Returns the number deleted.
+        """
+        if not self.ttl:
+            return 0
+        with self.lock:
+            with self.db:
+                n = self.db.execute("DELETE FROM geocodes WHERE created < ?",
+                                    (time.time() - self.ttl,)).rowcount
+        self.expired += n
+        return n
+
+    def responses(self):
+        """
+        Yield (query, raw response) for every cached entry, e.g. to parse
+        all cached geocodes again.
+        """
+        with self.lock:
+            rows = self.db.execute("SELECT query, response FROM geocodes").fetchall()
+        for row in rows:
+            yield row
+
+    def __len__(self):
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM geocodes").fetchone()[0]
+
+    def summary(self):
+        lookups = self.hits + self.misses
+        return ("geocode cache: {} hits, {} misses ({:.1%} hit rate), "
+                "{} expired, {} evicted").format(
+                    self.hits, self.misses, self.hits / lookups if lookups else 0.,
+                    self.expired, self.evicted)
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description = 'Inspect the geocode cache')
+    parser.add_argument('-cache', type = str,
+                        help = 'SQLite file of the geocode cache',
+                        default = 'data/tweets/geocode_cache.sqlite')
+    parser.add_argument('-ttl', type = float,
+                        help = 'Days a cached geocode stays valid (0 for no expiry)',
+                        default = 0)
+    parser.add_argument('-purge',
+                        help = 'Delete expired entries',
+                        action = "store_true")
+    args = parser.parse_args()
+
+    cache = GeocodeCache(args.cache, ttl = args.ttl)
+    if args.purge:
+        print("{} expired entries deleted".format(cache.purge()))
+    print("{} cached geocodes".format(len(cache)))
+    cache.close()
+    sys.exit()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Client of Google's Geocoding API, shared by 03_parse_address.py and
+pipeline.py. Requests from all threads share one connection pool and one
+rate limiter, back off exponentially while the API answers
+OVER_QUERY_LIMIT, and are answered from the geocode cache when the same
+query was geocoded before. Cached responses are parsed again on every
+hit, with the parser of their own format.
+"""
+
+import logging
+import threading
+import time
+import requests
+from requests.exceptions import HTTPError
+from address_parser import parse_response, response_status
+
+log = logging.getLogger(__name__)
+
+api_url = "https://maps.googleapis.com"
+
+# responses worth keeping; other statuses (e.g. OVER_QUERY_LIMIT) are retried
+cached_status = ("OK", "ZERO_RESULTS")
+
+
+class Geocoder(object):
+    """
+    ---
+    key (str, Google API key)
+    limiter (throttle.TokenBucket shared by all requests)
+    cache (geocode_cache.GeocodeCache, or None to always call the API)
+    fmt (str, 'xml' or 'json' endpoint)
+    retries (int, retries of a request answered with OVER_QUERY_LIMIT)
+    pool_size (int, connections kept open; the number of worker threads)
+    base_url (str, root of the API)
+    """
+
+    def __init__(self, key, limiter, cache = None, fmt = "xml", retries = 5,
+                 pool_size = 8, base_url = api_url):
+        self.key = key
+        self.limiter = limiter
+        self.cache = cache
+        self.fmt = fmt
+        self.retries = retries
+        self.url = "{}/maps/api/geocode/{}".format(base_url.rstrip("/"), fmt)
+        self.session = requests.Session()
+        self.session.mount(self.url.split("://")[0] + "://",
+                           requests.adapters.HTTPAdapter(pool_connections = 1,
+                                                         pool_maxsize = pool_size))
+        self.latencies = [] # seconds taken by each request
+        self.lock = threading.Lock()
+
+    def request(self, query):
+        """
+        Pass the query to Google's Geocode API to get structured
+        address data. Requests wait for the rate limiter and back off
+        exponentially while the API answers OVER_QUERY_LIMIT.
+        Returns the response, or None if the request failed, including
+        when the API still answers OVER_QUERY_LIMIT after the retries.
+        """
+        params = {'address': query, 'lang': 'en', 'key': self.key}
+
+        for attempt in range(self.retries + 1):
+            self.limiter.acquire()
+            start = time.perf_counter()
+            try:
+                resp = self.session.get(self.url, params = params, timeout = 30)
+                # If the response was successful, no Exception will be raised
+                resp.raise_for_status()
+            except HTTPError as http_err:
+                log.info(f'HTTP error occurred: {http_err}')
+                resp = None
+            except Exception as err:
+                log.info(f'Other error occurred: {err}')
+                resp = None
+            with self.lock:
+                self.latencies.append(time.perf_counter() - start)
+
+            if resp is not None:
+                if response_status(resp.content, self.fmt) != "OVER_QUERY_LIMIT":
+                    log.info('Success!')
+                    return resp
+            if attempt < self.retries:
+                delay = min(2 ** attempt, 60)
+                log.info("Request failed, retrying in {} seconds".format(delay))
+                self.limiter.pause(delay)
+
+        log.info("Giving up on {!r} after {} retries".format(query, self.retries))
+        return None
+
+    def geocode(self, query):
+        """
+        Return the parsed address of the query, from the cached response if
+        the same query was geocoded before, else from the Geocoding API.
+        Returns None if the request failed.
+        """
+        if self.cache is not None:
+            cached = self.cache.get(query)
+            if cached is not None:
+                if cached['response'] is None:
+                    return cached['address']
+                return parse_response(cached['response'], cached['fmt'])
+        resp = self.request(query)
+        if resp is None:
+            return None
+        address = parse_response(resp.content, self.fmt)
+        if self.cache is not None and response_status(resp.content, self.fmt) in cached_status:
+            self.cache.put(query, resp.content, address, self.fmt)
+        return address
+
+    def latency_summary(self):
+        """
+        Summarize the recorded request latencies.
+        """
+        with self.lock:
+            ordered = sorted(self.latencies)
+        if not ordered:
+            return "no geocoding requests"
+        def pct(q):
+            return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+        return ("{} geocoding requests, latency mean {:.3f} s, "
+                "p50 {:.3f} s, p95 {:.3f} s, max {:.3f} s").format(
+                    len(ordered), sum(ordered) / len(ordered),
+                    pct(.5), pct(.95), ordered[-1])
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Process the hourly files of stages 02 to 04 on a pool of processes.
+Each file is independent, so the files are handed out to the workers and
+their results are collected back in file order, whatever order they
+finish in. Every file is timed.
+"""
+
+import functools
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+
+def timed(fn, file):
+    """
+    Return (fn(file), seconds taken).
+    """
+    start = time.perf_counter()
+    result = fn(file)
+    return result, time.perf_counter() - start
+
+
+def map_files(fn, files, workers = 1, initializer = None):
+    """
+    Apply `fn` to each of the `files` and yield (file, result, seconds)
+    in the order of `files`.
+    ---
+    workers (int, processes; the files are processed in this process if 1)
+    initializer (function run once in each worker process, e.g. to open
+                 connections that cannot be shared with the parent)
+    """
+    files = list(files)
+    job = functools.partial(timed, fn)
+    if workers <= 1:
+        for file in files:
+            result, seconds = job(file)
+            yield file, result, seconds
+        return
+    with ProcessPoolExecutor(max_workers = workers, initializer = initializer) as pool:
+        for file, (result, seconds) in zip(files, pool.map(job, files)):
+            yield file, result, seconds
+
+
+def timing_summary(timings, elapsed):
+    """
+    Summarize the (file, seconds) `timings` of a run that took `elapsed`
+    seconds of wall-clock time.
+    """
+    if not timings:
+        return "no files"
+    busy = sum(seconds for _, seconds in timings)
+    slowest = max(timings, key = lambda x: x[1])
+    return ("{} files in {:.2f} s ({:.2f} s of work, {:.1f}x parallel); "
+            "slowest {} ({:.2f} s)").format(
+                len(timings), elapsed, busy, busy / elapsed if elapsed else 0.,
+                slowest[0], slowest[1])
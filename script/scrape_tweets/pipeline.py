@@ -0,0 +1,489 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Run the scrape_tweets stages 01 to 04 as one streaming pipeline:
+
+    search pages -> clean and find addresses -> geocode -> CSV / dataset
+
+Each stage runs on its own thread and hands pages of tweets to the next
+through a bounded queue, so tweets flow through as soon as their page is
+fetched and a slow stage holds back the ones before it instead of piling
+up pages in memory.
+
+Raw search pages in `-rawdir` are the checkpoint of the scrape: pages
+already saved are read back instead of requested, so an interrupted run
+resumes where it stopped, and `-offline` replays a saved scrape without
+Twitter credentials. The geocode cache plays the same role for stage 03.
+The per-stage JSON files of the stand-alone scripts are only written when
+their directories are given.
+
+$ python script/scrape_tweets/pipeline.py -offline -rawdir data/tweets/raw
+"""
+
+import argparse
+import logging
+import os
+import queue
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from dotenv import load_dotenv
+load_dotenv()
+sys.path.append(os.getcwd() + "/script/scrape_tweets")
+import raw_archive
+from address_filter import contain_address
+from address_query import address_query
+from bucket_planner import plan_slices
+from dedup import Deduplicator
+from districts import add_districts
+from geocode_cache import GeocodeCache, normalize_query
+from geocoder import Geocoder, api_url as geocode_url
+from sites import add_sites, default_radius, write_sites
+from throttle import TokenBucket
+from tweet_frame import build_frame
+from tweet_reader import write_tweets
+from tweet_text import clean_tweets
+from twitter_search import SearchClient, api_url as search_url
+try:
+    from tweet_store import write_store
+except ImportError:
+    # the typed dataset is optional; the CSV is written without pyarrow
+    write_store = None
+
+# set up parser
+parser = argparse.ArgumentParser(description = 'Scrape, clean, geocode and tabulate tweets in one pass')
+parser.add_argument('-rawdir', type = str,
+                    help = 'Directory of raw search pages; saved pages are read instead of requested',
+                    default = 'data/tweets/raw')
+parser.add_argument('-offline',
+                    help = 'Only replay the pages saved in -rawdir, without calling the search API',
+                    action = "store_true")
+parser.add_argument('-fromdate', type = str,
+                    help = 'Start of the scrape (YYYYMMDDHHMM)',
+                    default = '201811061100')
+parser.add_argument('-todate', type = str,
+                    help = 'End of the scrape (YYYYMMDDHHMM)',
+                    default = '201811062359')
+parser.add_argument('-script01dir', type = str,
+                    help = 'Checkpoint directory for "scraped*.json" files (none if empty)',
+                    default = '')
+parser.add_argument('-script02dir', type = str,
+                    help = 'Checkpoint directory for "cleaned*.json" files (none if empty)',
+                    default = '')
+parser.add_argument('-script03dir', type = str,
+                    help = 'Checkpoint directory for "parsed*.json" files (none if empty)',
+                    default = '')
+parser.add_argument('-csvdir', type = str,
+                    help = "Directory storing csv files",
+                    default = "data/csv")
+parser.add_argument('-shpdir', type = str,
+                    help = "Directory storing shp files (adds a `district` column)",
+                    default = "data/shp")
+parser.add_argument('-radius', type = float,
+                    help = "Distance in metres under which two tweets are at the same delivery site",
+                    default = default_radius)
+parser.add_argument('-storedir', type = str,
+                    help = "Directory of the Parquet/Arrow dataset partitioned by state and hour ('' to skip)",
+                    default = "data/parquet/PizzaToThePolls")
+parser.add_argument('-storeformat', type = str,
+                    help = "File format of the dataset",
+                    choices = ["parquet", "arrow"],
+                    default = "parquet")
+parser.add_argument('-queuesize', type = int,
+                    help = 'Pages held between two stages before the earlier stage waits',
+                    default = 8)
+parser.add_argument('-workers', type = int,
+                    help = 'Number of time slices to scrape concurrently',
+                    default = 4)
+parser.add_argument('-ratelimit', type = int,
+                    help = 'Search requests allowed per minute (full-archive limit is 60)',
+                    default = 60)
+parser.add_argument('-pagesize', type = int,
+                    help = 'Results per search page',
+                    default = 500)
+parser.add_argument('-cache', type = str,
+                    help = 'SQLite file caching geocode responses across runs',
+                    default = "data/tweets/geocode_cache.sqlite")
+parser.add_argument('-geoworkers', type = int,
+                    help = 'Number of concurrent Geocoding requests',
+                    default = 8)
+parser.add_argument('-qps', type = float,
+                    help = 'Geocoding requests allowed per second',
+                    default = 10)
+parser.add_argument('-retries', type = int,
+                    help = 'Retries of a request answered with OVER_QUERY_LIMIT',
+                    default = 5)
+parser.add_argument('-format', type = str,
+                    help = 'Output format of the Geocoding API',
+                    choices = ["xml", "json"],
+                    default = "xml")
+parser.add_argument('-twitterurl', type = str,
+                    help = 'Root of the search API, e.g. a local replay_server.py',
+                    default = search_url)
+parser.add_argument('-geocodeurl', type = str,
+                    help = 'Root of the Geocoding API, e.g. a local replay_server.py',
+                    default = geocode_url)
+parser.add_argument('-v','--verbose',
+                    help = "Set log level to debug",
+                    action="store_true")
+args = parser.parse_args()
+
+
+
+# set up logging
+log = logging.getLogger(__name__)
+log.setLevel(logging.ERROR)
+if args.verbose:
+    log.setLevel(logging.DEBUG)
+loghandler = logging.StreamHandler(sys.stderr)
+loghandler.setFormatter(logging.Formatter("[%(asctime)s] %(message)s"))
+log.addHandler(loghandler)
+
+
+
+""" STEP 0: Plumbing between stages """
+
+end = object() # marks the end of a stage's output
+
+# set once any stage fails, so that the threads feeding the others stop
+# instead of waiting forever on a full queue; `failures` keeps the errors
+stop = threading.Event()
+failures = []
+
+
+class Cancelled(Exception):
+    """
+    Raised in a thread that gives up because another stage failed.
+    """
+
+
+def fail(err):
+    """
+    Record the error `err` of a stage and stop every other stage.
+    """
+    if not isinstance(err, (Cancelled, GeneratorExit)):
+        failures.append(err)
+    stop.set()
+
+
+def put(q, item):
+    """
+    Put `item` on the bounded queue `q`, raising Cancelled instead of
+    waiting once `stop` is set.
+    """
+    while True:
+        if stop.is_set():
+            raise Cancelled()
+        try:
+            q.put(item, timeout = 0.1)
+            return
+        except queue.Full:
+            pass
+
+
+def stage(fn, items):
+    """
+    Run the generator function fn(items) on its own thread and return an
+    iterator over its outputs, passed through a queue of at most
+    `args.queuesize` items. An exception in the stage is raised again in
+    the consumer, and an exception in the consumer stops the stage.
+    """
+    q = queue.Queue(args.queuesize)
+
+    def run():
+        try:
+            for out in fn(items):
+                put(q, (out, None))
+            put(q, (end, None))
+        except BaseException as err:
+            fail(err)
+            # stop the stage feeding this one, if it is a generator
+            if hasattr(items, "close"):
+                items.close()
+            # the thread is a daemon, so this never holds up the exit
+            # if the consumer is gone
+            q.put((None, err))
+    threading.Thread(target = run, daemon = True).start()
+
+    try:
+        while True:
+            out, err = q.get()
+            if err is not None:
+                raise err
+            if out is end:
+                return
+            yield out
+    except BaseException as err:
+        fail(err)
+        raise
+
+
+def page_name(fromDate, toDate, page):
+    return "{}-{}-{}".format(fromDate, toDate, page)
+
+
+def page_order(name):
+    """
+    Sort key of page names: time slice, then page number.
+    """
+    fromDate, toDate, page = name.split("-")
+    return fromDate, toDate, int(page)
+
+
+def checkpoint(directory, prefix, name, tweets):
+    """
+    Save the tweets of page `name` like the stand-alone scripts do,
+    if `directory` is given.
+    """
+    if directory:
+        write_tweets(os.path.join(directory, prefix + name + ".json"), tweets)
+
+
+
+""" STEP 1: Fetch search pages (01_scrape_twitter.py) """
+
+client = None
+if not args.offline:
+    client = SearchClient(TokenBucket(rate = args.ratelimit / 60.), 
+                          base_url = args.twitterurl, page_size = args.pagesize)
+    client.authorize(os.getenv('twitter_api_key'), os.getenv('twitter_api_secret'))
+
+raw_name = re.compile(r"^search_resp(\d{12})-(\d{12})-(\d+)\.json(?:\.gz)?$")
+
+
+def saved_pages(rawdir):
+    """
+    Return {(fromDate, toDate): sorted page numbers} of the pages saved
+    in `rawdir`.
+    """
+    saved = {}
+    for file in os.listdir(rawdir):
+        m = raw_name.match(file)
+        if m is not None:
+            saved.setdefault((m.group(1), m.group(2)), set()).add(int(m.group(3)))
+    return {s: sorted(pages) for s, pages in saved.items()}
+
+
+def fetch_page(fromDate, toDate, page, next_):
+    """
+    Return (tweets, 'next' token) of page `page` of a slice, read from
+    `args.rawdir` if it was saved before, else requested with the 'next'
+    token `next_` and saved. Only pages of results are saved: a failed
+    request raises before anything is written, and a saved page that is
+    not a page of results (e.g. an error body kept by an older run) is
+    requested again.
+    """
+    filename = "search_resp" + page_name(fromDate, toDate, page)
+    if args.rawdir:
+        for path in (os.path.join(args.rawdir, filename + ".json.gz"),
+                     os.path.join(args.rawdir, filename + ".json")):
+            if os.path.exists(path):
+                try:
+                    return raw_archive.project_page(raw_archive.read_page(path))
+                except (KeyError, ValueError):
+                    if client is None:
+                        raise
+                    log.error("{} is not a page of results; requesting it again".format(path))
+                    break
+    if client is None:
+        raise FileNotFoundError("Page {} is not saved in {}".format(filename, args.rawdir))
+    content = client.search(fromDate, toDate, next_)
+    tweets, next_ = raw_archive.project_page(content)
+    if args.rawdir:
+        raw_archive.write_page(os.path.join(args.rawdir, filename + ".json.gz"), content)
+    return tweets, next_
+
+
+def fetch_pages(slices):
+    """
+    Yield (page name, tweets) for every page of the `slices`, following the
+    'next' tokens of each slice in order while `args.workers` slices are
+    fetched concurrently. With `-offline`, the saved pages of each slice
+    are read instead.
+    """
+    pages = queue.Queue(args.queuesize)
+    saved = saved_pages(args.rawdir) if args.offline else {}
+
+    def scrape_slice(fromDate, toDate):
+        if args.offline:
+            numbers = iter(saved[(fromDate, toDate)])
+        page = next(numbers) if args.offline else 0
+        next_ = 0
+        while True:
+            if stop.is_set():
+                raise Cancelled()
+            try:
+                tweets, next_ = fetch_page(fromDate, toDate, page, next_)
+            except (KeyError, ValueError):
+                # a saved page that cannot be requested again ends the slice
+                if not args.offline:
+                    raise
+                log.error("No results in page {}".format(page_name(fromDate, toDate, page)))
+                return page
+            name = page_name(fromDate, toDate, page)
+            checkpoint(args.script01dir, "scraped", name, tweets)
+            put(pages, (name, tweets))
+            if args.offline:
+                page = next(numbers, None)
+                if page is None:
+                    return len(saved[(fromDate, toDate)])
+            elif next_ == 0:
+                return page + 1
+            else:
+                page += 1
+
+    def done(job):
+        if not job.cancelled() and job.exception() is not None:
+            fail(job.exception())
+
+    with ThreadPoolExecutor(max_workers = args.workers) as pool:
+        jobs = [pool.submit(scrape_slice, fromDate, toDate)
+                for fromDate, toDate in slices]
+        for job in jobs:
+            job.add_done_callback(done)
+        def finish():
+            wait(jobs)
+            pages.put(end)
+        threading.Thread(target = finish, daemon = True).start()
+        try:
+            while True:
+                item = pages.get()
+                if item is end:
+                    break
+                yield item
+        except BaseException as err:
+            # the slices not started are dropped and the running ones
+            # stop at their next page
+            fail(err)
+            pool.shutdown(wait = False, cancel_futures = True)
+            raise
+        for job in jobs:
+            job.result()
+
+
+
+""" STEP 2: Clean tweets and find addresses (02_clean_and_find_address.py) """
+
+dedup = Deduplicator(threshold = None)
+found = {} # representative key -> canonical query of the address, or False
+counts = {"tweets": 0, "address": 0, "skipped": 0}
+
+
+def find_addresses(pages):
+    """
+    Yield (page name, tweets containing an address) with the fields added
+    by 02_clean_and_find_address.py.
+    """
+    for name, tweets in pages:
+        queries = clean_tweets([tweet['text'] for tweet in tweets])
+        out = []
+        for tweet, query in zip(tweets, queries):
+            tweet['clean_text'] = query
+            key = dedup.add(query)
+            if key not in found:
+                found[key] = contain_address(query) and address_query(query)
+            if found[key] is not False:
+                tweet.update({'contain_address': True,
+                              'address_query': found[key]})
+                out.append(tweet)
+        counts["tweets"] += len(tweets)
+        counts["address"] += len(out)
+        checkpoint(args.script02dir, "cleaned", name, out)
+        yield name, out
+
+
+
+""" STEP 3: Geocode addresses (03_parse_address.py) """
+
+cache = GeocodeCache(args.cache)
+geocoder = Geocoder(os.getenv('google_api_key'),
+                    limiter = TokenBucket(rate = args.qps, capacity = max(1, int(args.qps))),
+                    cache = cache,
+                    fmt = args.format,
+                    retries = args.retries,
+                    pool_size = args.geoworkers,
+                    base_url = args.geocodeurl)
+geocoded = {} # normalized query -> parsed address (None if not geocoded)
+
+
+def geocode_pages(pages):
+    """
+    Yield (page name, tweets) with the parsed address added to each tweet.
+    Each distinct query is geocoded once.
+    """
+    with ThreadPoolExecutor(max_workers = args.geoworkers) as pool:
+        for name, tweets in pages:
+            keys = []
+            todo = {}
+            for tweet in tweets:
+                key = None
+                if tweet['address_query'] is not None:
+                    key = normalize_query(tweet['address_query'])
+                    if key not in geocoded and key not in todo:
+                        todo[key] = pool.submit(geocoder.geocode, tweet['address_query'])
+                else:
+                    counts["skipped"] += 1
+                keys.append(key)
+            for key, job in todo.items():
+                geocoded[key] = job.result()
+            for tweet, key in zip(tweets, keys):
+                if key is not None and geocoded[key] is not None:
+                    tweet.update(geocoded[key])
+            checkpoint(args.script03dir, "parsed", name, tweets)
+            yield name, tweets
+
+
+
+""" STEP 4: Write the table (04_convert_to_csv.py) """
+
+def write_outputs(pages):
+    """
+    Write the geocoded tweets to PizzaToThePolls.csv and the dataset, in
+    the order of their pages, and the deliveries per site to
+    PizzaToThePolls_sites.csv. Returns the DataFrame.
+    """
+    collected = dict(pages)
+    df = build_frame(tweet for name in sorted(collected, key = page_order)
+                     for tweet in collected[name])
+    df = add_districts(df, args.shpdir)
+    df = add_sites(df, args.radius)
+    df.to_csv(os.path.join(args.csvdir, "PizzaToThePolls.csv"))
+    write_sites(df, os.path.join(args.csvdir, "PizzaToThePolls_sites.csv"))
+    if args.storedir:
+        if write_store is None:
+            print("pyarrow is not installed; skipping {}".format(args.storedir))
+        else:
+            write_store(df, args.storedir, fmt = args.storeformat)
+    return df
+
+
+
+if __name__ == "__main__":
+
+    start = time.perf_counter()
+    if args.offline:
+        slices = sorted(saved_pages(args.rawdir))
+    else:
+        counts_ = client.counts(args.fromdate, args.todate, bucket = 'hour')
+        slices = [s[:2] for s in plan_slices(counts_, page_size = args.pagesize,
+                                             refine = client.counts)]
+    log.info("{} slices to fetch".format(len(slices)))
+
+    try:
+        df = write_outputs(stage(geocode_pages, stage(find_addresses, fetch_pages(slices))))
+    except Cancelled:
+        # raise the error that stopped the stages rather than the
+        # cancellation it caused further down
+        if failures:
+            raise failures[0]
+        raise
+
+    print("{tweets} tweets, {address} with an address, "
+          "{skipped} without a plausible address".format(**counts))
+    print("{} distinct address queries, {} rows written".format(len(geocoded), len(df)))
+    print(cache.summary())
+    print(geocoder.latency_summary())
+    print("{:.1f} s".format(time.perf_counter() - start))
+    sys.exit()
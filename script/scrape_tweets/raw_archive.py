@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Compressed archive of the raw search responses of 01_scrape_twitter.py.
+Each page is saved as a gzip file holding the response body exactly as
+the API sent it, so nothing is decoded and re-encoded just to be stored.
+
+Run this file to compress raw pages saved as plain JSON by earlier runs:
+$ python script/scrape_tweets/raw_archive.py -rawdir data/tweets/raw
+"""
+
+import argparse
+import gzip
+import json
+import logging
+import os
+import sys
+
+log = logging.getLogger(__name__)
+
+# fields of each tweet kept in the "scraped*.json" files
+projection = ('created_at', 'text', 'id')
+
+
+def write_page(path, content, level = 6):
+    """
+    Compress the raw response body `content` (bytes) to `path`.
+    The file is written under a temporary name and renamed when complete,
+    so a crash never leaves a truncated page behind.
+    """
+    tmp = path + ".part"
+    with gzip.open(tmp, "wb", compresslevel = level) as g:
+        g.write(content)
+    os.replace(tmp, path)
+
+
+def read_page(path):
+    """
+    Return the raw response body saved at `path`,
+    either compressed ("*.json.gz") or plain ("*.json").
+    """
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rb") as f:
+        return f.read()
+
+
+def project_page(content, fields = projection):
+    """
+    Decode the response body `content` and keep only `fields` of each tweet.
+    Returns (list of tweet dictionaries, 'next' token or 0).
+    """
+    data = json.loads(content)
+    tweets = [{k: res[k] for k in fields} for res in data['results']]
+    return tweets, data.get('next', 0)
+
+
+def compress_dir(rawdir, keep = False, index = None):
+    """
+    Compress every plain "search_resp*.json" page in `rawdir`. The tweets
+    of each page in the tweet_index.TweetIndex `index` are pointed at the
+    compressed page.
+    Returns (bytes before, bytes after).
+    """
+    before = after = 0
+    for file in sorted(os.listdir(rawdir)):
+        if not (file.startswith("search_resp") and file.endswith(".json")):
+            continue
+        path = os.path.join(rawdir, file)
+        content = read_page(path)
+        write_page(path + ".gz", content)
+        before += len(content)
+        after += os.path.getsize(path + ".gz")
+        if index is not None:
+            index.rename(path, path + ".gz")
+        if not keep:
+            os.remove(path)
+        log.info("Compressed {}".format(file))
+    return before, after
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description = 'Compress raw search responses')
+    parser.add_argument('-rawdir', type = str,
+                        help = 'Directory storing raw JSON responses',
+                        default = 'data/tweets/raw')
+    parser.add_argument('-keep',
+                        help = 'Keep the plain JSON files after compressing them',
+                        action = "store_true")
+    parser.add_argument('-index', type = str,
+                        help = "SQLite file of the tweet id index, updated to the compressed pages ('' to skip)",
+                        default = 'data/tweets/tweet_index.sqlite')
+    parser.add_argument('-v','--verbose',
+                        help = "Set log level to debug", action="store_true")
+    args = parser.parse_args()
+
+    log.setLevel(logging.ERROR)
+    if args.verbose:
+        log.setLevel(logging.DEBUG)
+    loghandler = logging.StreamHandler(sys.stderr)
+    loghandler.setFormatter(logging.Formatter("[%(asctime)s] %(message)s"))
+    log.addHandler(loghandler)
+
+    index = None
+    if args.index and os.path.exists(args.index):
+        sys.path.append(os.getcwd() + "/script/scrape_tweets")
+        from tweet_index import TweetIndex
+        index = TweetIndex(args.index)
+    before, after = compress_dir(args.rawdir, keep = args.keep, index = index)
+    if index is not None:
+        index.close()
+    print("{:.1f} MB compressed to {:.1f} MB".format(before / 1e6, after / 1e6))
+    sys.exit()
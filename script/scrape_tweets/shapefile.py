@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Read ESRI shapefiles such as the Census cartographic boundary files in
+data/shp: the polygons of the .shp file and the attribute table of the
+.dbf file, with numpy only (no GDAL or shapely). Only polygon shapes
+(type 5) and null shapes are supported, which is all the Census files use.
+
+The files are memory-mapped. Geometries are contiguous arrays (every
+vertex in one (n, 2) array, with offsets of the rings and of the shapes'
+rings) and DBF columns are decoded only when asked for. The geometry is
+also cached as .npy files under `cachedir`, keyed by the hash of the .shp
+file, and memory-mapped from there on the next load.
+
+$ python script/scrape_tweets/shapefile.py data/shp/cb_2017_us_cd115_500k/cb_2017_us_cd115_500k.shp
+"""
+
+import argparse
+import mmap
+import os
+import struct
+import sys
+import time
+import numpy as np
+sys.path.append(os.getcwd() + "/script")
+from manifest import file_hash
+
+# shape types of the .shp header and records
+NULL_SHAPE = 0
+POLYGON = 5
+
+default_cachedir = "data/shp/cache"
+
+
+def map_file(path):
+    """
+    Return a read-only memory map of the file at `path` (bytes if empty).
+    """
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b""
+        return mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+
+
+class Table(object):
+    """
+    The attribute table of the dBase file at `path`, memory-mapped. Each
+    column is decoded the first time it is asked for, for all records at
+    once: character fields as arrays of str stripped of their padding,
+    numeric fields as float64 (int64 without decimals and blanks).
+    ---
+    encoding (str, defaults to the .cpg file next to `path`, else latin-1)
+    """
+
+    def __init__(self, path, encoding = None):
+        if encoding is None:
+            cpg = os.path.splitext(path)[0] + ".cpg"
+            encoding = "latin-1"
+            if os.path.exists(cpg):
+                with open(cpg) as f:
+                    encoding = f.read().strip() or encoding
+        self.encoding = encoding
+        self.data = map_file(path)
+        n_records, header_length, record_length = struct.unpack("<IHH", self.data[4:12])
+
+        # 32-byte field descriptors, up to the 0x0D terminator; each
+        # record starts with a deletion flag
+        self.fields = {}
+        self.names = []
+        offset, position = 32, 1
+        while self.data[offset] != 0x0D:
+            descriptor = self.data[offset:offset + 32]
+            name = descriptor[:11].split(b"\x00")[0].decode("ascii")
+            self.fields[name] = (chr(descriptor[11]), position, descriptor[16], descriptor[17])
+            self.names.append(name)
+            position += descriptor[16]
+            offset += 32
+
+        rows = np.frombuffer(self.data, dtype = np.uint8, count = n_records * record_length,
+                             offset = header_length).reshape(n_records, record_length)
+        live = rows[:, 0] != ord("*")
+        self.rows = rows if live.all() else rows[live]
+        self.columns = {}
+
+    def __len__(self):
+        return len(self.rows)
+
+    def strings(self, name):
+        """
+        Return the values of field `name` for every record, as str.
+        """
+        _, position, length, _ = self.fields[name]
+        raw = np.ascontiguousarray(self.rows[:, position:position + length])
+        return np.char.strip(np.char.decode(raw.view("S{}".format(length)).ravel(),
+                                            self.encoding))
+
+    def column(self, name):
+        """
+        Return the values of field `name` for every record, typed.
+        """
+        values = self.columns.get(name)
+        if values is None:
+            kind, _, _, decimals = self.fields[name]
+            values = self.strings(name)
+            if kind in "NF":
+                blank = values == ""
+                if decimals or blank.any():
+                    values = np.where(blank, "nan", values).astype(np.float64)
+                else:
+                    values = values.astype(np.int64)
+            self.columns[name] = values
+        return values
+
+    def records(self):
+        """
+        Return the records as dictionaries of strings.
+        """
+        columns = [self.strings(name).tolist() for name in self.names]
+        return [dict(zip(self.names, values)) for values in zip(*columns)]
+
+
+def read_dbf(path, encoding = None):
+    """
+    Return (field names, list of records as dictionaries of strings) of the
+    dBase file at `path`. Values are stripped of their padding; numeric
+    fields are left as strings.
+    ---
+    encoding (str, defaults to the .cpg file next to `path`, else latin-1)
+    """
+    table = Table(path, encoding)
+    return table.names, table.records()
+
+
+class Geometry(object):
+    """
+    Polygons as contiguous arrays: `coords` is the (n, 2) array of the
+    (x, y) = (longitude, latitude) vertices of every ring, ring k is
+    coords[rings[k]:rings[k + 1]] and shape s is made of the rings
+    parts[s] to parts[s + 1] (none for null shapes).
+    """
+
+    def __init__(self, coords, rings, parts):
+        self.coords = coords
+        self.rings = rings
+        self.parts = parts
+
+    def __len__(self):
+        return len(self.parts) - 1
+
+    def shape(self, s):
+        """
+        Return the rings of shape `s` as views of `coords`.
+        """
+        return [self.coords[self.rings[k]:self.rings[k + 1]]
+                for k in range(self.parts[s], self.parts[s + 1])]
+
+    def ring_shape(self):
+        """
+        Return the shape of each ring.
+        """
+        return np.repeat(np.arange(len(self), dtype = np.int64), np.diff(self.parts))
+
+
+def parse_shp(path):
+    """
+    Return the Geometry of the polygon shapefile at `path`, locating the
+    records with the .shx index next to it.
+    """
+    data = map_file(path)
+    file_code, = struct.unpack(">i", data[:4])
+    if file_code != 9994:
+        raise ValueError("{} is not a shapefile".format(path))
+    shape_type, = struct.unpack("<i", data[32:36])
+    if shape_type not in (NULL_SHAPE, POLYGON):
+        raise ValueError("{}: shape type {} is not supported".format(path, shape_type))
+
+    # record offsets of the index, in 16-bit words from the start of the
+    # file; without an index, the records are walked through
+    index = os.path.splitext(path)[0] + ".shx"
+    if os.path.exists(index):
+        offsets = np.frombuffer(map_file(index), dtype = ">i4", offset = 100).reshape(-1, 2)[:, 0] * 2 + 8
+    else:
+        offsets = []
+        offset = 100
+        while offset + 8 <= len(data):
+            _, length = struct.unpack(">ii", data[offset:offset + 8])
+            offsets.append(offset + 8)
+            offset += 8 + 2 * length
+        offsets = np.array(offsets, dtype = np.int64)
+
+    coords, rings, parts = [], [0], [0]
+    for content in offsets.tolist():
+        record_type, = struct.unpack("<i", data[content:content + 4])
+        if record_type == NULL_SHAPE:
+            parts.append(parts[-1])
+            continue
+        if record_type != POLYGON:
+            raise ValueError("{}: shape type {} is not supported".format(path, record_type))
+        n_parts, n_points = struct.unpack("<ii", data[content + 36:content + 44])
+        starts = np.frombuffer(data, dtype = "<i4", count = n_parts, offset = content + 44)
+        coords.append(np.frombuffer(data, dtype = "<f8", count = 2 * n_points,
+                                    offset = content + 44 + 4 * n_parts))
+        rings.extend((rings[-1] + np.append(starts[1:], n_points)).tolist())
+        parts.append(parts[-1] + n_parts)
+    coords = np.concatenate(coords).reshape(-1, 2) if coords else np.zeros((0, 2))
+    return Geometry(coords, np.array(rings, dtype = np.int64), np.array(parts, dtype = np.int64))
+
+
+def read_geometry(path, cachedir = default_cachedir):
+    """
+    Return the Geometry of the polygon shapefile at `path`, from the cache
+    in `cachedir` if this content of the file was read before ('' or None
+    to not cache). Cached arrays are memory-mapped, read-only.
+    """
+    if not cachedir:
+        return parse_shp(path)
+    directory = os.path.join(cachedir, file_hash(path))
+    names = ("coords", "rings", "parts")
+    files = [os.path.join(directory, name + ".npy") for name in names]
+    if all(os.path.exists(file) for file in files):
+        return Geometry(*[np.load(file, mmap_mode = "r") for file in files])
+    geometry = parse_shp(path)
+    os.makedirs(directory, exist_ok = True)
+    for name, file in zip(names, files):
+        tmp = file + ".part.npy"
+        np.save(tmp, getattr(geometry, name))
+        os.replace(tmp, file)
+    return geometry
+
+
+def read_shapefile(path, cachedir = default_cachedir):
+    """
+    Return (Table, Geometry) of the shapefile at `path` (the .shp file;
+    the .dbf file has the same name).
+    """
+    base = os.path.splitext(path)[0]
+    table = Table(base + ".dbf")
+    geometry = read_geometry(base + ".shp", cachedir)
+    if len(table) != len(geometry):
+        raise ValueError("{}: {} records but {} shapes".format(base, len(table), len(geometry)))
+    return table, geometry
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description = 'Summarize a shapefile')
+    parser.add_argument('path', type = str,
+                        help = 'Path to the .shp (or only the .dbf) file')
+    parser.add_argument('-cachedir', type = str,
+                        help = "Directory caching the parsed geometries ('' to not cache)",
+                        default = default_cachedir)
+    args = parser.parse_args()
+
+    base = os.path.splitext(args.path)[0]
+    start = time.perf_counter()
+    table = Table(base + ".dbf")
+    print("{} records with fields {} ({:.3f} s)".format(
+        len(table), ", ".join(table.names), time.perf_counter() - start))
+    if os.path.exists(base + ".shp"):
+        start = time.perf_counter()
+        geometry = read_geometry(base + ".shp", args.cachedir)
+        print("{} shapes, {} rings, {} vertices ({:.3f} s)".format(
+            len(geometry), len(geometry.rings) - 1, len(geometry.coords),
+            time.perf_counter() - start))
+    else:
+        print("no .shp file next to the .dbf")
+    sys.exit()
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Collapse the geocoded tweets into delivery sites (polling places), so that
+deliveries can be counted per location. Tweets for the same polling place
+differ slightly in `lat`/`lng` (e.g. "111 Bright Street" geocoded from two
+spellings) or in the spelling of `st_num`/`route`, and rounding the
+coordinates or comparing every pair of rows either misses them or does
+not scale.
+
+Two tweets are at the same site if their normalized addresses (street
+number, route with abbreviated suffixes and directions, city, state) are
+equal, or if their coordinates are less than `radius` metres apart. Sites
+are the connected components of these links (single linkage). Near
+coordinates are found by bucketing the distinct coordinates into a grid
+of cells at least `radius` wide and only measuring pairs in the same or
+adjacent cells, so the work is near linear in the number of tweets.
+
+Every site gets a `site_id` derived from its smallest normalized address,
+which does not depend on the order of the rows and stays the same when
+more tweets for the site come in. Tweets without a street address (e.g.
+geocoded to a city only) are not at any site.
+
+$ python script/scrape_tweets/sites.py -csv data/csv/PizzaToThePolls.csv
+"""
+
+import argparse
+import hashlib
+import logging
+import os
+import re
+import sys
+import time
+import numpy as np
+import pandas as pd
+sys.path.append(os.getcwd() + "/script/scrape_tweets")
+from districts import spread
+
+log = logging.getLogger(__name__)
+
+default_radius = 50.
+default_path = "data/csv/PizzaToThePolls_sites.csv"
+
+# metres per degree of latitude
+metres_per_degree = 111195.
+
+# address columns of the site table, besides `site_id`, `count`, `lat` and `lng`
+address_columns = ("st_num", "route", "city", "county", "zipcode", "state_abbv")
+
+# words of the route -> abbreviation, as in USPS Publication 28
+abbreviations = {
+    "avenue": "ave", "av": "ave", "boulevard": "blvd", "circle": "cir",
+    "court": "ct", "drive": "dr", "expressway": "expy", "freeway": "fwy",
+    "highway": "hwy", "lane": "ln", "parkway": "pkwy", "place": "pl",
+    "road": "rd", "route": "rte", "square": "sq", "street": "st",
+    "terrace": "ter", "trail": "trl", "way": "wy", "saint": "st", "mount": "mt",
+    "fort": "ft", "north": "n", "south": "s", "east": "e", "west": "w",
+    "northeast": "ne", "northwest": "nw", "southeast": "se", "southwest": "sw",
+}
+non_word = re.compile(r"[^0-9a-z ]+")
+
+
+def normalize_route(route):
+    """
+    Return `route` in lower case, without punctuation, with abbreviated
+    suffixes and directions, e.g. 'Saint Marks Avenue' -> 'st marks ave'.
+    """
+    words = non_word.sub(" ", route.lower()).split()
+    return " ".join(abbreviations.get(word, word) for word in words)
+
+
+def address_key(st_num, route, city, state_abbv):
+    """
+    Return the normalized address of a tweet, None without street number
+    or route.
+    """
+    if not (isinstance(st_num, str) and isinstance(route, str)) or not st_num.strip():
+        return None
+    return "|".join((non_word.sub("", st_num.lower()), normalize_route(route),
+                     city.lower().strip() if isinstance(city, str) else "",
+                     state_abbv if isinstance(state_abbv, str) else ""))
+
+
+def components(n, a, b):
+    """
+    Return the smallest node of the connected component of each of the `n`
+    nodes linked by the edges (a, b): roots are hooked to the smaller root
+    across each edge, then every node jumps to its parent's parent until
+    all point to their root.
+    """
+    label = np.arange(n)
+    while True:
+        la, lb = label[a], label[b]
+        if (la == lb).all():
+            return label
+        low = np.minimum(la, lb)
+        np.minimum.at(label, la, low)
+        np.minimum.at(label, lb, low)
+        while True:
+            up = label[label]
+            if (up == label).all():
+                break
+            label = up
+
+
+def near_pairs(lat, lng, radius):
+    """
+    Return the pairs (i, j), i < j, of the points less than `radius` metres
+    apart. The points are bucketed into cells `radius` high and at least
+    `radius` wide at the highest latitude, so near points are in the same
+    or adjacent cells; each cell is compared with itself and with four of
+    its neighbours.
+    """
+    empty = np.zeros(0, dtype = np.int64)
+    if len(lat) < 2 or radius <= 0:
+        return empty, empty
+    height = radius / metres_per_degree
+    width = height / max(np.cos(np.radians(np.abs(lat).max())), 0.01)
+    row = np.floor(lat / height).astype(np.int64)
+    col = np.floor(lng / width).astype(np.int64)
+    col -= col.min() - 1
+    stride = col.max() + 2
+    keys = row * stride + col
+    order = np.argsort(keys, kind = "stable")
+    cells, starts, counts = np.unique(keys[order], return_index = True, return_counts = True)
+
+    pairs_a, pairs_b = [], []
+    for offset in (0, 1, stride - 1, stride, stride + 1):
+        other = np.searchsorted(cells, cells + offset)
+        found = other < len(cells)
+        found[found] = cells[other[found]] == cells[found] + offset
+        source, other = np.flatnonzero(found), other[found]
+        size = counts[source] * counts[other]
+        which, within = spread(np.zeros(len(size), dtype = np.int64), size - 1)
+        i = starts[source][which] + within // counts[other][which]
+        j = starts[other][which] + within % counts[other][which]
+        if offset == 0:
+            keep = i < j
+            i, j = i[keep], j[keep]
+        i, j = order[i], order[j]
+        dy = (lat[i] - lat[j]) * metres_per_degree
+        dx = (lng[i] - lng[j]) * metres_per_degree * np.cos(np.radians((lat[i] + lat[j]) / 2))
+        near = dx * dx + dy * dy < radius * radius
+        pairs_a.append(np.minimum(i, j)[near])
+        pairs_b.append(np.maximum(i, j)[near])
+    return np.concatenate(pairs_a), np.concatenate(pairs_b)
+
+
+def first_of(codes):
+    """
+    Return, for each row, the first row with the same code.
+    """
+    _, first, inverse = np.unique(codes, return_index = True, return_inverse = True)
+    return first[inverse.ravel()]
+
+
+def address_ranks(df):
+    """
+    Return the sorted distinct normalized addresses of `df` and the rank of
+    each row's address among them (-1 without street address). Each
+    distinct spelling of an address is only normalized once.
+    """
+    columns = ["st_num", "route", "city", "state_abbv"]
+    codes = df.groupby(columns, dropna = False, sort = False).ngroup().to_numpy()
+    _, first = np.unique(codes, return_index = True)
+    keys = np.array([address_key(*row) for row in zip(
+        *(df[name].to_numpy()[first].tolist() for name in columns))], dtype = object)
+    valid = pd.notna(keys)
+    names, rank = np.unique(keys[valid].astype(str), return_inverse = True)
+    ranks = np.full(len(keys), -1, dtype = np.int64)
+    ranks[valid] = rank.ravel()
+    return names, ranks[codes]
+
+
+def site_ids(df, radius = default_radius):
+    """
+    Return the `site_id` of each row of `df` (columns lat, lng, st_num,
+    route, city, state_abbv), None for rows without street address (e.g.
+    geocoded to a city only).
+    """
+    names, ranks = address_ranks(df)
+    addressed = np.flatnonzero(ranks >= 0)
+    ranks = ranks[addressed]
+    lat = pd.to_numeric(df['lat'], errors = "coerce").to_numpy(dtype = np.float64)[addressed]
+    lng = pd.to_numeric(df['lng'], errors = "coerce").to_numpy(dtype = np.float64)[addressed]
+
+    # rows are linked to the first row with the same address, to the first
+    # row with the same coordinates, and distinct coordinates to the ones
+    # nearby
+    located = np.flatnonzero(~(np.isnan(lat) | np.isnan(lng)))
+    points, first, inverse = np.unique(lat[located] + 1j * lng[located],
+                                       return_index = True, return_inverse = True)
+    representative = located[first]
+    i, j = near_pairs(points.real, points.imag, radius)
+    a = np.concatenate([np.arange(len(ranks)), located, representative[i]])
+    b = np.concatenate([first_of(ranks), representative[inverse.ravel()], representative[j]])
+    label = components(len(ranks), a, b)
+
+    # name each site by the smallest of its addresses
+    smallest = np.full(len(ranks), len(names), dtype = np.int64)
+    np.minimum.at(smallest, label, ranks)
+    sites, site = np.unique(label, return_inverse = True)
+    ids = np.array([hashlib.sha1(name.encode("utf-8")).hexdigest()[:12]
+                    for name in names[smallest[sites]].tolist()], dtype = object)
+    site_id = np.full(len(df), None, dtype = object)
+    site_id[addressed] = ids[site.ravel()]
+    return site_id
+
+
+def add_sites(df, radius = default_radius):
+    """
+    Return the DataFrame of tweet_frame.build_frame with a `site_id` column.
+    """
+    start = time.perf_counter()
+    site_id = site_ids(df, radius)
+    log.info("{} tweets at {} sites in {:.3f} s".format(
+        len(df), len(set(site_id) - {None}), time.perf_counter() - start))
+    return df.assign(site_id = site_id)
+
+
+def site_table(df):
+    """
+    Return the deliveries per site of a DataFrame with a `site_id` column:
+    the number of tweets, the median coordinates and the most frequent
+    address of each site, most deliveries first.
+    """
+    df = df[df['site_id'].notna()]
+    columns = [name for name in address_columns + ("district",) if name in df]
+    sites = df.groupby("site_id").agg(count = ("site_id", "size"),
+                                      lat = ("lat", "median"), lng = ("lng", "median"))
+    addresses = (df.groupby(["site_id"] + columns, dropna = False).size()
+                 .rename("n").reset_index()
+                 .sort_values(["site_id", "n"], ascending = [True, False], kind = "stable")
+                 .drop_duplicates("site_id")
+                 .set_index("site_id")[columns])
+    return (sites.join(addresses).reset_index()
+            .sort_values(["count", "site_id"], ascending = [False, True], kind = "stable")
+            .reset_index(drop = True))
+
+
+def write_sites(df, path = default_path):
+    """
+    Write the site table of `df` to `path`; returns the table.
+    """
+    sites = site_table(df)
+    sites.to_csv(path, index = False)
+    return sites
+
+
+if __name__ == "__main__":
+
+    logger = logging.getLogger()
+    logger.setLevel(logging.INFO)
+    handler = logging.StreamHandler()
+    handler.setLevel(logging.INFO)
+    logger.addHandler(handler)
+
+    parser = argparse.ArgumentParser(description = 'Count deliveries per polling location')
+    parser.add_argument('-csv', type = str,
+                        help = 'CSV file with lat, lng and address columns',
+                        default = "data/csv/PizzaToThePolls.csv")
+    parser.add_argument('-out', type = str,
+                        help = "Table of sites ('' to only print the largest)",
+                        default = default_path)
+    parser.add_argument('-radius', type = float,
+                        help = 'Distance in metres under which two tweets are at the same site',
+                        default = default_radius)
+    args = parser.parse_args()
+
+    df = pd.read_csv(args.csv, dtype = {name: str for name in address_columns})
+    df = add_sites(df, args.radius)
+    sites = write_sites(df, args.out) if args.out else site_table(df)
+    print(sites.head(20).to_string())
+    print("{} tweets, {} sites, {} with more than one delivery".format(
+        len(df), len(sites), (sites['count'] > 1).sum()))
+    sys.exit()
@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Synthetic Election-Day corpus for load testing the scrape_tweets pipeline.
+
+The corpus is modeled on the raw search pages of one real day
+(`data/tweets/raw`): tweets per hour, share of retweets, share of tweets
+naming an address, and texts and user objects resampled from the real
+tweets, so the text length distribution and the page size follow the
+data. Each address tweet gets a new house number, so the number of
+distinct geocode queries grows with the corpus as it would on a bigger
+day. Retweets are modeled on the tweets retweeted that day (mostly
+@PizzaToThePolls reporting lines at polling places): they repeat recent
+synthetic originals made from those, start a new one as often as the real
+retweets did, and name an address as often as the real retweets.
+
+Pages are written like the pages of 01_scrape_twitter.py, gzip
+compressed "search_resp<from>-<to>-<page>.json.gz" files of at most
+`-pagesize` tweets chained by 'next' tokens.
+
+$ python script/scrape_tweets/synthetic.py -scale 10 -outdir data/synthetic/raw
+"""
+
+import argparse
+import datetime
+import hashlib
+import json
+import logging
+import os
+import random
+import sys
+sys.path.append(os.getcwd() + "/script/scrape_tweets")
+import raw_archive
+from address_query import address_query, parse_components, street_pattern
+from tweet_reader import iter_tweets
+from tweet_text import clean_tweets
+
+log = logging.getLogger(__name__)
+
+# format of Twitter's `created_at`
+created_at_format = "%a %b %d %H:%M:%S +0000 %Y"
+# start of the tweet id epoch (ms), ids are (ms since epoch) << 22
+snowflake_epoch = 1288834974657
+
+# user objects kept from the real pages
+max_users = 2000
+# synthetic originals a retweet picks from
+recent_originals = 200
+
+
+def percentiles(values, qs = (.1, .5, .9)):
+    ordered = sorted(values)
+    if not ordered:
+        return [None for _ in qs]
+    return [ordered[min(len(ordered) - 1, int(q * len(ordered)))] for q in qs]
+
+
+def profile_corpus(rawdir, script03dir = None):
+    """
+    Return the profile of the raw search pages in `rawdir` that the
+    synthetic corpus is modeled on:
+    ---
+    tweets (int, tweets in the pages)
+    hours ({'YYYYMMDDHH': tweets posted in the hour})
+    rt_ratio (float, share of retweets)
+    address_rate (float, share of original tweets with a plausible address)
+    rt_address_rate (float, share of retweets with a plausible address)
+    new_rt_rate (float, distinct retweeted tweets per retweet)
+    plain, addresses (lists of original texts without and with an address)
+    retweeted ({has address: list of (screen name, text) of retweeted tweets})
+    users (list of user objects)
+    lengths (list of text lengths)
+    places (list of geocoded addresses of `script03dir`, used by fake_geocode)
+    """
+    hours = {}
+    plain, addresses, users, lengths = [], [], [], []
+    texts, rt_texts = [], []
+    retweeted = {}
+    files = sorted(f for f in os.listdir(rawdir) if f.startswith("search_resp"))
+    for file in files:
+        for tweet in iter_tweets(os.path.join(rawdir, file)):
+            created = datetime.datetime.strptime(tweet['created_at'], created_at_format)
+            hour = created.strftime("%Y%m%d%H")
+            hours[hour] = hours.get(hour, 0) + 1
+            lengths.append(len(tweet['text']))
+            if len(users) < max_users and tweet.get('user') is not None:
+                users.append(tweet['user'])
+            if tweet.get('retweeted_status') is not None:
+                rt_texts.append(tweet['text'])
+                original = tweet['retweeted_status']
+                text = original.get('extended_tweet', {}).get('full_text', original['text'])
+                retweeted[original['id']] = (original['user']['screen_name'], text)
+            else:
+                texts.append(tweet['text'])
+    for text, query in zip(texts, clean_tweets(texts)):
+        if address_query(query) is not None:
+            addresses.append(text)
+        else:
+            plain.append(text)
+    rt_addresses = sum(1 for query in clean_tweets(rt_texts) if address_query(query) is not None)
+    # an original counts as an address tweet if its retweets show the address
+    originals = list(retweeted.values())
+    shown = clean_tweets([retweet_text(*original) for original in originals])
+    retweeted = {True: [], False: []}
+    for original, query in zip(originals, shown):
+        retweeted[address_query(query) is not None].append(original)
+    places = []
+    if script03dir is not None and os.path.isdir(script03dir):
+        for file in sorted(os.listdir(script03dir)):
+            for tweet in iter_tweets(os.path.join(script03dir, file)):
+                if tweet.get('lat') is not None and tweet.get('state_abbv') is not None:
+                    places.append({k: tweet.get(k) for k in
+                                   ("city", "county", "state", "state_abbv",
+                                    "zipcode", "lat", "lng")})
+    n = sum(hours.values())
+    return {"tweets": n,
+            "hours": hours,
+            "rt_ratio": len(rt_texts) / n if n else 0.,
+            "address_rate": len(addresses) / len(texts) if texts else 0.,
+            "rt_address_rate": rt_addresses / len(rt_texts) if rt_texts else 0.,
+            "new_rt_rate": len(originals) / len(rt_texts) if rt_texts else 0.,
+            "plain": plain,
+            "addresses": addresses,
+            "retweeted": retweeted,
+            "users": users,
+            "lengths": lengths,
+            "places": places}
+
+
+def profile_summary(profile):
+    return ("{} tweets over {} hours, {:.1%} retweets, {:.1%} of originals and "
+            "{:.1%} of retweets with an address, text length p10/p50/p90 {}/{}/{}").format(
+                profile['tweets'], len(profile['hours']), profile['rt_ratio'],
+                profile['address_rate'], profile['rt_address_rate'],
+                *percentiles(profile['lengths']))
+
+
+def renumber(text, rng):
+    """
+    Give the first street address of `text` a random house number.
+    """
+    m = street_pattern.search(text)
+    if m is None:
+        return text
+    return text[:m.start(1)] + str(rng.randint(1, 9999)) + text[m.end(1):]
+
+
+def retweet_text(screen_name, text):
+    """
+    Text of a retweet of `text`, truncated to 140 characters as the API does.
+    """
+    rt = "RT @{}: {}".format(screen_name, text)
+    if len(rt) > 140:
+        rt = rt[:139] + "…"
+    return rt
+
+
+def tweet_id(created):
+    ms = int(created.timestamp() * 1000) - snowflake_epoch
+    return ms << 22
+
+
+def generate_tweets(profile, hour, n, rng, rt_ratio = None, address_rate = None):
+    """
+    Return `n` synthetic tweets (raw API dictionaries) posted during `hour`
+    ('YYYYMMDDHH'), newest first as the search API returns them.
+    """
+    rt_ratio = profile['rt_ratio'] if rt_ratio is None else rt_ratio
+    address_rate = profile['address_rate'] if address_rate is None else address_rate
+    start = datetime.datetime.strptime(hour, "%Y%m%d%H").replace(tzinfo = datetime.timezone.utc)
+    offsets = sorted(rng.random() * 3600 for _ in range(n))
+    originals = {True: [], False: []} # synthetic retweeted tweets, by address
+    tweets = []
+    for i, offset in enumerate(offsets):
+        created = start + datetime.timedelta(seconds = offset)
+        id_ = tweet_id(created) + i % (1 << 21)
+        user = rng.choice(profile['users']) if profile['users'] else {"screen_name": "user"}
+        with_address = rng.random() < profile['rt_address_rate']
+        templates = profile['retweeted'][with_address]
+        if templates and rng.random() < rt_ratio:
+            recent = originals[with_address]
+            if not recent or rng.random() < profile['new_rt_rate']:
+                screen_name, text = rng.choice(templates)
+                if with_address:
+                    text = renumber(text, rng)
+                recent.append({"created_at": created.strftime(created_at_format),
+                               "id": id_ + (1 << 21), "id_str": str(id_ + (1 << 21)),
+                               "text": text,
+                               "user": {"screen_name": screen_name}})
+                del recent[:-recent_originals]
+            retweeted = rng.choice(recent)
+            text = retweet_text(retweeted['user']['screen_name'], retweeted['text'])
+        else:
+            if profile['addresses'] and rng.random() < address_rate:
+                text = renumber(rng.choice(profile['addresses']), rng)
+            else:
+                text = rng.choice(profile['plain']) if profile['plain'] else ""
+            retweeted = None
+        tweet = {"created_at": created.strftime(created_at_format),
+                 "id": id_,
+                 "id_str": str(id_),
+                 "text": text,
+                 "truncated": False,
+                 "user": user,
+                 "lang": "en"}
+        if retweeted is not None:
+            tweet["retweeted_status"] = retweeted
+        tweets.append(tweet)
+    tweets.reverse()
+    return tweets
+
+
+def generate_pages(profile, scale = 10, page_size = 500, seed = 0,
+                   rt_ratio = None, address_rate = None):
+    """
+    Yield (file name, response body) of the pages of a corpus `scale`
+    times the size of the profiled one, hour by hour.
+    """
+    rng = random.Random(seed)
+    for hour in sorted(profile['hours']):
+        n = int(round(profile['hours'][hour] * scale))
+        tweets = generate_tweets(profile, hour, n, rng, rt_ratio, address_rate)
+        fromDate = hour + "00"
+        toDate = (datetime.datetime.strptime(hour, "%Y%m%d%H") +
+                  datetime.timedelta(hours = 1)).strftime("%Y%m%d%H") + "00"
+        pages = [tweets[i:i + page_size] for i in range(0, len(tweets), page_size)]
+        for page, results in enumerate(pages):
+            body = {"results": results,
+                    "requestParameters": {"maxResults": page_size,
+                                          "fromDate": fromDate,
+                                          "toDate": toDate}}
+            if page < len(pages) - 1:
+                body["next"] = hashlib.sha1("{}-{}".format(hour, page).encode()).hexdigest()
+            name = "search_resp{}-{}-{}.json.gz".format(fromDate, toDate, page)
+            yield name, json.dumps(body).encode("utf-8")
+
+
+def write_corpus(outdir, pages):
+    """
+    Save the (file name, response body) `pages` to `outdir`.
+    Returns (pages, bytes written).
+    """
+    os.makedirs(outdir, exist_ok = True)
+    n = size = 0
+    for name, content in pages:
+        path = os.path.join(outdir, name)
+        raw_archive.write_page(path, content)
+        n += 1
+        size += os.path.getsize(path)
+    return n, size
+
+
+def fake_geocode(query, places):
+    """
+    Offline stand-in for the Geocoding API: the parsed address of `query`
+    with its house number and street, placed at one of the real geocoded
+    `places` chosen by the hash of the query. Returns None if the query
+    has no address.
+    """
+    parts = parse_components(query) if query is not None else None
+    if parts is None or not places:
+        return None
+    h = int(hashlib.sha1(query.encode("utf-8")).hexdigest()[:8], 16)
+    place = dict(places[h % len(places)])
+    place.update({"st_num": parts['number'],
+                  "route": parts['street'],
+                  "full": "{} {}, {}, {} {}, USA".format(
+                      parts['number'], parts['street'], place['city'],
+                      place['state_abbv'], place['zipcode'] or "").replace(" ,", ",")})
+    return place
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description = 'Generate a synthetic Election-Day corpus')
+    parser.add_argument('-rawdir', type = str,
+                        help = 'Directory of the raw search pages the corpus is modeled on',
+                        default = 'data/tweets/raw')
+    parser.add_argument('-outdir', type = str,
+                        help = 'Directory to store the synthetic raw pages',
+                        default = 'data/synthetic/raw')
+    parser.add_argument('-scale', type = float,
+                        help = 'Size of the corpus relative to the modeled one (e.g. 10, 1000)',
+                        default = 10)
+    parser.add_argument('-pagesize', type = int,
+                        help = 'Tweets per page',
+                        default = 500)
+    parser.add_argument('-rtratio', type = float,
+                        help = 'Share of retweets (default: as in -rawdir)',
+                        default = None)
+    parser.add_argument('-addressrate', type = float,
+                        help = 'Share of original tweets with an address (default: as in -rawdir)',
+                        default = None)
+    parser.add_argument('-seed', type = int,
+                        help = 'Seed of the random generator',
+                        default = 0)
+    parser.add_argument('-v','--verbose',
+                        help = "Set log level to debug", action = "store_true")
+    args = parser.parse_args()
+
+    log.setLevel(logging.ERROR)
+    if args.verbose:
+        log.setLevel(logging.DEBUG)
+    loghandler = logging.StreamHandler(sys.stderr)
+    loghandler.setFormatter(logging.Formatter("[%(asctime)s] %(message)s"))
+    log.addHandler(loghandler)
+
+    profile = profile_corpus(args.rawdir)
+    print("Profile: {}".format(profile_summary(profile)))
+    n, size = write_corpus(args.outdir, generate_pages(profile, scale = args.scale,
+                                                       page_size = args.pagesize,
+                                                       seed = args.seed,
+                                                       rt_ratio = args.rtratio,
+                                                       address_rate = args.addressrate))
+    print("{} pages, {:.1f} MB written to {}".format(n, size / 1e6, args.outdir))
+    sys.exit()
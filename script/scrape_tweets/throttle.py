@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Token bucket shared by the threads that call a rate-limited API.
+"""
+
+import threading
+import time
+
+
+class TokenBucket(object):
+    """
+    Hands out `rate` tokens per second and holds at most `capacity` tokens,
+    so bursts never exceed `capacity` requests.
+    ---
+    rate (float, tokens added per second)
+    capacity (int, maximum number of tokens held at once)
+    """
+
+    def __init__(self, rate, capacity = 1):
+        self.rate = float(rate)
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Block until a token is available and take it.
+        Return the number of seconds spent waiting.
+        """
+        waited = 0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity,
+                                  self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if now < self.blocked_until:
+                    wait = self.blocked_until - now
+                elif self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                else:
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+    def pause(self, seconds):
+        """
+        Hold every caller for `seconds`, e.g. after the API reports that
+        the quota is used up.
+        """
+        with self.lock:
+            self.tokens = 0
+            self.blocked_until = max(self.blocked_until,
+                                     time.monotonic() + seconds)
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Build the table of geocoded tweets written by 04_convert_to_csv.py.
+Rows are collected into one list per column in a single pass and the
+DataFrame is built once at the end, with typed columns: `id` int64,
+`lat` and `lng` float64, `created_at` datetime (UTC).
+"""
+
+import numpy as np
+import pandas as pd
+
+# columns of PizzaToThePolls.csv, in the order they are written
+colnames = ("city", "clean_text", "county", "created_at", "id", "lat", "lng",
+            "route", "st_num", "state_abbv", "zipcode")
+
+# format of Twitter's `created_at`, e.g. "Tue Nov 06 13:13:36 +0000 2018"
+created_at_format = "%a %b %d %H:%M:%S %z %Y"
+
+
+def collect_columns(tweets):
+    """
+    Return {column: list of values} over the tweets that contain an address,
+    with None for fields a tweet lacks (e.g. when geocoding failed).
+    """
+    columns = {name: [] for name in colnames}
+    appends = [(name, columns[name].append) for name in colnames]
+    for tweet in tweets:
+        if tweet.get('contain_address') != True:
+            continue
+        get = tweet.get
+        for name, append in appends:
+            append(get(name))
+    return columns
+
+
+def merge_columns(parts):
+    """
+    Concatenate the column buffers of `collect_columns`, in order.
+    """
+    columns = {name: [] for name in colnames}
+    for part in parts:
+        for name in colnames:
+            columns[name].extend(part[name])
+    return columns
+
+
+def to_frame(columns):
+    """
+    Return the typed DataFrame of the column buffers of `collect_columns`.
+    """
+    columns = dict(columns)
+    columns['id'] = np.array(columns['id'], dtype = np.int64)
+    for name in ("lat", "lng"):
+        columns[name] = pd.to_numeric(pd.Series(columns[name], dtype = object),
+                                      errors = "coerce").astype(np.float64)
+    columns['created_at'] = pd.to_datetime(pd.Series(columns['created_at'], dtype = object),
+                                           format = created_at_format,
+                                           errors = "coerce", utc = True)
+    return pd.DataFrame(columns, columns = list(colnames))
+
+
+def build_frame(tweets):
+    """
+    Return the DataFrame of the tweets that contain an address.
+    =====================
+    tweets (iterable of tweet dictionaries from 03_parse_address.py)
+    """
+    return to_frame(collect_columns(tweets))
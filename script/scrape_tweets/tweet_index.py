@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SQLite index from tweet id to the raw search page holding the tweet and
+the byte range of the tweet within the (decompressed) page.
+01_scrape_twitter.py adds each page as it is saved; this file can also be
+run to index pages already on disk or to look tweets up:
+
+$ python script/scrape_tweets/tweet_index.py -rawdir data/tweets/raw
+$ python script/scrape_tweets/tweet_index.py -lookup 1059822571867168769
+"""
+
+import argparse
+import functools
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+sys.path.append(os.getcwd() + "/script/scrape_tweets")
+import raw_archive
+
+log = logging.getLogger(__name__)
+
+
+# JSON whitespace, skipped between tokens
+whitespace = " \t\r\n"
+
+
+def skip(text, pos, chars = whitespace):
+    """
+    Return the position of the first character of `text` from `pos` on
+    that is not in `chars`.
+    """
+    while pos < len(text) and text[pos] in chars:
+        pos += 1
+    return pos
+
+
+def scan_results(content):
+    """
+    Yield (tweet id, start, end) for every tweet in the 'results' array of
+    the response body `content`, where content[start:end] is the tweet.
+    The members of the top-level object are read with the JSON decoder,
+    so 'results' is only found as a key of the response, never inside
+    another value.
+    """
+    text = content.decode("utf-8")
+    ascii_only = len(text) == len(content)
+    decoder = json.JSONDecoder()
+
+    # skip the members before 'results'; error responses carry none
+    pos = skip(text, 0)
+    if not text.startswith("{", pos):
+        return
+    pos = skip(text, pos + 1)
+    while not text.startswith("}", pos):
+        key, pos = decoder.raw_decode(text, pos)
+        pos = skip(text, pos)
+        if not text.startswith(":", pos):
+            raise ValueError("Expected ':' at {}".format(pos))
+        pos = skip(text, pos + 1)
+        if key == "results" and text.startswith("[", pos):
+            break
+        _, pos = decoder.raw_decode(text, pos)
+        pos = skip(text, pos, whitespace + ",")
+    else:
+        return
+
+    pos += 1
+    byte_pos = last = pos
+    while True:
+        pos = skip(text, pos, whitespace + ",")
+        if text[pos] == "]":
+            return
+        obj, end = decoder.raw_decode(text, pos)
+        if ascii_only:
+            start, stop = pos, end
+        else:
+            # character offsets differ from byte offsets after any
+            # multi-byte character
+            byte_pos += len(text[last:pos].encode("utf-8"))
+            start = byte_pos
+            byte_pos += len(text[pos:end].encode("utf-8"))
+            stop = byte_pos
+            last = end
+        yield obj['id'], start, stop
+        pos = end
+
+
+class TweetIndex(object):
+    """
+    Index of tweet ids stored in the SQLite database at `path`.
+    Safe to share between the threads of 01_scrape_twitter.py.
+    ---
+    cache_pages (int, decompressed pages kept for lookups)
+    """
+
+    def __init__(self, path, cache_pages = 16):
+        self.path = path
+        self.lock = threading.Lock()
+        # (file, mtime, size) -> decompressed page; a rewritten page gets a new key
+        self.pages = functools.lru_cache(maxsize = cache_pages)(
+            lambda file, mtime, size: raw_archive.read_page(file))
+        self.db = sqlite3.connect(path, check_same_thread = False)
+        self.db.execute("""CREATE TABLE IF NOT EXISTS tweets (
+                            id INTEGER PRIMARY KEY,
+                            file TEXT NOT NULL,
+                            start INTEGER NOT NULL,
+                            end INTEGER NOT NULL)""")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS files (
+                            file TEXT PRIMARY KEY,
+                            size INTEGER NOT NULL)""")
+        self.db.commit()
+
+    def add_page(self, file, content):
+        """
+        Index the tweets of the response body `content` saved at `file`.
+        """
+        rows = [(id_, file, start, end) for id_, start, end in scan_results(content)]
+        with self.lock:
+            with self.db:
+                self.db.executemany("INSERT OR REPLACE INTO tweets VALUES (?, ?, ?, ?)",
+                                    rows)
+                self.db.execute("INSERT OR REPLACE INTO files VALUES (?, ?)",
+                                (file, os.path.getsize(file)))
+        return len(rows)
+
+    def rename(self, old, new):
+        """
+        Point the tweets indexed in the page `old` at the page `new`, e.g.
+        after raw_archive.compress_dir compressed it. The offsets are into
+        the decompressed page, so they stay the same.
+        """
+        with self.lock:
+            with self.db:
+                self.db.execute("UPDATE tweets SET file = ? WHERE file = ?", (new, old))
+                self.db.execute("DELETE FROM files WHERE file = ?", (old,))
+                self.db.execute("INSERT OR REPLACE INTO files VALUES (?, ?)",
+                                (new, os.path.getsize(new)))
+
+    def add_dir(self, rawdir):
+        """
+        Index every "search_resp*" page in `rawdir` that is new or
+        changed since it was last indexed. Returns the number of pages indexed.
+        """
+        with self.lock:
+            known = dict(self.db.execute("SELECT file, size FROM files"))
+        n = 0
+        for file in sorted(os.listdir(rawdir)):
+            if not (file.startswith("search_resp") and
+                    file.endswith((".json", ".json.gz"))):
+                continue
+            path = os.path.join(rawdir, file)
+            if known.get(path) == os.path.getsize(path):
+                continue
+            count = self.add_page(path, raw_archive.read_page(path))
+            log.info("Indexed {} tweets in {}".format(count, file))
+            n += 1
+        return n
+
+    def locate(self, id_):
+        """
+        Return (file, start, end) of tweet `id_`, or None if not indexed.
+        """
+        with self.lock:
+            return self.db.execute("SELECT file, start, end FROM tweets WHERE id = ?",
+                                   (int(id_),)).fetchone()
+
+    def read_page(self, file):
+        """
+        Return the decompressed page at `file`, decompressing it only if
+        it is not among the last pages read or changed since.
+        """
+        stat = os.stat(file)
+        return self.pages(file, stat.st_mtime_ns, stat.st_size)
+
+    def lookup(self, id_):
+        """
+        Return the original tweet object for `id_`, or None if not indexed.
+        Tweets of the same page are sliced out of one decompressed copy.
+        """
+        found = self.locate(id_)
+        if found is None:
+            return None
+        file, start, end = found
+        return json.loads(self.read_page(file)[start:end])
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description = 'Index raw tweets by id')
+    parser.add_argument('-rawdir', type = str,
+                        help = 'Directory storing raw JSON responses',
+                        default = 'data/tweets/raw')
+    parser.add_argument('-index', type = str,
+                        help = 'SQLite file of the tweet id index',
+                        default = 'data/tweets/tweet_index.sqlite')
+    parser.add_argument('-lookup', type = int, nargs = "*",
+                        help = 'Tweet ids to print instead of indexing rawdir')
+    parser.add_argument('-v','--verbose',
+                        help = "Set log level to debug", action="store_true")
+    args = parser.parse_args()
+
+    log.setLevel(logging.ERROR)
+    if args.verbose:
+        log.setLevel(logging.DEBUG)
+    loghandler = logging.StreamHandler(sys.stderr)
+    loghandler.setFormatter(logging.Formatter("[%(asctime)s] %(message)s"))
+    log.addHandler(loghandler)
+
+    index = TweetIndex(args.index)
+    if args.lookup:
+        for id_ in args.lookup:
+            print(json.dumps(index.lookup(id_)))
+    else:
+        print("{} pages indexed".format(index.add_dir(args.rawdir)))
+    index.close()
+    sys.exit()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Read and write the JSON files of the scrape_tweets stages one tweet at a
+time, so that memory is bounded by one tweet rather than one file.
+Reads JSON arrays ("scraped*.json", "cleaned*.json", "parsed*.json"),
+raw search pages (the 'results' array of "search_resp*.json[.gz]") and
+newline-delimited JSON ("*.jsonl[.gz]").
+"""
+
+import gzip
+import json
+
+chunk_size = 1 << 16
+
+
+def open_text(path, mode = "r"):
+    """
+    Open `path` as text, decompressing "*.gz" files.
+    """
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding = "utf-8", errors = "ignore")
+    return open(path, mode, encoding = "utf-8", errors = "ignore")
+
+
+def iter_array(f, key = None):
+    """
+    Yield the elements of a JSON array read incrementally from the text
+    file object `f`. If `key` is given, the array is the value of `key`
+    in the top-level object (e.g. 'results' of a raw search page).
+    """
+    decoder = json.JSONDecoder()
+    buf = ""
+    pos = 0
+    eof = False
+
+    def fill(buf, pos, size):
+        chunk = f.read(size)
+        return buf[pos:] + chunk, 0, chunk == ""
+
+    # move to the first element of the array
+    start = '"{}"'.format(key) if key is not None else "["
+    while True:
+        found = buf.find(start)
+        if found >= 0 and (key is None or buf.find("[", found) >= 0):
+            pos = (found if key is None else buf.find("[", found)) + 1
+            break
+        if eof:
+            return
+        buf, pos, eof = fill(buf, 0, chunk_size)
+
+    size = chunk_size
+    while True:
+        while pos < len(buf) and buf[pos] in " \t\r\n,":
+            pos += 1
+        if pos == len(buf):
+            if eof:
+                raise ValueError("Unterminated JSON array")
+            buf, pos, eof = fill(buf, pos, size)
+            continue
+        if buf[pos] == "]":
+            return
+        try:
+            obj, end = decoder.raw_decode(buf, pos)
+        except ValueError:
+            end = None
+        # a value running up to the end of the buffer may be cut short
+        if end is None or (end == len(buf) and not eof):
+            if eof:
+                raise ValueError("Truncated JSON value at offset {}".format(pos))
+            buf, pos, eof = fill(buf, pos, size)
+            # read larger chunks for records longer than one chunk
+            size *= 2
+            continue
+        size = chunk_size
+        yield obj
+        pos = end
+
+
+def iter_tweets(path, key = None):
+    """
+    Yield the tweets stored in the file at `path` one at a time.
+    Raw search pages ("search_resp*") are read from their 'results' array.
+    """
+    if key is None and "search_resp" in path:
+        key = "results"
+    with open_text(path) as f:
+        if path.endswith((".jsonl", ".jsonl.gz")):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            for tweet in iter_array(f, key = key):
+                yield tweet
+
+
+def iter_chunks(tweets, size):
+    """
+    Group the iterable `tweets` into lists of at most `size` tweets.
+    """
+    chunk = []
+    for tweet in tweets:
+        chunk.append(tweet)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def write_tweets(path, tweets):
+    """
+    Write the iterable `tweets` to `path` as a JSON array, one tweet at a
+    time. The output is the same as json.dump() of the list of tweets.
+    Returns the number of tweets written.
+    """
+    n = 0
+    with open_text(path, "w") as j:
+        j.write("[")
+        for tweet in tweets:
+            if n:
+                j.write(", ")
+            j.write(json.dumps(tweet))
+            n += 1
+        j.write("]")
+    return n
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Typed, compressed copy of PizzaToThePolls.csv written by
+04_convert_to_csv.py, as a Parquet (or Arrow IPC) dataset partitioned by
+state and hour of the tweet:
+
+    data/parquet/PizzaToThePolls/state_abbv=NY/hour=2018110613/part-0.parquet
+
+Readers select columns and partitions and only touch those files, which
+are memory-mapped. From R: arrow::open_dataset("data/parquet/PizzaToThePolls").
+Each write replaces the whole dataset. Requires pyarrow.
+
+$ python script/scrape_tweets/tweet_store.py -state NY -columns id lat lng
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.fs
+
+# stable schema of the dataset; `state_abbv` and `hour` are the partitions
+schema = pa.schema([("id", pa.int64()),
+                    ("created_at", pa.timestamp("us", tz = "UTC")),
+                    ("lat", pa.float64()),
+                    ("lng", pa.float64()),
+                    ("st_num", pa.string()),
+                    ("route", pa.string()),
+                    ("city", pa.string()),
+                    ("county", pa.string()),
+                    ("zipcode", pa.string()),
+                    ("clean_text", pa.string()),
+                    ("district", pa.string()),
+                    ("site_id", pa.string()),
+                    ("state_abbv", pa.string()),
+                    ("hour", pa.string())])
+
+partitioning = ds.partitioning(pa.schema([("state_abbv", pa.string()),
+                                          ("hour", pa.string())]),
+                               flavor = "hive")
+
+# hour partition of a tweet, as in the file names of the raw pages
+hour_format = "%Y%m%d%H"
+
+formats = {"parquet": ds.ParquetFileFormat(), "arrow": ds.IpcFileFormat()}
+
+
+def to_table(df):
+    """
+    Convert the DataFrame of tweet_frame.build_frame to an Arrow table
+    with `schema`. Columns added by later stages (`district`, `site_id`)
+    are null where the frame has none.
+    """
+    df = df.assign(hour = df['created_at'].dt.strftime(hour_format))
+    df = df.assign(**{name: None for name in schema.names if name not in df})
+    return pa.Table.from_pandas(df[schema.names], schema = schema,
+                                preserve_index = False)
+
+
+def write_store(df, path, fmt = "parquet", compression = "zstd"):
+    """
+    Write the DataFrame of tweet_frame.build_frame to the dataset at
+    `path`, replacing the whole dataset: it is written next to `path` and
+    moved into place, so no partition of an earlier run is left behind.
+    ---
+    fmt (str, 'parquet' or 'arrow' for Arrow IPC files)
+    compression (str, codec of the files)
+    """
+    file_format = formats[fmt]
+    parent = os.path.dirname(os.path.abspath(path))
+    os.makedirs(parent, exist_ok = True)
+    tmp = tempfile.mkdtemp(prefix = "." + os.path.basename(path) + "-", dir = parent)
+    try:
+        ds.write_dataset(to_table(df), tmp,
+                         format = file_format,
+                         file_options = file_format.make_write_options(compression = compression),
+                         partitioning = partitioning,
+                         basename_template = "part-{i}." + fmt,
+                         existing_data_behavior = "overwrite_or_ignore")
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors = True)
+        raise
+    old = None
+    if os.path.exists(path):
+        old = tmp + "-old"
+        os.replace(path, old)
+    os.replace(tmp, path)
+    if old is not None:
+        shutil.rmtree(old)
+
+
+def open_store(path, fmt = "parquet"):
+    """
+    Open the dataset at `path` with memory-mapped files.
+    """
+    return ds.dataset(path, schema = schema, format = formats[fmt],
+                      partitioning = partitioning,
+                      filesystem = pyarrow.fs.LocalFileSystem(use_mmap = True))
+
+
+def read_store(path, columns = None, states = None, hours = None, fmt = "parquet"):
+    """
+    Read the dataset at `path` into an Arrow table (`.to_pandas()` for a
+    DataFrame), reading only the files of the partitions selected.
+    ---
+    columns (list of str, columns to read; None for all)
+    states (list of str, state abbreviations to read; None for all)
+    hours (list of str, hours "YYYYMMDDHH" to read; None for all)
+    """
+    condition = None
+    for field, values in (("state_abbv", states), ("hour", hours)):
+        if values is not None:
+            term = ds.field(field).isin(list(values))
+            condition = term if condition is None else condition & term
+    return open_store(path, fmt).to_table(columns = columns, filter = condition)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description = 'Read the tweet dataset')
+    parser.add_argument('-store', type = str,
+                        help = 'Directory of the dataset written by 04_convert_to_csv.py',
+                        default = 'data/parquet/PizzaToThePolls')
+    parser.add_argument('-format', type = str,
+                        help = 'File format of the dataset',
+                        choices = sorted(formats),
+                        default = 'parquet')
+    parser.add_argument('-columns', nargs = "*",
+                        help = 'Columns to read',
+                        default = None)
+    parser.add_argument('-state', nargs = "*",
+                        help = 'State abbreviations to read',
+                        default = None)
+    parser.add_argument('-hour', nargs = "*",
+                        help = 'Hours (YYYYMMDDHH) to read',
+                        default = None)
+    args = parser.parse_args()
+
+    table = read_store(args.store, columns = args.columns, states = args.state,
+                       hours = args.hour, fmt = args.format)
+    print("{} tweets".format(table.num_rows))
+    print(table.slice(0, 10).to_pandas())
+    sys.exit()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Clean tweet text for 02_clean_and_find_address.py.
+`clean_tweet` cleans one tweet; `clean_tweets` cleans a whole list of
+tweets at once with the same result, running each pass over a chunk of
+tweets joined into one string instead of once per tweet.
+"""
+
+import re
+
+# the original single-tweet pattern
+pattern = re.compile(r"(@[\S]+)|([^0-9A-Za-z \t])|(\w+:\/\/\S+)")
+
+# passes of the batch cleaner
+scheme = re.compile(r"://(?=\S)")
+mention = re.compile(r"@\S+")
+space = re.compile(r"\s")
+ascii_alnum = re.compile(r"[0-9A-Za-z]")
+keep = b"0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz \t"
+blank_table = bytes(c if c in keep else ord(" ") for c in range(256))
+
+# joins the tweets of a chunk; survives every pass untouched
+separator = " QXQTWEETBREAKQXQ "
+token = separator.strip()
+
+
+def clean_tweet(tweet):
+    '''
+    Utility function to clean the text in a tweet by removing
+    links and special characters using regex.
+    '''
+    return ' '.join(pattern.sub(" ", tweet).split())
+
+
+def blank_urls(text):
+    """
+    Replace each link (a word followed by '://' and more text) with a space,
+    from its first ASCII letter or digit to the next whitespace, the same
+    span the third group of `pattern` removes.
+    """
+    out = []
+    last = 0
+    for m in scheme.finditer(text):
+        if m.start() < last:
+            continue
+        # walk back over the word before '://'
+        r = m.start()
+        while r > last and (text[r - 1].isalnum() or text[r - 1] == "_"):
+            r -= 1
+        head = ascii_alnum.search(text, r, m.start())
+        if head is None:
+            continue
+        end = space.search(text, m.end())
+        out.append(text[last:head.start()])
+        out.append(" ")
+        last = end.start() if end else len(text)
+    out.append(text[last:])
+    return "".join(out)
+
+
+def blank_text(text):
+    """
+    Apply the passes of the batch cleaner to `text`: links, then mentions,
+    then every character other than ASCII letters, digits, space and tab.
+    Whitespace is not collapsed.
+    """
+    text = mention.sub(" ", blank_urls(text))
+    return text.encode("ascii", "replace").translate(blank_table).decode("ascii")
+
+
+def clean_tweets(tweets, chunk_size = 2000):
+    """
+    Clean a list of tweet texts. Returns the list of cleaned texts,
+    equal to [clean_tweet(t) for t in tweets].
+    ---
+    tweets (list of str)
+    chunk_size (int, number of tweets cleaned in one pass)
+    """
+    out = []
+    for i in range(0, len(tweets), chunk_size):
+        chunk = tweets[i:i + chunk_size]
+        joined = separator.join(chunk)
+        if joined.count(token) != len(chunk) - 1:
+            # a tweet contains the separator's token, which the passes
+            # could turn into a separator (or a separator into text)
+            out.extend(clean_tweet(t) for t in chunk)
+        else:
+            out.extend(' '.join(p.split()) for p in blank_text(joined).split(separator))
+    return out
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Client of Twitter's premium full-archive search API, shared by
+01_scrape_twitter.py and pipeline.py. Every request waits for a shared
+rate limiter, and requests answered with HTTP 429 wait out the rate limit
+window and are sent again. Server errors (5xx) and connection errors are
+retried a few times with exponential backoff; any other status, or a
+server error that persists, raises requests.HTTPError so that no error
+body is ever taken for a page of results.
+"""
+
+import base64
+import logging
+import time
+import requests
+
+log = logging.getLogger(__name__)
+
+api_url = 'https://api.twitter.com'
+query = '@PizzaToThePolls'
+
+
+class SearchClient(object):
+    """
+    ---
+    limiter (throttle.TokenBucket shared by all requests)
+    base_url (str, root of the API)
+    page_size (int, 'maxResults' of a search request)
+    retries (int, retries of a request failing with a server or connection error)
+    """
+
+    def __init__(self, limiter, base_url = api_url, page_size = 500, retries = 5):
+        self.limiter = limiter
+        self.retries = retries
+        self.base_url = base_url.rstrip("/")
+        self.page_size = page_size
+        self.headers = {}
+        self.search_url = '{}/1.1/tweets/search/fullarchive/research.json'.format(self.base_url)
+        self.count_url = '{}/1.1/tweets/search/fullarchive/research/counts.json'.format(self.base_url)
+
+    def authorize(self, client_key, client_secret):
+        """
+        Get an application-only bearer token, per
+        https://developer.twitter.com/en/docs/basics/authentication/overview/application-only
+        """
+        key_secret = '{}:{}'.format(client_key, client_secret).encode('ascii')
+        b64_encoded_key = base64.b64encode(key_secret).decode('ascii')
+        auth_headers = {
+            'Authorization': 'Basic {}'.format(b64_encoded_key),
+            'Content-Type': 'application/x-www-form-urlencoded;charset=UTF-8'}
+        auth_data = {'grant_type': 'client_credentials'}
+        auth_resp = requests.post('{}/oauth2/token'.format(self.base_url),
+                                  headers = auth_headers, data = auth_data)
+
+        # Check status code is 200, meaning "okay"
+        if auth_resp.status_code != 200:
+            log.error("Authorization status code: {}".format(auth_resp.status_code))
+        else:
+            log.info("Authorization request successful")
+        access_token = auth_resp.json()['access_token']
+        self.headers = {'Authorization': 'Bearer {}'.format(access_token)}
+        return access_token
+
+    def get(self, url, params):
+        """
+        Send a GET request to `url`, waiting out the rate limit window on
+        HTTP 429 and backing off exponentially on server and connection
+        errors, at most `retries` times. Returns the response, which may
+        still be an error if the retries ran out.
+        """
+        attempt = 0
+        while True:
+            self.limiter.acquire()
+            try:
+                resp = requests.get(url, headers = self.headers, params = params, timeout = 60)
+            except (requests.ConnectionError, requests.Timeout) as err:
+                if attempt >= self.retries:
+                    raise
+                log.info("Connection error: {}".format(err))
+            else:
+                if resp.status_code == 429:
+                    reset = resp.headers.get('x-rate-limit-reset')
+                    wait = max(int(reset) - time.time(), 1) if reset else 60
+                    log.info("Rate limited, waiting {:.0f} seconds".format(wait))
+                    self.limiter.pause(wait)
+                    continue
+                if resp.status_code < 500 or attempt >= self.retries:
+                    return resp
+                log.info("Server error {}".format(resp.status_code))
+            delay = min(2 ** attempt, 60)
+            log.info("Request failed, retrying in {} seconds".format(delay))
+            self.limiter.pause(delay)
+            attempt += 1
+
+    def get_ok(self, url, params):
+        """
+        Return the response of `get`, raising requests.HTTPError unless its
+        status is 200.
+        """
+        resp = self.get(url, params)
+        if resp.status_code != 200:
+            log.error("Request status code: {}".format(resp.status_code))
+            raise requests.HTTPError("{} answered {}".format(url, resp.status_code),
+                                     response = resp)
+        return resp
+
+    def counts(self, fromDate, toDate, bucket = 'minute'):
+        """
+        Request the number of tweets per `bucket` ('minute', 'hour' or 'day')
+        between 'fromDate' and 'toDate'. Returns the list of
+        {'timePeriod': 'YYYYMMDDHHMM', 'count': (int)} over all response pages.
+        """
+        params = {'query': query,
+                  'fromDate': fromDate, 'toDate': toDate,
+                  'bucket': bucket}
+        results = []
+        while True:
+            data = self.get_ok(self.count_url, params).json()
+            results.extend(data['results'])
+            if 'next' not in data:
+                return results
+            params['next'] = data['next']
+
+    def search(self, fromDate, toDate, next_ = 0):
+        """
+        Request one page of tweets posted between 'fromDate' and 'toDate'
+        ('YYYYMMDDHHMM'), following the 'next' token `next_` (0 for the
+        first page). Returns the response body as bytes, undecoded; raises
+        requests.HTTPError unless the request succeeded.
+        """
+        search_params = {'query': query,
+                         'fromDate': fromDate, 'toDate': toDate,
+                         'maxResults': self.page_size}
+        if next_ != 0:
+            search_params['next'] = next_
+        resp = self.get_ok(self.search_url, search_params)
+        log.info("Request successful")
+        return resp.content
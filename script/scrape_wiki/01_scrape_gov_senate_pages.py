@@ -17,6 +17,8 @@ import re
 import json
 sys.path.append(os.getcwd() + "/script/scrape_wiki")
 import us_states_list as us 
+sys.path.append(os.getcwd() + "/script")
+from manifest import Manifest
 
 
 # set argument parser
@@ -24,6 +26,15 @@ parser = argparse.ArgumentParser(description='Scrape wikipedia pages.')
 parser.add_argument("-datadir", type = str,
                     help = "Directory to store output of this file.",
                     default = "data/raw_wiki")
+parser.add_argument("-wikiurl", type = str,
+                    help = "Root of Wikipedia's pages, e.g. a local replay_server.py",
+                    default = "https://en.wikipedia.org")
+parser.add_argument("-manifest", type = str,
+                    help = "Manifest of built files; pages whose html did not change are not parsed again",
+                    default = "data/manifest.json")
+parser.add_argument("-force", 
+                    help = "Parse every page even if its html did not change",
+                    action = "store_true")
 parser.add_argument("-v", "--verbose", 
                     help = "Set logging level to DEBUG.",
                     action = "store_true")
@@ -41,7 +52,7 @@ log.addHandler(loghandler)
 # set global environments
 user_agent = "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_14_3) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/72.0.3626.109 Safari/537.36"
 wikipedia = MediaWiki(user_agent = user_agent)
-base_url = "https://en.wikipedia.org"
+base_url = args.wikiurl.rstrip("/")
 
 
 
@@ -240,6 +251,9 @@ if __name__ == "__main__":
     # Get current directory
     current_dir = os.getcwd()
     
+    # pages are always downloaded, but only parsed again if their html changed
+    manifest = Manifest(args.manifest, "01_scrape_gov_senate_pages",
+                        sources = [__file__], force = args.force)
     
     for office in ['governor', 'senate']:
         races = get_states(office)
@@ -248,11 +262,20 @@ if __name__ == "__main__":
             log.info(state)
             wikilink = get_state_link(state, office)
             wikipage = get_state_html(wikilink)
+            html_path = os.path.join(args.datadir, office, state + "-wikipage.html")
+            json_path = os.path.join(args.datadir, office, state + ".json")
+            if manifest.fresh(json_path, [html_path]):
+                with open(json_path) as j:
+                    OUT.update({state: json.load(j)})
+                continue
             OUT.update({state: parse_state_html(wikipage)})
+            manifest.record(json_path, [html_path])
         # save output to file 
         file = office + "_elections_2018.json"
         with open(os.path.join(args.datadir, office, file), "w") as j:
             json.dump(OUT, j)
+    manifest.save()
+    print(manifest.summary())
     
     sys.exit()
         
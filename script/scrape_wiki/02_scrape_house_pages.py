@@ -27,6 +27,9 @@ parser.add_argument('-rawdir', type = str,
                     default = "data/raw_wiki/house")
 parser.add_argument('-state', type = str, 
                     help = 'State for which the election data is required.')
+parser.add_argument('-wikiurl', type = str,
+                    help = "Root of Wikipedia's pages, e.g. a local replay_server.py",
+                    default = "https://en.wikipedia.org")
 parser.add_argument('-v','--verbose', 
                     help = "Set log level to debug", 
                     action="store_true")
@@ -46,7 +49,7 @@ log.addHandler(loghandler)
 # set global environments
 user_agent = "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_14_3) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/72.0.3626.109 Safari/537.36"
 wikipedia = MediaWiki(user_agent = user_agent)
-base_url = "https://en.wikipedia.org/"
+base_url = args.wikiurl.rstrip("/") + "/"
 states = ["Alabama","Alaska","Arizona","Arkansas","California","Colorado",
               "Connecticut","Delaware","Florida","Georgia","Hawaii","Idaho","Illinois",
               "Indiana","Iowa","Kansas","Kentucky","Louisiana","Maine","Maryland",
@@ -14,6 +14,8 @@ import re
 import pandas as pd
 sys.path.append('/Users/asako/Google Drive/pizza_to_the_polls/script/scrape_wiki')
 from us_states_list import states_dict 
+sys.path.append(os.getcwd() + "/script")
+from manifest import Manifest
 
 
 
@@ -30,6 +32,12 @@ parser.add_argument('-govdir', type = str,
 parser.add_argument('-csvdir', type = str,
                     help = 'Directory to store csv files.',
                     default = "data/csv")
+parser.add_argument('-manifest', type = str,
+                    help = 'Manifest of built files; csv files whose json did not change are not rebuilt',
+                    default = 'data/manifest.json')
+parser.add_argument('-force',
+                    help = 'Rebuild every csv file',
+                    action = "store_true")
 parser.add_argument('-v', '--verbose', 
                     help = 'Set logging level to DEBUG.',
                     action = "store_true")
@@ -221,17 +229,31 @@ def clean_house_df(df):
 
 if __name__ == "__main__":
     
-    
-    senate_df = create_df("senate", args.senatedir)
-    log.info(senate_df.info())
-    
-    guber_df = create_df("gubernatorial", args.govdir)
-    log.info(guber_df.info())
-    
-    house_df = create_house_df()
-    house_df = clean_house_df(house_df)
-    log.info(house_df.info())
-    
+    # each csv is rebuilt only if its json file or this script changed
+    manifest = Manifest(args.manifest, "03_convert_json_to_csv",
+                        sources = [__file__, "script/scrape_wiki/us_states_list.py"],
+                        force = args.force)
+    def paths(race, datadir):
+        return (os.path.join(datadir, race + "_elections_2018.json"),
+                os.path.join(args.csvdir, race + "_elections_2018.csv"))
+    
+    for race, datadir in [("senate", args.senatedir), ("gubernatorial", args.govdir)]:
+        json_path, csv_path = paths(race, datadir)
+        if manifest.fresh(csv_path, [json_path]):
+            continue
+        df = create_df(race, datadir)
+        log.info(df.info())
+        manifest.record(csv_path, [json_path])
+    
+    json_path, csv_path = paths("house", args.housedir)
+    if not manifest.fresh(csv_path, [json_path]):
+        house_df = create_house_df()
+        house_df = clean_house_df(house_df)
+        log.info(house_df.info())
+        manifest.record(csv_path, [json_path])
+    
+    manifest.save()
+    print(manifest.summary())
     sys.exit()
 
     
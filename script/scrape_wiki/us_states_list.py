@@ -19,3 +19,15 @@ states_abbv = ["AL", "AK", "AZ", "AR", "CA", "CO", "CT", "DC", "DE", "FL", "GA",
           "SD", "TN", "TX", "UT", "VT", "VA", "WA", "WV", "WI", "WY"]
 
 states_dict = dict(zip(states, states_abbv))
+
+# FIPS codes of the states (STATEFP of the Census shapefiles), in the order of states_abbv
+states_fips = ["01", "02", "04", "05", "06", "08", "09", "11", "10", "12", "13",
+          "15", "16", "17", "18", "19", "20", "21", "22", "23", "24",
+          "25", "26", "27", "28", "29", "30", "31", "32", "33", "34",
+          "35", "36", "37", "38", "39", "40", "41", "42", "44", "45",
+          "46", "47", "48", "49", "50", "51", "53", "54", "55", "56"]
+
+# territories, which have a non-voting delegate in the House
+territories_fips = {"60": "AS", "66": "GU", "69": "MP", "72": "PR", "78": "VI"}
+
+fips_dict = dict(zip(states_fips, states_abbv), **territories_fips)
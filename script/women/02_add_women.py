@@ -13,12 +13,20 @@ import os
 import pandas as pd
 import json
 import re
+sys.path.append(os.getcwd() + "/script")
+from manifest import Manifest
 
 # set argument parser
 parser = argparse.ArgumentParser(description='Get junior faculty for each school.')
 parser.add_argument("-csvdir", type = str,
                     help = "Directory storing csv files.",
                     default = "data/csv")
+parser.add_argument("-manifest", type = str,
+                    help = "Manifest of built files; nothing is rebuilt if no input or code changed",
+                    default = "data/manifest.json")
+parser.add_argument("-force", 
+                    help = "Rebuild even if up to date",
+                    action = "store_true")
 parser.add_argument("-v", "--verbose", 
                     help = "Set logging level to DEBUG.",
                     action = "store_true")
@@ -166,6 +174,17 @@ def split_df(df):
 
 if __name__ == "__main__":
     
+    # every merged csv depends on all inputs; rebuild only if one changed
+    file_names = [s + "_elections_2018_merged.csv" for s in ['gubernatorial', 'senate', 'house']]
+    outputs = [os.path.join(args.csvdir, file) for file in file_names]
+    inputs = [os.path.join(args.csvdir, s + "_elections_2018.csv") 
+              for s in ['gubernatorial', 'senate', 'house']]
+    inputs.append("data/cawp/women-candidate-2018.json")
+    manifest = Manifest(args.manifest, "02_add_women", sources = [__file__], 
+                        force = args.force)
+    if all([manifest.fresh(output, inputs) for output in outputs]):
+        print("{} are up to date".format(", ".join(file_names)))
+        sys.exit()
  
     women_df = create_df(convert_women())
     
@@ -175,11 +194,10 @@ if __name__ == "__main__":
     senate = pd.merge(senate_pre, s, on = 'state', how = 'left')
     house = pd.merge(house_pre, h, on = "district", how = "left")
     
-    
-    file_names = [s + "_elections_2018_merged.csv" for s in ['gubernatorial', 'senate', 'house']]
-    
-    for df, file in zip([governor, senate, house], file_names):
-            df.to_csv(os.path.join(args.csvdir, file))
+    for df, output in zip([governor, senate, house], outputs):
+            df.to_csv(output)
+            manifest.record(output, inputs)
+    manifest.save()
     
     
     log.info(governor.info())